@@ -1,20 +1,32 @@
+from typing import Dict, Optional, Tuple
+
 import pandas as pd
 
+from candle_map import export_candles, load_candles
 from database import Hdf5Client
 
-from utils import resample_timeframe, STRAT_PARAMS, get_library
+from utils import STRAT_PARAMS, STRAT_COLUMNS, get_library
 from strategies import obv, ichimoku, support_resistance
 
+# Python strategies: backtest(data, **params)
+PY_STRATEGIES = {"obv": obv, "ichimoku": ichimoku, "sup_res": support_resistance}
+
+# C++ strategies: prefix of the exported functions and the order of the execute_backtest arguments
+CPP_STRATEGIES = {
+    "sma": ("Sma", ["slow_ma", "fast_ma"]),
+    "psar": ("Psar", ["initial_acc", "acc_increment", "max_acc"]),
+    "atr": ("Atr", ["period", "atr_multiplier"]),
+    "gpsar": ("GradientPsar", ["initial_acc", "acc_increment", "max_acc", "gradient_threshold", "gradient_period"]),
+}
 
-def get_data(exchange: str, symbol: str, tf: str, from_time: int, to_time: int) -> pd.DataFrame:
-    h5_db = Hdf5Client(exchange)
-    data = h5_db.get_data(symbol, from_time, to_time)
-    data = resample_timeframe(data, tf)
-    return data
 
+def get_data(exchange: str, symbol: str, tf: str, from_time: int, to_time: int, columns=None) -> pd.DataFrame:
+    h5_db = Hdf5Client(exchange, mode="r")
+    data = h5_db.get_resampled(symbol, tf, from_time, to_time, columns=columns)
+    return data
 
-def run(exchange: str, symbol: str, strategy: str, tf: str, from_time: int, to_time: int ):
 
+def ask_params(strategy: str) -> Dict:
     params_des = STRAT_PARAMS[strategy]
     params = dict()
 
@@ -26,79 +38,134 @@ def run(exchange: str, symbol: str, strategy: str, tf: str, from_time: int, to_t
             except ValueError:
                 continue
 
-    if strategy == "obv":
-        data = get_data(exchange, symbol, tf, from_time, to_time)
-        pnl, max_drawdown, num_trades, sharpe_ratio, cagr = obv.backtest(data, ma_period=params["ma_period"])
-        return pnl, max_drawdown, num_trades, sharpe_ratio, cagr
-
-    if strategy == "ichimoku":
-        data = get_data(exchange, symbol, tf, from_time, to_time)
-        pnl, max_drawdown, num_trades, sharpe_ratio, cagr = ichimoku.backtest(data, tenkan_period=params["tenkan_period"], kijun_period=params["kijun_period"])
-        return pnl, max_drawdown, num_trades, sharpe_ratio, cagr
-
-    if strategy == "sup_res":
-        data = get_data(exchange, symbol, tf, from_time, to_time)
-        pnl, max_drawdown, num_trades, sharpe_ratio, cagr = support_resistance.backtest(data, min_points=params["min_points"],
-                                          min_diff_points=params["min_diff_points"],
-                                          rounding_nb=params["rounding_nb"],
-                                          take_profit=params["take_profit"],
-                                          stop_loss=params["stop_loss"])
-        return pnl, max_drawdown, num_trades, sharpe_ratio, cagr
-
-    if strategy == "sma":
-        lib = get_library()
-
-        obj = lib.Sma_new(exchange.encode(), symbol.encode(), tf.encode(), from_time, to_time)
-        lib.Sma_execute_backtest(obj, params["slow_ma"], params["fast_ma"])
-        pnl = lib.Sma_get_pnl(obj)
-        max_drawdown = lib.Sma_get_max_dd(obj)
-        num_trades = lib.Sma_get_num_trades(obj)
-        sharpe_ratio = lib.Sma_get_sharpe_ratio(obj)
-        cagr = lib.Sma_get_cagr(obj)
-
-        return  pnl, max_drawdown, num_trades, sharpe_ratio, cagr
-
-    if strategy == "psar":
-        lib = get_library()
-
-        obj = lib.Psar_new(exchange.encode(), symbol.encode(), tf.encode(), from_time, to_time)
-        lib.Psar_execute_backtest(obj, params["initial_acc"], params["acc_increment"], params["max_acc"])
-        pnl = lib.Psar_get_pnl(obj)
-        max_drawdown = lib.Psar_get_max_dd(obj)
-        num_trades = lib.Psar_get_num_trades(obj)
-        sharpe_ratio = lib.Psar_get_sharpe_ratio(obj)
-        cagr = lib.Psar_get_cagr(obj)
+    return params
+
+
+class BacktestSession:
+    """
+    Keeps everything a backtest loads for as long as the session lives: the HDF5 file of the exchange, the
+    resampled frames of the Python strategies, the C++ library and one C++ strategy object per
+    symbol/strategy/timeframe/period (which hold their own copy of the candles). Running the same backtest
+    again with other parameters only executes the strategy.
+
+    mapped: the candles are exported once to a file (see candle_map.py) and memory-mapped, by the DataFrames of
+    the Python strategies and by the C++ strategies alike, instead of being copied into every process. Parallel
+    sessions over the same candles then share a single copy of them.
+
+        with BacktestSession("binance") as session:
+            for ma_period in range(10, 100, 10):
+                pnl, max_dd, num_trades, sharpe_ratio, cagr = session.run("BTCUSDT", "obv", "1h", from_time,
+                                                                          to_time, {"ma_period": ma_period})
+    """
+
+    def __init__(self, exchange: str, mapped: bool = False):
+        self.exchange = exchange
+        self.mapped = mapped
+
+        self._h5_db: Optional[Hdf5Client] = None
+        self._lib = None
+        self._frames: Dict[Tuple, pd.DataFrame] = dict()
+        self._objects: Dict[Tuple, int] = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def h5_db(self) -> Hdf5Client:
+        if self._h5_db is None:
+            self._h5_db = Hdf5Client(self.exchange, mode="r")
+        return self._h5_db
+
+    @property
+    def lib(self):
+        if self._lib is None:
+            self._lib = get_library()
+        return self._lib
+
+    def get_data(self, symbol: str, tf: str, from_time: int, to_time: int, columns=None) -> pd.DataFrame:
+        key = (symbol, tf, from_time, to_time, tuple(columns) if columns is not None else None)
+
+        if key not in self._frames:
+            if self.mapped:
+                path = export_candles(self.h5_db, symbol, tf, from_time, to_time, columns=columns)
+                self._frames[key] = load_candles(path)
+            else:
+                self._frames[key] = self.h5_db.get_resampled(symbol, tf, from_time, to_time, columns=columns)
+
+        return self._frames[key]
+
+    def get_strategy(self, symbol: str, strategy: str, tf: str, from_time: int, to_time: int) -> int:
+        """
+        The C++ strategy object, created (and its candles loaded) on first use.
+        """
+        key = (symbol, strategy, tf, from_time, to_time)
+
+        if key not in self._objects:
+            prefix = CPP_STRATEGIES[strategy][0]
+            if self.mapped:
+                # Flat candles in the empty buckets and no last bucket, like the resampling of the C++ library
+                path = export_candles(self.h5_db, symbol, tf, from_time, to_time, empty_buckets="ffill",
+                                      drop_last=True)
+                self._objects[key] = getattr(self.lib, f"{prefix}_new_mapped")(path.encode())
+            else:
+                self._objects[key] = getattr(self.lib, f"{prefix}_new")(self.exchange.encode(), symbol.encode(),
+                                                                        tf.encode(), from_time, to_time)
+
+        return self._objects[key]
+
+    def run(self, symbol: str, strategy: str, tf: str, from_time: int, to_time: int,
+            params: Dict) -> Tuple[float, float, int, float, float]:
+        """
+        Returns pnl, max_drawdown, num_trades, sharpe_ratio, cagr. params holds every parameter of the
+        strategy listed in STRAT_PARAMS.
+        """
+        missing = [p for p in STRAT_PARAMS[strategy] if p not in params]
+        if missing:
+            raise ValueError(f"Missing parameters for {strategy}: {', '.join(missing)}")
+
+        if strategy in PY_STRATEGIES:
+            data = self.get_data(symbol, tf, from_time, to_time, columns=STRAT_COLUMNS[strategy])
+            return PY_STRATEGIES[strategy].backtest(data, **{p: params[p] for p in STRAT_PARAMS[strategy]})
+
+        prefix, args = CPP_STRATEGIES[strategy]
+        obj = self.get_strategy(symbol, strategy, tf, from_time, to_time)
+
+        getattr(self.lib, f"{prefix}_execute_backtest")(obj, *[params[p] for p in args])
+        pnl = getattr(self.lib, f"{prefix}_get_pnl")(obj)
+        max_drawdown = getattr(self.lib, f"{prefix}_get_max_dd")(obj)
+        num_trades = getattr(self.lib, f"{prefix}_get_num_trades")(obj)
+        sharpe_ratio = getattr(self.lib, f"{prefix}_get_sharpe_ratio")(obj)
+        cagr = getattr(self.lib, f"{prefix}_get_cagr")(obj)
 
         return pnl, max_drawdown, num_trades, sharpe_ratio, cagr
 
-    if strategy == "atr":
-        lib = get_library()
-
-        obj = lib.Atr_new(exchange.encode(), symbol.encode(), tf.encode(), from_time, to_time)
-        lib.Atr_execute_backtest(obj, params["period"], params["atr_multiplier"])
-        pnl = lib.Atr_get_pnl(obj)
-        max_drawdown = lib.Atr_get_max_dd(obj)
-        num_trades = lib.Atr_get_num_trades(obj)
-        sharpe_ratio = lib.Atr_get_sharpe_ratio(obj)
-        cagr = lib.Atr_get_cagr(obj)
-
-        # print(f"""period: {params["period"]} | atr_multiplier: {params["atr_multiplier"]}""")
-
-        return pnl, max_drawdown, num_trades, sharpe_ratio, cagr
-
-    if strategy == "gpsar":
-        lib = get_library()
-
-        obj = lib.GradientPsar_new(exchange.encode(), symbol.encode(), tf.encode(), from_time, to_time)
-        lib.GradientPsar_execute_backtest(obj, params["initial_acc"], params["acc_increment"], params["max_acc"], params["gradient_threshold"], params["gradient_period"])
-        pnl = lib.GradientPsar_get_pnl(obj)
-        max_drawdown = lib.GradientPsar_get_max_dd(obj)
-        num_trades = lib.GradientPsar_get_num_trades(obj)
-        sharpe_ratio = lib.GradientPsar_get_sharpe_ratio(obj)
-
-        print("About to get cagr")
-        cagr = lib.GradientPsar_get_cagr(obj)
-        print("Retruned from get cagr")
-        # cagr = 0.0
-
-        return pnl, max_drawdown, num_trades, sharpe_ratio, cagr
\ No newline at end of file
+    def close(self):
+        """
+        Drops the loaded frames and closes the HDF5 file. The C++ library has no destructors exported, its
+        strategy objects are only forgotten.
+        """
+        self._frames.clear()
+        self._objects.clear()
+
+        if self._h5_db is not None:
+            self._h5_db.hf.close()
+            self._h5_db = None
+
+
+def run(exchange: str, symbol: str, strategy: str, tf: str, from_time: int, to_time: int,
+        params: Optional[Dict] = None, session: Optional[BacktestSession] = None):
+    """
+    Single backtest. The parameters are asked on the command line unless given, pass a session to reuse what
+    earlier runs loaded.
+    """
+    if params is None:
+        params = ask_params(strategy)
+
+    if session is not None:
+        return session.run(symbol, strategy, tf, from_time, to_time, params)
+
+    with BacktestSession(exchange) as session:
+        return session.run(symbol, strategy, tf, from_time, to_time, params)
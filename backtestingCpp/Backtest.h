@@ -0,0 +1,59 @@
+#ifndef BACKTEST_H
+#define BACKTEST_H
+
+#include <algorithm>
+#include <atomic>
+#include <thread>
+#include <vector>
+
+// Results of one backtest, laid out like the BacktestMetrics ctypes structure of utils.py
+struct BacktestMetrics
+{
+    double pnl = 0.0;
+    double max_dd = 0.0;
+    int num_trades = 0;
+    double sharpe_ratio = 0.0;
+    double cagr = 0.0;
+};
+
+// Calls backtest_at(i) for every i in [0, count) on num_threads threads (one per core when num_threads <= 0).
+// The threads pick the next index as soon as they are done with theirs, and each result is written to its own
+// slot by backtest_at, so the output does not depend on the scheduling.
+template <typename F>
+void run_batch(int count, int num_threads, F backtest_at)
+{
+    if (num_threads <= 0)
+    {
+        num_threads = static_cast<int>(std::max(std::thread::hardware_concurrency(), 1u));
+    }
+    num_threads = std::min(num_threads, count);
+
+    std::atomic<int> next_index(0);
+    auto work = [&]()
+    {
+        for (int i = next_index++; i < count; i = next_index++)
+        {
+            backtest_at(i);
+        }
+    };
+
+    if (num_threads <= 1)
+    {
+        work();
+        return;
+    }
+
+    std::vector<std::thread> threads;
+    for (int t = 0; t < num_threads - 1; t++)
+    {
+        threads.emplace_back(work);
+    }
+    work();
+
+    for (std::thread &thread : threads)
+    {
+        thread.join();
+    }
+}
+
+#endif // BACKTEST_H
@@ -0,0 +1,117 @@
+#include "CandleMap.h"
+
+#include <cstdint>
+#include <cstring>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+using namespace std;
+
+// Layout written by candle_map.py, see HEADER there
+static const char CANDLE_MAP_MAGIC[8] = {'C', 'A', 'N', 'D', 'L', 'E', 'S', '1'};
+static const size_t HEADER_SIZE = 256;
+static const size_t COLUMN_NAMES_OFFSET = 80;
+static const size_t COLUMN_NAME_SIZE = 16;
+
+CandleMap::CandleMap(const string &path)
+{
+    int fd = ::open(path.c_str(), O_RDONLY);
+    if (fd < 0)
+    {
+        printf("Error while opening %s\n", path.c_str());
+        return;
+    }
+
+    struct stat file_stat;
+    if (fstat(fd, &file_stat) < 0 || static_cast<size_t>(file_stat.st_size) < HEADER_SIZE)
+    {
+        printf("%s is not a candle file\n", path.c_str());
+        ::close(fd);
+        return;
+    }
+
+    mapping_size = static_cast<size_t>(file_stat.st_size);
+    mapping = mmap(nullptr, mapping_size, PROT_READ, MAP_SHARED, fd, 0);
+    // The mapping stays valid once the descriptor is closed
+    ::close(fd);
+
+    if (mapping == MAP_FAILED)
+    {
+        printf("Error while mapping %s\n", path.c_str());
+        mapping = nullptr;
+        return;
+    }
+
+    const char *header = static_cast<const char *>(mapping);
+    int64_t num_columns = 0;
+    memcpy(&num_rows, header + 8, sizeof(int64_t));
+    memcpy(&num_columns, header + 16, sizeof(int64_t));
+    memcpy(&tf_ms, header + 24, sizeof(int64_t));
+
+    size_t expected_size = HEADER_SIZE + static_cast<size_t>((1 + num_columns) * num_rows) * sizeof(double);
+    if (memcmp(header, CANDLE_MAP_MAGIC, sizeof(CANDLE_MAP_MAGIC)) != 0 || num_columns > 8
+        || mapping_size < expected_size)
+    {
+        printf("%s is not a candle file\n", path.c_str());
+        num_rows = 0;
+        return;
+    }
+
+    for (int64_t i = 0; i < num_columns; ++i)
+    {
+        const char *name = header + COLUMN_NAMES_OFFSET + i * COLUMN_NAME_SIZE;
+        columns.push_back(string(name, strnlen(name, COLUMN_NAME_SIZE)));
+    }
+
+    values = reinterpret_cast<const double *>(header + HEADER_SIZE);
+
+    // Read sequentially by the backtests
+    madvise(mapping, mapping_size, MADV_SEQUENTIAL);
+
+    printf("Mapped %lld candles from %s\n", num_rows, path.c_str());
+}
+
+CandleMap::~CandleMap()
+{
+    if (mapping != nullptr)
+    {
+        munmap(mapping, mapping_size);
+    }
+}
+
+const double *CandleMap::column(const string &name) const
+{
+    if (!is_open())
+    {
+        return nullptr;
+    }
+
+    // Row 0 of the data block holds the timestamps
+    if (name == "timestamp")
+    {
+        return values;
+    }
+
+    for (size_t i = 0; i < columns.size(); ++i)
+    {
+        if (columns[i] == name)
+        {
+            return values + (i + 1) * num_rows;
+        }
+    }
+
+    return nullptr;
+}
+
+tuple<Series, Series, Series, Series, Series, Series> CandleMap::candles() const
+{
+    auto series = [this](const string &name) {
+        const double *data = column(name);
+        return data == nullptr ? Series() : Series(data, static_cast<size_t>(num_rows));
+    };
+
+    return make_tuple(series("timestamp"), series("open"), series("high"), series("low"), series("close"),
+                      series("volume"));
+}
@@ -0,0 +1,81 @@
+#ifndef CANDLE_MAP_H
+#define CANDLE_MAP_H
+
+#include <cstddef>
+#include <string>
+#include <tuple>
+#include <utility>
+#include <vector>
+
+// Column of candles used by the strategies: either owns its values (rearrange_candles output) or points into a
+// CandleMap, read with the same operators as the std::vector it stands for
+class Series
+{
+public:
+    Series() = default;
+    Series(std::vector<double> values) : owned(std::move(values)), values_ptr(owned.data()), length(owned.size()) {}
+    Series(const double *values, size_t size) : values_ptr(values), length(size), borrowed(true) {}
+
+    Series(const Series &other) { *this = other; }
+    Series &operator=(const Series &other)
+    {
+        owned = other.owned;
+        borrowed = other.borrowed;
+        values_ptr = borrowed ? other.values_ptr : owned.data();
+        length = other.length;
+        return *this;
+    }
+
+    Series(Series &&other) noexcept { *this = std::move(other); }
+    Series &operator=(Series &&other) noexcept
+    {
+        owned = std::move(other.owned);
+        borrowed = other.borrowed;
+        values_ptr = borrowed ? other.values_ptr : owned.data();
+        length = other.length;
+        return *this;
+    }
+
+    double operator[](size_t i) const { return values_ptr[i]; }
+    size_t size() const { return length; }
+    bool empty() const { return length == 0; }
+    double back() const { return values_ptr[length - 1]; }
+    const double *data() const { return values_ptr; }
+    const double *begin() const { return values_ptr; }
+    const double *end() const { return values_ptr + length; }
+
+private:
+    std::vector<double> owned;
+    const double *values_ptr = nullptr;
+    size_t length = 0;
+    bool borrowed = false;
+};
+
+// Read-only memory map of a candle file written by candle_map.py (export_candles). The pages are shared with
+// every other process mapping the same file, nothing is copied into the process.
+class CandleMap
+{
+public:
+    explicit CandleMap(const std::string &path);
+    ~CandleMap();
+
+    CandleMap(const CandleMap &) = delete;
+    CandleMap &operator=(const CandleMap &) = delete;
+
+    bool is_open() const { return values != nullptr; }
+    // nullptr when the file has no such column
+    const double *column(const std::string &name) const;
+    // ts, open, high, low, close, volume, in the order the strategies unpack rearrange_candles output
+    std::tuple<Series, Series, Series, Series, Series, Series> candles() const;
+
+    long long num_rows = 0;
+    long long tf_ms = 0;
+    std::vector<std::string> columns;
+
+private:
+    void *mapping = nullptr;
+    size_t mapping_size = 0;
+    const double *values = nullptr;
+};
+
+#endif // CANDLE_MAP_H
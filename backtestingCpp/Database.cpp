@@ -1,5 +1,6 @@
 #include "Database.h"
 
+#include <algorithm>
 #include <chrono>
 #include <cstdlib>
 #include <filesystem>
@@ -23,7 +24,9 @@ Database::Database(const string &file_name)
     status = H5Pset_fclose_degree(fapl, H5F_CLOSE_STRONG);
 
     printf("Opening %s\n", FILE_NAME.c_str());
-    h5_file = H5Fopen(FILE_NAME.c_str(), H5F_ACC_RDONLY, fapl);
+    // SWMR reader: shares the file with other readers and with a collector appending to it in SWMR mode
+    // (Hdf5Client.start_swmr), sees the rows written up to the time each dataset is opened
+    h5_file = H5Fopen(FILE_NAME.c_str(), H5F_ACC_RDONLY | H5F_ACC_SWMR_READ, fapl);
 
     if (h5_file < 0)
     {
@@ -140,11 +143,24 @@ std::vector<BacktestResult> Database::read_optimised_parameters(const std::strin
 // }
 
 // WIP
-double **Database::get_data(const string &symbol, const string &exchange, int &array_size)
+double **Database::get_data(const string &symbol, const string &exchange, int &array_size, const string &timeframe)
 {
     double **results = nullptr;
 
-    hid_t dataset = H5Dopen2(h5_file, symbol.c_str(), H5P_DEFAULT);
+    // Pre-aggregated candles kept by Hdf5Client next to the 1m data, fall back to 1m when missing
+    string path = symbol;
+    string timeframe_path = "timeframes/" + timeframe + "/" + symbol;
+
+    if (timeframe != "1m"
+        && H5Lexists(h5_file, "timeframes", H5P_DEFAULT) > 0
+        && H5Lexists(h5_file, ("timeframes/" + timeframe).c_str(), H5P_DEFAULT) > 0
+        && H5Lexists(h5_file, timeframe_path.c_str(), H5P_DEFAULT) > 0)
+    {
+        path = timeframe_path;
+    }
+
+    // Either a (N, 6|7) matrix dataset or, for the columnar layout, a group with one dataset per column
+    hid_t dataset = H5Oopen(h5_file, path.c_str(), H5P_DEFAULT);
     if (dataset < 0)
     {
         return results;
@@ -152,15 +168,33 @@ double **Database::get_data(const string &symbol, const string &exchange, int &a
 
     auto start_ts = chrono::high_resolution_clock::now();
 
-    hid_t dspace = H5Dget_space(dataset);
-    hsize_t dims[2];
-    H5Sget_simple_extent_dims(dspace, dims, NULL);
+    int num_columns = 0;
+    int max_rows = 0;
+    double *flat_data = nullptr;
 
-    int num_columns = static_cast<int>(dims[1]);
-    int max_rows = static_cast<int>(dims[0]);
+    if (H5Iget_type(dataset) == H5I_GROUP)
+    {
+        flat_data = read_columnar(dataset, max_rows, num_columns);
+    }
+    else
+    {
+        hid_t dspace = H5Dget_space(dataset);
+        hsize_t dims[2];
+        H5Sget_simple_extent_dims(dspace, dims, NULL);
+
+        num_columns = static_cast<int>(dims[1]);
+        max_rows = static_cast<int>(dims[0]);
+
+        // Reads the extent seen above, a SWMR writer may extend the dataset in the meantime
+        hid_t mem_space = H5Screate_simple(2, dims, NULL);
+        flat_data = new double[max_rows * num_columns];
+        H5Dread(dataset, H5T_NATIVE_DOUBLE, mem_space, dspace, H5P_DEFAULT, flat_data);
+        H5Sclose(mem_space);
+        H5Sclose(dspace);
+    }
 
-    double *flat_data = new double[max_rows * num_columns];
-    H5Dread(dataset, H5T_NATIVE_DOUBLE, H5S_ALL, H5S_ALL, H5P_DEFAULT, flat_data);
+    // Written by Hdf5Client when the rows are sorted by timestamp, unique and free of NaN
+    bool is_sorted = is_dataset_sorted(dataset);
 
     // Temporary array to hold valid rows
     double **temp_results = new double *[max_rows];
@@ -170,7 +204,7 @@ double **Database::get_data(const string &symbol, const string &exchange, int &a
     {
         bool has_nan = false;
 
-        for (int col = 0; col < num_columns; ++col)
+        for (int col = 0; col < num_columns && !is_sorted; ++col)
         {
             if (std::isnan(flat_data[row * num_columns + col]))
             {
@@ -202,19 +236,91 @@ double **Database::get_data(const string &symbol, const string &exchange, int &a
 
     array_size = valid_row_count;
 
-    qsort(results, array_size, sizeof(results[0]), compare);
+    if (!is_sorted)
+    {
+        qsort(results, array_size, sizeof(results[0]), compare);
+    }
 
-    H5Sclose(dspace);
-    H5Dclose(dataset);
+    H5Oclose(dataset);
 
     auto end_ts = chrono::high_resolution_clock::now();
     auto read_duration = chrono::duration_cast<chrono::milliseconds>(end_ts - start_ts);
 
-    printf("Fetched %i valid rows of %s %s data in %i ms\n", array_size, exchange.c_str(), symbol.c_str(), (int)read_duration.count());
+    printf("Fetched %i valid rows of %s %s data in %i ms\n", array_size, exchange.c_str(), path.c_str(), (int)read_duration.count());
 
     return results;
 }
 
+// Reads the columnar layout into the same row-major (N, columns) buffer as the matrix layout.
+// HDF5 converts the int64 timestamps and any float32 columns to double while reading.
+double *read_columnar(hid_t group, int &num_rows, int &num_columns)
+{
+    const char *column_names[] = {"timestamp", "open", "high", "low", "close", "volume", "spread"};
+
+    vector<hid_t> columns;
+    for (const char *name : column_names)
+    {
+        if (H5Lexists(group, name, H5P_DEFAULT) > 0)
+        {
+            columns.push_back(H5Dopen2(group, name, H5P_DEFAULT));
+        }
+    }
+
+    // A writer in SWMR mode extends the columns one after the other, only the rows present in all of them are read
+    hsize_t dims[1] = {0};
+    for (size_t col = 0; col < columns.size(); ++col)
+    {
+        hid_t dspace = H5Dget_space(columns[col]);
+        hsize_t column_dims[1];
+        H5Sget_simple_extent_dims(dspace, column_dims, NULL);
+        H5Sclose(dspace);
+
+        dims[0] = col == 0 ? column_dims[0] : min(dims[0], column_dims[0]);
+    }
+
+    num_rows = static_cast<int>(dims[0]);
+    num_columns = static_cast<int>(columns.size());
+
+    double *flat_data = new double[num_rows * num_columns];
+    vector<double> column_data(num_rows);
+
+    hid_t mem_space = H5Screate_simple(1, dims, NULL);
+    hsize_t offset[1] = {0};
+
+    for (int col = 0; col < num_columns; ++col)
+    {
+        hid_t file_space = H5Dget_space(columns[col]);
+        H5Sselect_hyperslab(file_space, H5S_SELECT_SET, offset, NULL, dims, NULL);
+        H5Dread(columns[col], H5T_NATIVE_DOUBLE, mem_space, file_space, H5P_DEFAULT, column_data.data());
+        H5Sclose(file_space);
+        H5Dclose(columns[col]);
+
+        for (int row = 0; row < num_rows; ++row)
+        {
+            flat_data[row * num_columns + col] = column_data[row];
+        }
+    }
+
+    H5Sclose(mem_space);
+
+    return flat_data;
+}
+
+bool is_dataset_sorted(hid_t dataset)
+{
+    if (H5Aexists(dataset, "sorted") <= 0)
+    {
+        return false;
+    }
+
+    int value = 0;
+    hid_t attr = H5Aopen(dataset, "sorted", H5P_DEFAULT);
+    herr_t status = H5Aread(attr, H5T_NATIVE_INT, &value);
+    H5Aclose(attr);
+
+    return status >= 0 && value != 0;
+}
+
 int compare(const void *pa, const void *pb)
 {
     const double *a = *(const double **)pa;
@@ -1,4 +1,5 @@
 #include <string>
+#include <vector>
 #include <hdf5.h>
 
 
@@ -24,7 +25,7 @@ class Database
 public:
     Database(const std::string &file_name);
     void close_file();
-    double **get_data(const std::string &symbol, const std::string &exchange, int &array_size);
+    double **get_data(const std::string &symbol, const std::string &exchange, int &array_size, const std::string &timeframe = "1m");
 
     hid_t h5_file;
 
@@ -33,4 +34,6 @@ public:
 
 };
 
+double *read_columnar(hid_t group, int &num_rows, int &num_columns);
+bool is_dataset_sorted(hid_t dataset);
 int compare(const void *pa, const void *pb);
@@ -4,58 +4,76 @@
 
 using namespace std;
 
-tuple<vector<double>, vector<double>, vector<double>, vector<double>, vector<double>, vector<double>>
-rearrange_candles(double **candles, string tf, long long from_time, long long to_time, int array_size)
+double timeframe_ms(const string &tf)
 {
-    vector<double> ts, open, high, low, close, volume;
-    double tf_ms;
-
     if (tf.find("m") != string::npos)
     {
         string minutes = tf.substr(0, tf.find("m"));
-        tf_ms = stod(minutes) * 60.0 * 1000.0;
+        return stod(minutes) * 60.0 * 1000.0;
     }
     else if (tf.find("h") != string::npos)
     {
         string hours = tf.substr(0, tf.find("h"));
-        tf_ms = stod(hours) * 60.0 * 60.0 * 1000.0;
+        return stod(hours) * 60.0 * 60.0 * 1000.0;
     }
     else if (tf.find("d") != string::npos)
     {
         string days = tf.substr(0, tf.find("d"));
-        tf_ms = stod(days) * 24.0 * 60.0 * 60.0 * 1000.0;
+        return stod(days) * 24.0 * 60.0 * 60.0 * 1000.0;
     }
-    else
+
+    return 0.0;
+}
+
+// The rows of a pre-aggregated timeframe are whole buckets: they give the same candles as the 1m rows only when
+// from_time opens a bucket and to_time is in the last minute of one, otherwise the edge buckets would hold 1m
+// candles from outside the range
+string stored_timeframe(const string &tf, long long from_time, long long to_time)
+{
+    long long tf_ms = static_cast<long long>(timeframe_ms(tf));
+
+    if (tf_ms <= 60000 || from_time % tf_ms != 0 || (to_time / 60000 + 1) * 60000 % tf_ms != 0)
+    {
+        return "1m";
+    }
+
+    return tf;
+}
+
+tuple<vector<double>, vector<double>, vector<double>, vector<double>, vector<double>, vector<double>>
+rearrange_candles(double **candles, string tf, long long from_time, long long to_time, int array_size)
+{
+    vector<double> ts, open, high, low, close, volume;
+    double tf_ms = timeframe_ms(tf);
+
+    if (tf_ms == 0.0)
     {
         printf("Parsing timeframe failed for %s\n", tf.c_str());
         return make_tuple(ts, open, high, low, close, volume);
     }
 
-    double current_ts = candles[0][0] - fmod(candles[0][0], tf_ms);
-    double current_o;
-    double current_h;
-    double current_l;
-    double current_c;
-    double current_v;
-    int total_missing_candles = 0;
+    // Start from the first candle inside the range so the first bucket is initialised from real data
+    int first = 0;
+    while (first < array_size && candles[first][0] < from_time)
+    {
+        first++;
+    }
 
-    for (int i = 1; i < array_size; i++)
+    if (first >= array_size)
     {
-        if (candles[i][0] < from_time)
-        {
-            continue;
-        }
-        else if (current_ts == 0.0)
-        {
-            current_ts = candles[i][0] - fmod(candles[0][0], tf_ms);
-            current_o = candles[i][1];
-            current_h = candles[i][2];
-            current_l = candles[i][3];
-            current_c = candles[i][4];
-            current_v = candles[i][5];
-//            TODO - add spread column
-        }
+        return make_tuple(ts, open, high, low, close, volume);
+    }
+
+    double current_ts = candles[first][0] - fmod(candles[first][0], tf_ms);
+    double current_o = candles[first][1];
+    double current_h = candles[first][2];
+    double current_l = candles[first][3];
+    double current_c = candles[first][4];
+    double current_v = candles[first][5];
+    int total_missing_candles = 0;
 
+    for (int i = first + 1; i < array_size; i++)
+    {
         if (candles[i][0] > to_time)
         {
             break;
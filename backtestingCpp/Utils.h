@@ -2,4 +2,8 @@
 #include <tuple>
 #include <vector>
 
+double timeframe_ms(const std::string &tf);
+// Timeframe to read from the file for a backtest on tf between from_time and to_time, see Utils.cpp
+std::string stored_timeframe(const std::string &tf, long long from_time, long long to_time);
+
 std::tuple<std::vector<double>, std::vector<double>, std::vector<double>, std::vector<double>, std::vector<double>, std::vector<double>> rearrange_candles(double **candles, std::string tf, long long from_time, long long to_time, int array_size);
\ No newline at end of file
@@ -19,12 +19,19 @@ Atr::Atr(char* exchange_c, char* symbol_c, char* timeframe_c, long long from_tim
 
     Database db(exchange);
     int array_size = 0;
-    double **res = db.get_data(symbol, exchange, array_size);
+    double **res = db.get_data(symbol, exchange, array_size, stored_timeframe(timeframe, from_time, to_time));
 
     std::tie(ts, open, high, low, close, volume) = rearrange_candles(res, timeframe, from_time, to_time, array_size);
 }
 
-double Atr::calculate_true_range(int i)
+// Candles exported by candle_map.py (export_candles with empty_buckets="ffill"), mapped rather than read from HDF5
+Atr::Atr(char *map_path)
+{
+    candle_map = make_shared<CandleMap>(map_path);
+    std::tie(ts, open, high, low, close, volume) = candle_map->candles();
+}
+
+double Atr::calculate_true_range(int i) const
 {
     if (i == 0) return high[i] - low[i];
 
@@ -35,7 +42,7 @@ double Atr::calculate_true_range(int i)
     return max({tr_1, tr_2, tr_3});
 }
 
-double Atr::calculate_atr(int end_index, int period)
+double Atr::calculate_atr(int end_index, int period) const
 {
     if (end_index < period - 1) return 0.0;
 
@@ -48,13 +55,13 @@ double Atr::calculate_atr(int end_index, int period)
     return sum_tr / period;
 }
 
-void Atr::execute_backtest(int period, double atr_multiplier)
+BacktestMetrics Atr::backtest(int period, double atr_multiplier) const
 {
     bool verbose = false;
     
-    pnl = 0.0;
-    max_dd = 0.0;
-    num_trades = 0;
+    double pnl = 0.0;
+    double max_dd = 0.0;
+    int num_trades = 0;
     std::vector<double> returns;
 
     double max_pnl = 0.0;
@@ -151,10 +158,22 @@ void Atr::execute_backtest(int period, double atr_multiplier)
 
     long long from_time = ts[0];
     long long to_time = ts.back();
-    sharpe_ratio = compute_sharpe_ratio(returns);
+    double sharpe_ratio = compute_sharpe_ratio(returns);
     // cagr = compute_cagr_from_percent(pnl, from_time, to_time);
-    cagr = compute_cagr_from_returns(returns, from_time, to_time, 10000.0);
+    double cagr = compute_cagr_from_returns(returns, from_time, to_time, 10000.0);
+
+    return {pnl, max_dd, num_trades, sharpe_ratio, cagr};
+}
+
+void Atr::execute_backtest(int period, double atr_multiplier)
+{
+    BacktestMetrics result = backtest(period, atr_multiplier);
 
+    pnl = result.pnl;
+    max_dd = result.max_dd;
+    num_trades = result.num_trades;
+    sharpe_ratio = result.sharpe_ratio;
+    cagr = result.cagr;
 }
 
 extern "C"
@@ -164,11 +183,28 @@ extern "C"
         return new Atr(exchange, symbol, timeframe, from_time, to_time);
     }
 
+    Atr *Atr_new_mapped(char *map_path)
+    {
+        return new Atr(map_path);
+    }
+
     void Atr_execute_backtest(Atr *atr, int period, double atr_multiplier)
     {
         return atr->execute_backtest(period, atr_multiplier);
     }
 
+    // params: num_params parameter sets of 2 values, in the order of execute_backtest. The backtests run on
+    // num_threads threads (one per core when <= 0) sharing the candles of the object, results[i] is filled with
+    // the results of the i-th set
+    void Atr_execute_batch(Atr *atr, double *params, int num_params, BacktestMetrics *results, int num_threads)
+    {
+        run_batch(num_params, num_threads, [&](int i)
+        {
+            const double *p = params + 2 * i;
+            results[i] = atr->backtest(static_cast<int>(p[0]), p[1]);
+        });
+    }
+
     double Atr_get_pnl(Atr *atr) { return atr->pnl; }
     double Atr_get_max_dd(Atr *atr) { return atr->max_dd; }
     int Atr_get_num_trades(Atr *atr) { return atr->num_trades; }
@@ -1,18 +1,27 @@
+#include <memory>
 #include <string>
 #include <vector>
 
+#include "../Backtest.h"
+#include "../CandleMap.h"
+
 
 class Atr
 {
     public:
         Atr(char* exchange_c, char* symbol_c, char* timeframe_c, long long from_time, long long to_time);
+        Atr(char* map_path);
         void execute_backtest(int period, double atr_multiplier);
+        // Reentrant: only reads the candles, several threads can run it on the same object
+        BacktestMetrics backtest(int period, double atr_multiplier) const;
 
         std::string exchange;
         std::string symbol;
         std::string timeframe;
 
-        std::vector<double> ts, open, high, low, close, volume, spread;
+        Series ts, open, high, low, close, volume, spread;
+        // Keeps the candles mapped for the lifetime of a strategy built from an exported file
+        std::shared_ptr<CandleMap> candle_map;
         // std::vector<double> ts, open, high, low, close, volume;
 
         double pnl = 0.0;
@@ -22,6 +31,6 @@ class Atr
         double cagr = 0.0;
     
     private:
-        double calculate_true_range(int i);
-        double calculate_atr(int i, int period);
+        double calculate_true_range(int i) const;
+        double calculate_atr(int i, int period) const;
 };
\ No newline at end of file
@@ -26,17 +26,24 @@ GradientPsar::GradientPsar(char *exchange_c, char *symbol_c, char *timeframe_c,
 
     Database db(exchange);
     int array_size = 0;
-    double **res = db.get_data(symbol, exchange, array_size);
+    double **res = db.get_data(symbol, exchange, array_size, stored_timeframe(timeframe, from_time, to_time));
     db.close_file();
 
     std::tie(ts, open, high, low, close, volume) = rearrange_candles(res, timeframe, from_time, to_time, array_size);
 }
 
-void GradientPsar::execute_backtest(double initial_acc, double acc_increment, double max_acc, double gradient_threshold, int gradient_period)
+// Candles exported by candle_map.py (export_candles with empty_buckets="ffill"), mapped rather than read from HDF5
+GradientPsar::GradientPsar(char *map_path)
+{
+    candle_map = make_shared<CandleMap>(map_path);
+    std::tie(ts, open, high, low, close, volume) = candle_map->candles();
+}
+
+BacktestMetrics GradientPsar::backtest(double initial_acc, double acc_increment, double max_acc, double gradient_threshold, int gradient_period) const
 {
-    pnl = 0.0;
-    max_dd = 0.0;
-    num_trades = 0;
+    double pnl = 0.0;
+    double max_dd = 0.0;
+    int num_trades = 0;
     std::vector<double> returns;
 
     double max_pnl = 0.0;
@@ -161,12 +168,24 @@ void GradientPsar::execute_backtest(double initial_acc, double acc_increment, do
 
     long long from_time = ts[0];
     long long to_time = ts.back();
-    sharpe_ratio = compute_sharpe_ratio(returns);
+    double sharpe_ratio = compute_sharpe_ratio(returns);
     // cagr = compute_cagr_from_percent(pnl, from_time, to_time);
-    cagr = compute_cagr_from_returns(returns, from_time, to_time, 10000.0);
+    double cagr = compute_cagr_from_returns(returns, from_time, to_time, 10000.0);
     double years = compute_years_from_ms(from_time, to_time);
     // printf("Sharpe: %f | CAGR: %f | %lld -> %lld Years: %f\n", sharpe_ratio, cagr, from_time, to_time, years);
 
+    return {pnl, max_dd, num_trades, sharpe_ratio, cagr};
+}
+
+void GradientPsar::execute_backtest(double initial_acc, double acc_increment, double max_acc, double gradient_threshold, int gradient_period)
+{
+    BacktestMetrics result = backtest(initial_acc, acc_increment, max_acc, gradient_threshold, gradient_period);
+
+    pnl = result.pnl;
+    max_dd = result.max_dd;
+    num_trades = result.num_trades;
+    sharpe_ratio = result.sharpe_ratio;
+    cagr = result.cagr;
 }
 
 extern "C"
@@ -176,11 +195,28 @@ extern "C"
         return new GradientPsar(exchange, symbol, timeframe, from_time, to_time);
     }
 
+    GradientPsar *GradientPsar_new_mapped(char *map_path)
+    {
+        return new GradientPsar(map_path);
+    }
+
     void GradientPsar_execute_backtest(GradientPsar *gradient_psar, double initial_acc, double acc_increment, double max_acc, double gradient_threshold, int gradient_period)
     {
         return gradient_psar->execute_backtest(initial_acc, acc_increment, max_acc, gradient_threshold, gradient_period);
     }
 
+    // params: num_params parameter sets of 5 values, in the order of execute_backtest. The backtests run on
+    // num_threads threads (one per core when <= 0) sharing the candles of the object, results[i] is filled with
+    // the results of the i-th set
+    void GradientPsar_execute_batch(GradientPsar *gradient_psar, double *params, int num_params, BacktestMetrics *results, int num_threads)
+    {
+        run_batch(num_params, num_threads, [&](int i)
+        {
+            const double *p = params + 5 * i;
+            results[i] = gradient_psar->backtest(p[0], p[1], p[2], p[3], static_cast<int>(p[4]));
+        });
+    }
+
     double GradientPsar_get_pnl(GradientPsar *gradient_psar) { return gradient_psar->pnl; }
     double GradientPsar_get_max_dd(GradientPsar *gradient_psar) { return gradient_psar->max_dd; }
     int GradientPsar_get_num_trades(GradientPsar *gradient_psar) { return gradient_psar->num_trades; }
@@ -13,17 +13,24 @@ Psar::Psar(char *exchange_c, char *symbol_c, char *timeframe_c, long long from_t
 
     Database db(exchange);
     int array_size = 0;
-    double **res = db.get_data(symbol, exchange, array_size);
+    double **res = db.get_data(symbol, exchange, array_size, stored_timeframe(timeframe, from_time, to_time));
     db.close_file();
 
     std::tie(ts, open, high, low, close, volume) = rearrange_candles(res, timeframe, from_time, to_time, array_size);
 }
 
-void Psar::execute_backtest(double initial_acc, double acc_increment, double max_acc)
+// Candles exported by candle_map.py (export_candles with empty_buckets="ffill"), mapped rather than read from HDF5
+Psar::Psar(char *map_path)
 {
-    pnl = 0.0;
-    max_dd = 0.0;
-    num_trades = 0;
+    candle_map = make_shared<CandleMap>(map_path);
+    std::tie(ts, open, high, low, close, volume) = candle_map->candles();
+}
+
+BacktestMetrics Psar::backtest(double initial_acc, double acc_increment, double max_acc) const
+{
+    double pnl = 0.0;
+    double max_dd = 0.0;
+    int num_trades = 0;
     std::vector<double> returns;
 
     double max_pnl = 0.0;
@@ -135,11 +142,24 @@ void Psar::execute_backtest(double initial_acc, double acc_increment, double max
 
     long long from_time = ts[0];
     long long to_time = ts.back();
-    sharpe_ratio = compute_sharpe_ratio(returns);
+    double sharpe_ratio = compute_sharpe_ratio(returns);
     // cagr = compute_cagr_from_percent(pnl, from_time, to_time);
-    cagr = compute_cagr_from_returns(returns, from_time, to_time, 10000.0);
+    double cagr = compute_cagr_from_returns(returns, from_time, to_time, 10000.0);
     
     // printf("Sharpe: %f | CAGR: %f | %lld -> %lld Years: %f\n", sharpe_ratio, cagr, from_time, to_time, years);
+
+    return {pnl, max_dd, num_trades, sharpe_ratio, cagr};
+}
+
+void Psar::execute_backtest(double initial_acc, double acc_increment, double max_acc)
+{
+    BacktestMetrics result = backtest(initial_acc, acc_increment, max_acc);
+
+    pnl = result.pnl;
+    max_dd = result.max_dd;
+    num_trades = result.num_trades;
+    sharpe_ratio = result.sharpe_ratio;
+    cagr = result.cagr;
 }
 
 extern "C"
@@ -149,11 +169,28 @@ extern "C"
         return new Psar(exchange, symbol, timeframe, from_time, to_time);
     }
 
+    Psar *Psar_new_mapped(char *map_path)
+    {
+        return new Psar(map_path);
+    }
+
     void Psar_execute_backtest(Psar *psar, double initial_acc, double acc_increment, double max_acc)
     {
         return psar->execute_backtest(initial_acc, acc_increment, max_acc);
     }
 
+    // params: num_params parameter sets of 3 values, in the order of execute_backtest. The backtests run on
+    // num_threads threads (one per core when <= 0) sharing the candles of the object, results[i] is filled with
+    // the results of the i-th set
+    void Psar_execute_batch(Psar *psar, double *params, int num_params, BacktestMetrics *results, int num_threads)
+    {
+        run_batch(num_params, num_threads, [&](int i)
+        {
+            const double *p = params + 3 * i;
+            results[i] = psar->backtest(p[0], p[1], p[2]);
+        });
+    }
+
     double Psar_get_pnl(Psar *psar) { return psar->pnl; }
     double Psar_get_max_dd(Psar *psar) { return psar->max_dd; }
     int Psar_get_num_trades(Psar *psar) { return psar->num_trades; }
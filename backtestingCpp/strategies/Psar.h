@@ -1,18 +1,27 @@
+#include <memory>
 #include <string>
 #include <vector>
 
+#include "../Backtest.h"
+#include "../CandleMap.h"
+
 
 class Psar
 {
     public:
         Psar(char* exchange_c, char* symbol_c, char* timeframe_c, long long from_time, long long to_time);
+        Psar(char* map_path);
         void execute_backtest(double initial_acc, double acc_increment, double max_acc);
+        // Reentrant: only reads the candles, several threads can run it on the same object
+        BacktestMetrics backtest(double initial_acc, double acc_increment, double max_acc) const;
 
         std::string exchange;
         std::string symbol;
         std::string timeframe;
 
-        std::vector<double> ts, open, high, low, close, volume, spread;
+        Series ts, open, high, low, close, volume, spread;
+        // Keeps the candles mapped for the lifetime of a strategy built from an exported file
+        std::shared_ptr<CandleMap> candle_map;
         // std::vector<double> ts, open, high, low, close, volume;
 
         double pnl = 0.0;
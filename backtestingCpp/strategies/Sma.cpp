@@ -16,17 +16,24 @@ Sma::Sma(char *exchange_c, char *symbol_c, char *timeframe_c, long long from_tim
 
     Database db(exchange);
     int array_size = 0;
-    double **res = db.get_data(symbol, exchange, array_size);
+    double **res = db.get_data(symbol, exchange, array_size, stored_timeframe(timeframe, from_time, to_time));
     db.close_file();
 
     std::tie(ts, open, high, low, close, volume) = rearrange_candles(res, timeframe, from_time, to_time, array_size);
 }
 
-void Sma::execute_backtest(int slow_ma, int fast_ma)
+// Candles exported by candle_map.py (export_candles with empty_buckets="ffill"), mapped rather than read from HDF5
+Sma::Sma(char *map_path)
 {
-    pnl = 0.0;
-    max_dd = 0.0;
-    num_trades = 0;
+    candle_map = make_shared<CandleMap>(map_path);
+    std::tie(ts, open, high, low, close, volume) = candle_map->candles();
+}
+
+BacktestMetrics Sma::backtest(int slow_ma, int fast_ma) const
+{
+    double pnl = 0.0;
+    double max_dd = 0.0;
+    int num_trades = 0;
     std::vector<double> returns;
 
     double max_pnl = 0.0;
@@ -99,9 +106,22 @@ void Sma::execute_backtest(int slow_ma, int fast_ma)
 
     long long from_time = ts[0];
     long long to_time = ts.back();
-    sharpe_ratio = compute_sharpe_ratio(returns);
+    double sharpe_ratio = compute_sharpe_ratio(returns);
     // cagr = compute_cagr_from_percent(pnl, from_time, to_time);
-    cagr = compute_cagr_from_returns(returns, from_time, to_time, 10000.0);
+    double cagr = compute_cagr_from_returns(returns, from_time, to_time, 10000.0);
+
+    return {pnl, max_dd, num_trades, sharpe_ratio, cagr};
+}
+
+void Sma::execute_backtest(int slow_ma, int fast_ma)
+{
+    BacktestMetrics result = backtest(slow_ma, fast_ma);
+
+    pnl = result.pnl;
+    max_dd = result.max_dd;
+    num_trades = result.num_trades;
+    sharpe_ratio = result.sharpe_ratio;
+    cagr = result.cagr;
 }
 
 extern "C"
@@ -111,11 +131,28 @@ extern "C"
         return new Sma(exchange, symbol, timeframe, from_time, to_time);
     }
 
+    Sma *Sma_new_mapped(char *map_path)
+    {
+        return new Sma(map_path);
+    }
+
     void Sma_execute_backtest(Sma *sma, int slow_ma, int fast_ma)
     {
         return sma->execute_backtest(slow_ma, fast_ma);
     }
 
+    // params: num_params parameter sets of 2 values, in the order of execute_backtest. The backtests run on
+    // num_threads threads (one per core when <= 0) sharing the candles of the object, results[i] is filled with
+    // the results of the i-th set
+    void Sma_execute_batch(Sma *sma, double *params, int num_params, BacktestMetrics *results, int num_threads)
+    {
+        run_batch(num_params, num_threads, [&](int i)
+        {
+            const double *p = params + 2 * i;
+            results[i] = sma->backtest(static_cast<int>(p[0]), static_cast<int>(p[1]));
+        });
+    }
+
     double Sma_get_pnl(Sma *sma) { return sma->pnl; }
     double Sma_get_max_dd(Sma *sma) { return sma->max_dd; }
     int Sma_get_num_trades(Sma *sma) { return sma->num_trades; }
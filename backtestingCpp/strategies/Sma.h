@@ -1,17 +1,26 @@
+#include <memory>
 #include <string>
 #include <vector>
 
+#include "../Backtest.h"
+#include "../CandleMap.h"
+
 
 class Sma {
     public:
         Sma(char* exchange_c, char* symbol_c, char* timeframe_c, long long from_time, long long to_time);
+        Sma(char* map_path);
         void execute_backtest(int slow_ma, int fast_ma);
+        // Reentrant: only reads the candles, several threads can run it on the same object
+        BacktestMetrics backtest(int slow_ma, int fast_ma) const;
 
         std::string exchange;
         std::string symbol;
         std::string timeframe;
 
-        std::vector<double> ts, open, high, low, close, volume, spread;
+        Series ts, open, high, low, close, volume, spread;
+        // Keeps the candles mapped for the lifetime of a strategy built from an exported file
+        std::shared_ptr<CandleMap> candle_map;
         // std::vector<double> ts, open, high, low, close, volume;
 
         double pnl = 0.0;
@@ -0,0 +1,150 @@
+"""
+Gap backfill benchmark for DataCollector.backfill against the local replay server (see replay_server.py).
+
+Builds synthetic source files for both exchanges, copies them into the target files with holes punched in every
+symbol, then backfills the holes twice:
+  - with a server failing every request, which drives the clients through their retry limit: the holes have to
+    stay GAP_MISSING in the gap index and be reported as failed windows, not be marked empty;
+  - with a healthy server, reporting rows/s and requests and checking that the target ends up identical to the
+    source.
+The clients' retry delays are shortened so the failing run doesn't wait for minutes.
+
+Usage: python benchmarks/bench_backfill.py [--days 30] [--symbols 4] [--holes 20] [--latency 0.0]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import exchanges.binance
+import exchanges.oanda
+from bench_collector import make_source
+from database import Hdf5Client
+from data_service import DataCollector
+from exchanges.binance import BinanceClient
+from exchanges.oanda import OandaClient
+from gaps import GAP_MISSING, GAP_EMPTY
+from pipeline import failed_windows
+from rate_limiter import TokenBucket
+from replay_server import ReplayServer
+
+logging.disable(logging.CRITICAL)
+
+
+def make_target(exchange: str, source: str, num_holes: int, hole_minutes: int, seed: int):
+    rng = np.random.default_rng(seed)
+    source_db = Hdf5Client(source)
+    target_db = Hdf5Client(exchange)
+
+    for symbol in source_db._symbols():
+        data = source_db.hf[symbol][:]
+        keep = np.ones(data.shape[0], dtype=bool)
+        for start in rng.integers(1, data.shape[0] - hole_minutes - 1, num_holes):
+            keep[start:start + hole_minutes] = False
+
+        target_db.create_dataset(symbol, data.shape[1])
+        target_db.write_data(symbol, data[keep])
+
+    source_db.hf.close()
+    target_db.hf.close()
+
+
+def make_collector(exchange: str, server: ReplayServer) -> DataCollector:
+    if exchange == "binance":
+        client = BinanceClient(base_url=server.url)
+    else:
+        client = OandaClient(api_url=server.url)
+    client.rate_limiter = TokenBucket(1e9, 1e9)
+
+    return DataCollector(exchange, client=client)
+
+
+def backfill_failing(exchange: str, server: ReplayServer) -> bool:
+    collector = make_collector(exchange, server)
+    server.error_rate = 1.0
+
+    kept_missing = True
+    for symbol in collector.client.symbols:
+        missing = collector.h5_db.scan_gaps(symbol)
+        missing = missing[missing[:, 2] == GAP_MISSING]
+
+        metrics = collector.backfill(symbol)
+        gaps = collector.h5_db.get_gaps(symbol)
+
+        kept_missing &= (len(failed_windows(metrics)) > 0 and not (gaps[:, 2] == GAP_EMPTY).any()
+                         and np.array_equal(gaps[gaps[:, 2] == GAP_MISSING], missing))
+
+    collector.h5_db.hf.close()
+    server.error_rate = 0.0
+
+    return kept_missing
+
+
+def backfill_healthy(exchange: str, source: str, server: ReplayServer):
+    collector = make_collector(exchange, server)
+    server.reset_counters()
+
+    start = time.perf_counter()
+    rows = 0
+    for symbol in collector.client.symbols:
+        metrics = collector.backfill(symbol)
+        rows += metrics["write"].rows if metrics is not None else 0
+    elapsed = time.perf_counter() - start
+
+    source_db = Hdf5Client(source, mode="r")
+    identical = all(np.array_equal(source_db.hf[s][:], collector.h5_db.hf[s][:]) for s in collector.client.symbols)
+    source_db.hf.close()
+    collector.h5_db.hf.close()
+
+    return rows, elapsed, server.requests, identical
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--symbols", type=int, default=4)
+    parser.add_argument("--holes", type=int, default=20)
+    parser.add_argument("--hole-minutes", type=int, default=600)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    exchanges.binance.BACKOFF_BASE = 0.001
+    exchanges.oanda.RETRY_DELAY = 0.001
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.mkdir("data")
+
+        make_source("replay_binance", args.symbols, args.days)
+        make_source("replay_oanda", args.symbols, args.days)
+
+        server = ReplayServer(binance="replay_binance", oanda="replay_oanda", latency=args.latency)
+        server.start()
+
+        print(f"{args.symbols} symbols x {args.days} days, {args.holes} holes of {args.hole_minutes} minutes per "
+              f"symbol\n")
+        print(f"{'exchange':<8} | {'failing: kept missing':>21} | {'rows':>9} | {'time':>8} | {'rows/s':>10} | "
+              f"{'requests':>8} | identical")
+
+        for i, exchange in enumerate(["binance", "oanda"]):
+            source = f"replay_{exchange}"
+            make_target(exchange, source, args.holes, args.hole_minutes, seed=i)
+
+            kept_missing = backfill_failing(exchange, server)
+            rows, elapsed, requests, identical = backfill_healthy(exchange, source, server)
+
+            print(f"{exchange:<8} | {str(kept_missing):>21} | {rows:>9,} | {elapsed:>7.2f}s | "
+                  f"{rows / elapsed if elapsed else 0:>10,.0f} | {requests:>8} | {identical}")
+
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+HTTP benchmark for BinanceClient against a local stand-in for the Binance REST API.
+
+The stand-in serves exchangeInfo and 1m klines pages over keep-alive HTTP/1.1 and reports the used weight in
+X-MBX-USED-WEIGHT-1M like Binance does. Three runs:
+- one connection per request (requests.get, the previous behaviour)
+- the client's pooled session
+- the pooled session with the server answering 429 + Retry-After every RATE_LIMIT_EVERY requests, to check that
+  the client backs off and every page still arrives
+
+Connections to localhost skip the TLS handshake, so the gap with api.binance.com is larger than measured here.
+
+Usage: python benchmarks/bench_binance_session.py
+"""
+import os
+import sys
+import json
+import threading
+import time
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from exchanges.binance import BinanceClient
+from rate_limiter import TokenBucket
+
+logging.disable(logging.WARNING)
+
+MINUTE_MS = 60_000
+NUM_REQUESTS = 300
+PAGE_ROWS = 1000
+RATE_LIMIT_EVERY = 50
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests_served = 0
+    rate_limit_every = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            StandInHandler.requests_served += 1
+            count = StandInHandler.requests_served
+
+        if self.rate_limit_every and count % self.rate_limit_every == 0:
+            self._send(429, {"code": -1003, "msg": "Too many requests"}, {"Retry-After": "0.2"})
+        elif "exchangeInfo" in self.path:
+            self._send(200, {"symbols": [{"symbol": "BTCUSDT"}]})
+        else:
+            start = 1_600_000_000_000
+            self._send(200, [[start + i * MINUTE_MS, "1.0", "1.1", "0.9", "1.05", "12.5", start + i * MINUTE_MS + 59_999]
+                             for i in range(PAGE_ROWS)])
+
+    def _send(self, status: int, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("X-MBX-USED-WEIGHT-1M", str(2 * self.requests_served % 6000))
+        for key, value in (headers or dict()).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    params = {"symbol": "BTCUSDT", "interval": "1m", "limit": PAGE_ROWS}
+
+    start = time.perf_counter()
+    for _ in range(NUM_REQUESTS):
+        requests.get(base_url + "/api/v3/klines", params=params).json()
+    per_request = (time.perf_counter() - start) / NUM_REQUESTS * 1000
+    print(f"requests.get per call   : {per_request:6.2f} ms/request")
+
+    client = BinanceClient(base_url=base_url)
+    # Not measuring the production rate budget here
+    client.rate_limiter = TokenBucket(1e9, 1e9)
+
+    start = time.perf_counter()
+    for _ in range(NUM_REQUESTS):
+        client._make_request("/api/v3/klines", params)
+    per_request = (time.perf_counter() - start) / NUM_REQUESTS * 1000
+    print(f"pooled session          : {per_request:6.2f} ms/request")
+
+    StandInHandler.rate_limit_every = RATE_LIMIT_EVERY
+    StandInHandler.requests_served = 0
+    start = time.perf_counter()
+    pages = sum(client._make_request("/api/v3/klines", params) is not None for _ in range(NUM_REQUESTS))
+    elapsed = time.perf_counter() - start
+    print(f"pooled session with 429 : {elapsed / NUM_REQUESTS * 1000:6.2f} ms/request, {pages}/{NUM_REQUESTS} pages, "
+          f"{StandInHandler.requests_served - NUM_REQUESTS} retries, last used weight {client.used_weight}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
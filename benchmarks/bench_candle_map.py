@@ -0,0 +1,158 @@
+"""
+Memory benchmark for the memory-mapped candle exports (candle_map.py).
+
+Builds a synthetic 1m candle file in a temporary directory, then starts N worker processes that each hold the
+1m candles of the whole file, first loaded privately with Hdf5Client.get_resampled, then mapped with
+load_candles. Every worker reads all the values and reports its proportional set size (PSS, Linux only):
+pages shared by k processes count 1/k towards each of them, so the sum over the workers is the memory the
+candles actually take.
+
+With --results, also runs the C++ strategies of BacktestSession on candles with holes in them, once loaded by
+the library itself and once mapped, over ranges on and off the bucket boundaries, and checks that both give the
+same results. Needs the C++ library built in backtestingCpp/build.
+
+Usage: python benchmarks/bench_candle_map.py [--rows 5000000] [--workers 10] [--results]
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from backtester import BacktestSession, CPP_STRATEGIES
+from candle_map import export_candles, load_candles
+from database import Hdf5Client
+
+logging.disable(logging.INFO)
+
+MINUTE_MS = 60_000
+
+CPP_PARAMS = {
+    "sma": {"slow_ma": 30, "fast_ma": 8},
+    "psar": {"initial_acc": 0.02, "acc_increment": 0.02, "max_acc": 0.2},
+    "atr": {"period": 14, "atr_multiplier": 2.0},
+    "gpsar": {"initial_acc": 0.02, "acc_increment": 0.02, "max_acc": 0.2, "gradient_threshold": 100,
+              "gradient_period": 3},
+}
+
+
+def make_candles(num_rows: int, start_ms: int = 1_577_836_800_000) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    ts = start_ms + np.arange(num_rows, dtype=np.float64) * MINUTE_MS
+    close = 100 + np.cumsum(rng.normal(0, 0.1, num_rows))
+    return np.column_stack([ts, close, close + 0.05, close - 0.05, close, rng.integers(1, 100, num_rows)])
+
+
+def pss_mb() -> float:
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def worker(mode: str, path: str, start, results):
+    before = pss_mb()
+
+    if mode == "private":
+        df = Hdf5Client("bench", mode="r").get_resampled("SYM", "1m", 0, 2 ** 62, cache=False)
+    else:
+        df = load_candles(path)
+
+    # Touch every value, as a backtest would
+    checksum = float(np.nansum(df.to_numpy()))
+
+    # Measured once every worker holds its candles
+    start.wait()
+    results.put((pss_mb() - before, checksum))
+    start.wait()
+
+
+def run(mode: str, path: str, num_workers: int):
+    context = multiprocessing.get_context("fork")
+    start = context.Barrier(num_workers + 1)
+    results = context.Queue()
+    workers = [context.Process(target=worker, args=(mode, path, start, results)) for _ in range(num_workers)]
+
+    t = time.perf_counter()
+    for w in workers:
+        w.start()
+    start.wait()
+    elapsed = time.perf_counter() - t
+    measures = [results.get() for _ in workers]
+    start.wait()
+    for w in workers:
+        w.join()
+
+    pss = [m[0] for m in measures]
+    print(f"{mode:<8} | {num_workers:>7} | {sum(pss):>13,.0f} | {max(pss):>13,.0f} | {elapsed:>7.2f}s")
+
+
+def compare_results(num_rows: int):
+    candles = make_candles(num_rows)
+    keep = np.random.default_rng(1).random(num_rows) > 0.03
+    keep[num_rows // 4:num_rows // 4 + 600] = False
+
+    h5_db = Hdf5Client("results")
+    h5_db.create_dataset("SYM", 6)
+    h5_db.write_data("SYM", candles[keep])
+    h5_db.hf.close()
+
+    # The library is loaded from backtestingCpp/build relative to the working directory
+    os.symlink(os.path.join(REPO_DIR, "backtestingCpp"), "backtestingCpp")
+
+    start = int(candles[0, 0])
+    end = int(candles[-1, 0])
+    print(f"\n{'tf':<4} | {'range':<9} | " + " | ".join(f"{s:>9}" for s in CPP_STRATEGIES))
+
+    for tf, tf_ms in [("15m", 15 * MINUTE_MS), ("1h", 60 * MINUTE_MS), ("4h", 240 * MINUTE_MS)]:
+        ranges = {"aligned": (start + 7 * tf_ms, start + 300 * tf_ms - 1),
+                  "unaligned": (start + 7 * tf_ms + 7 * MINUTE_MS, start + 300 * tf_ms + 5 * MINUTE_MS),
+                  "all": (0, end + tf_ms)}
+
+        for name, (from_time, to_time) in ranges.items():
+            identical = []
+            with BacktestSession("results") as loaded, BacktestSession("results", mapped=True) as mapped:
+                for strategy, params in CPP_PARAMS.items():
+                    identical.append(loaded.run("SYM", strategy, tf, from_time, to_time, params) ==
+                                     mapped.run("SYM", strategy, tf, from_time, to_time, params))
+
+            print(f"{tf:<4} | {name:<9} | " + " | ".join(f"{str(i):>9}" for i in identical))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    parser.add_argument("--workers", type=int, default=10)
+    parser.add_argument("--results", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.mkdir("data")
+
+        h5_db = Hdf5Client("bench")
+        h5_db.create_dataset("SYM", 6)
+        h5_db.write_data("SYM", make_candles(args.rows))
+        path = export_candles(h5_db, "SYM", "1m", 0, 2 ** 62)
+        h5_db.hf.close()
+
+        print(f"{args.rows:,} 1m candles, {os.path.getsize(path) / 1024 ** 2:,.0f} MB exported\n")
+        print(f"{'mode':<8} | {'workers':>7} | {'total PSS MB':>13} | {'max PSS MB':>13} | {'load':>8}")
+
+        for mode in ["private", "mapped"]:
+            run(mode, path, args.workers)
+
+        if args.results:
+            compare_results(min(args.rows, 200_000))
+
+
+if __name__ == "__main__":
+    main()
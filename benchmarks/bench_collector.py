@@ -0,0 +1,136 @@
+"""
+Collection throughput benchmark for DataCollector against the local replay server (see replay_server.py).
+
+Builds synthetic source files for both exchanges in a temporary directory, serves them through the replay server
+and collects them into empty files, first one symbol with collect_all then every symbol with sync_all. Reports
+rows/s and requests per 1000 rows for each run, so changes to the collection path can be compared.
+
+The clients' production rate budgets are replaced by an unlimited bucket unless --real-limits is given.
+
+Usage: python benchmarks/bench_collector.py [--days 30] [--symbols 4] [--latency 0.02] [--jitter 0.0]
+                                            [--rate-limit-every 0] [--error-rate 0.0] [--workers 4]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import logging
+from datetime import datetime, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Hdf5Client
+from data_service import DataCollector
+from exchanges.binance import BinanceClient
+from exchanges.oanda import OandaClient
+from gaps import is_market_closure
+from rate_limiter import TokenBucket
+from replay_server import ReplayServer
+
+logging.disable(logging.WARNING)
+
+MINUTE_MS = 60_000
+
+
+def make_candles(num_rows: int, end_ms: int, spread: bool, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    ts = end_ms - np.arange(num_rows, 0, -1, dtype=np.int64) * MINUTE_MS
+    close = 100 + np.cumsum(rng.normal(0, 0.1, num_rows))
+    columns = [ts.astype(np.float64), close, close + 0.05, close - 0.05, close, rng.integers(1, 100, num_rows)]
+
+    if spread:
+        columns.append(np.round(rng.uniform(0.0001, 0.0005, num_rows), 4))
+        candles = np.column_stack(columns)
+        # No candles while the market is closed
+        return candles[~is_market_closure(ts, ts, "oanda")]
+
+    return np.column_stack(columns)
+
+
+def make_source(exchange: str, num_symbols: int, days: int) -> int:
+    now_ms = int(datetime.now(timezone.utc).timestamp() * 1000) // MINUTE_MS * MINUTE_MS
+    h5_db = Hdf5Client(exchange)
+
+    for i in range(num_symbols):
+        symbol = f"SYM{i}USDT" if exchange == "replay_binance" else f"SYM{i}_USD"
+        h5_db.create_dataset(symbol, 6 if exchange == "replay_binance" else 7)
+        h5_db.write_data(symbol, make_candles(days * 1440, now_ms, exchange == "replay_oanda", i))
+
+    h5_db.hf.close()
+
+    return now_ms - days * 1440 * MINUTE_MS
+
+
+def run(name: str, server: ReplayServer, collect, target: DataCollector):
+    server.reset_counters()
+    start = time.perf_counter()
+    collect()
+    elapsed = time.perf_counter() - start
+
+    rows = sum(target.h5_db.get_metadata(s)["row_count"] for s in target.client.symbols if s in target.h5_db.hf)
+    print(f"{name:<28} | {rows:>9,} | {elapsed:>7.2f}s | {rows / elapsed:>10,.0f} | {server.requests:>8} | "
+          f"{server.requests / rows * 1000 if rows else 0:>8.2f} | {server.rate_limited:>4} | {server.errors:>4}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--symbols", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--real-limits", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.mkdir("data")
+
+        from_time = make_source("replay_binance", args.symbols, args.days)
+        make_source("replay_oanda", args.symbols, args.days)
+
+        server = ReplayServer(binance="replay_binance", oanda="replay_oanda", latency=args.latency,
+                              jitter=args.jitter, rate_limit_every=args.rate_limit_every, retry_after=0.1,
+                              error_rate=args.error_rate)
+        server.start()
+
+        print(f"{args.symbols} symbols x {args.days} days, latency {args.latency}s, 429 every "
+              f"{args.rate_limit_every or '-'} requests, {args.error_rate:.0%} errors\n")
+        print(f"{'run':<28} | {'rows':>9} | {'time':>8} | {'rows/s':>10} | {'requests':>8} | {'req/1k':>8} | "
+              f"{'429':>4} | {'500':>4}")
+
+        for exchange, client_class in [("binance", BinanceClient), ("oanda", OandaClient)]:
+            for mode in ["collect_all", "sync_all"]:
+                # Fresh target file for every run
+                if os.path.exists(f"data/{exchange}.h5"):
+                    os.remove(f"data/{exchange}.h5")
+
+                if exchange == "binance":
+                    client = client_class(base_url=server.url)
+                else:
+                    client = client_class(api_url=server.url)
+                if not args.real_limits:
+                    client.rate_limiter = TokenBucket(1e9, 1e9)
+
+                target = DataCollector(exchange, client=client)
+
+                if mode == "collect_all":
+                    client.symbols = client.symbols[:1]
+                    collect = lambda: target.collect_all(client.symbols[0], from_time)
+                else:
+                    collect = lambda: target.sync_all(from_time, workers=args.workers)
+
+                run(f"{exchange} {mode}", server, collect, target)
+                target.h5_db.hf.close()
+
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Range read benchmark for Hdf5Client.get_data.
+
+Builds synthetic 1m candle files of increasing size in a temporary directory and times one-day, one-week and
+one-month reads from the end of each file. With the range-query path the read time should follow the window
+size and stay flat as the file grows.
+
+Usage: python benchmarks/bench_get_data.py
+"""
+import os
+import sys
+import tempfile
+import time
+import logging
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Hdf5Client
+
+logging.disable(logging.INFO)
+
+MINUTE_MS = 60_000
+FILE_SIZES = [100_000, 1_000_000, 5_000_000]
+WINDOWS = {"1 day": 1440, "1 week": 7 * 1440, "1 month": 30 * 1440}
+REPEATS = 5
+
+
+def make_candles(num_rows: int, start_ms: int = 1_577_836_800_000) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    ts = start_ms + np.arange(num_rows, dtype=np.float64) * MINUTE_MS
+    close = 100 + np.cumsum(rng.normal(0, 0.1, num_rows))
+    return np.column_stack([ts, close, close + 0.05, close - 0.05, close, rng.integers(1, 100, num_rows)])
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.mkdir("data")
+
+        print(f"{'rows in file':>14} | " + " | ".join(f"{w:>10}" for w in WINDOWS))
+
+        for num_rows in FILE_SIZES:
+            client = Hdf5Client(f"bench_{num_rows}")
+            client.create_dataset("BENCH")
+            candles = make_candles(num_rows)
+            for i in range(0, num_rows, 1_000_000):
+                client.write_data("BENCH", candles[i:i + 1_000_000])
+
+            last_ts = int(candles[-1, 0])
+            timings = []
+
+            for minutes in WINDOWS.values():
+                from_time = last_ts - minutes * MINUTE_MS
+                start = time.perf_counter()
+                for _ in range(REPEATS):
+                    client.get_data("BENCH", from_time, last_ts)
+                timings.append((time.perf_counter() - start) / REPEATS * 1000)
+
+            print(f"{num_rows:>14,} | " + " | ".join(f"{t:>8.1f}ms" for t in timings))
+            client.hf.close()
+
+
+if __name__ == "__main__":
+    main()
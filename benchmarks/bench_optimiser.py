@@ -0,0 +1,90 @@
+"""
+Throughput benchmark for Nsga2.evaluate_population with several workers.
+
+Builds a synthetic 1m candle file in a temporary directory, then evaluates the same random population with 1, 2,
+4, ... workers (up to the number of cores) and reports the backtests per second and whether the results are
+identical to the serial evaluation. The workers are processes for the Python strategies and native threads of a
+single batch call for the C++ ones (which need the library built in backtestingCpp/build).
+
+Usage: python benchmarks/bench_optimiser.py [--rows 1000000] [--strategy obv] [--tf 15m] [--population 200]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from database import Hdf5Client
+from optimiser import Nsga2
+from utils import STRAT_PARAMS
+
+logging.disable(logging.INFO)
+
+MINUTE_MS = 60_000
+
+
+def make_candles(num_rows: int, start_ms: int = 1_577_836_800_000) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    ts = start_ms + np.arange(num_rows, dtype=np.float64) * MINUTE_MS
+    close = 100 + np.cumsum(rng.normal(0, 0.1, num_rows))
+    return np.column_stack([ts, close, close + 0.05, close - 0.05, close, rng.integers(1, 100, num_rows)])
+
+
+def evaluate(strategy: str, tf: str, population_size: int, workers: int):
+    with Nsga2("bench", "SYM", strategy, tf, 0, 2 ** 62, population_size, workers=workers, seed=0) as nsga2:
+        population = nsga2.create_initial_population()
+
+        # The pool is started by the first call, only the second one is timed
+        nsga2.evaluate_population(population.take(np.arange(min(workers, len(population)))))
+
+        t = time.perf_counter()
+        population = nsga2.evaluate_population(population)
+        elapsed = time.perf_counter() - t
+
+    return elapsed, [(bt.pnl, bt.max_dd, bt.num_trades, bt.sharpe_ratio, bt.cagr) for bt in population]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--strategy", default="obv", choices=list(STRAT_PARAMS))
+    parser.add_argument("--tf", default="15m")
+    parser.add_argument("--population", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.mkdir("data")
+        # get_library() loads the C++ library relative to the working directory
+        os.symlink(os.path.join(REPO_DIR, "backtestingCpp"), "backtestingCpp")
+
+        h5_db = Hdf5Client("bench")
+        h5_db.create_dataset("SYM", 6)
+        h5_db.write_data("SYM", make_candles(args.rows))
+        h5_db.hf.close()
+
+        print(f"{args.strategy} {args.tf}, {args.population} individuals, {args.rows:,} 1m candles\n")
+        print(f"{'workers':>7} | {'backtests/s':>11} | {'speedup':>7} | identical")
+
+        counts = [1]
+        while counts[-1] * 2 <= (os.cpu_count() or 1):
+            counts.append(counts[-1] * 2)
+
+        serial_time, serial_results = None, None
+        for workers in counts:
+            elapsed, results = evaluate(args.strategy, args.tf, args.population, workers)
+            if serial_results is None:
+                serial_time, serial_results = elapsed, results
+
+            print(f"{workers:>7} | {args.population / elapsed:>11,.1f} | {serial_time / elapsed:>6.2f}x | "
+                  f"{results == serial_results}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Benchmark of Nsga2.non_dominated_sorting against the pairwise sorting it replaced.
+
+Random populations (with ties, duplicates and the -inf results of the backtests without trades) are sorted by both,
+checking that the fronts hold the same individuals in the same order. The pairwise sorting is only timed up to
+--max-pairwise individuals, it grows with the square of the population.
+
+Usage: python benchmarks/bench_sorting.py [--sizes 200,1000,5000,20000] [--max-pairwise 5000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import BacktestResult, Population
+from optimiser import Nsga2
+
+
+def pairwise_sorting(population: Dict[int, BacktestResult]) -> List[List[BacktestResult]]:
+    """
+    The previous Nsga2.non_dominated_sorting, comparing every pair of individuals.
+    """
+    fronts = []
+
+    for id_1, indiv_1 in population.items():
+        for id_2, indiv_2 in population.items():
+            if (
+                indiv_1.cagr >= indiv_2.cagr
+                and indiv_1.sharpe_ratio >= indiv_2.sharpe_ratio
+                and (indiv_1.cagr > indiv_2.cagr or indiv_1.sharpe_ratio > indiv_2.sharpe_ratio)
+            ):
+                indiv_1.dominates.append(id_2)
+            elif (
+                indiv_2.cagr >= indiv_1.cagr
+                and indiv_2.sharpe_ratio >= indiv_1.sharpe_ratio
+                and (indiv_2.cagr > indiv_1.cagr or indiv_2.sharpe_ratio > indiv_1.sharpe_ratio)
+            ):
+                indiv_1.dominated_by += 1
+
+        if indiv_1.dominated_by == 0:
+            if len(fronts) == 0:
+                fronts.append([])
+            fronts[0].append(indiv_1)
+            indiv_1.rank = 0
+
+    i = 0
+
+    while True:
+        fronts.append([])
+
+        for indiv_1 in fronts[i]:
+            for indiv_2_id in indiv_1.dominates:
+                population[indiv_2_id].dominated_by -= 1
+                if population[indiv_2_id].dominated_by == 0:
+                    fronts[i + 1].append(population[indiv_2_id])
+                    population[indiv_2_id].rank = i + 1
+
+        if len(fronts[i + 1]) > 0:
+            i += 1
+        else:
+            del fronts[-1]
+            break
+
+    return fronts
+
+
+def make_population(size: int, seed: int) -> Dict[int, BacktestResult]:
+    rng = random.Random(seed)
+    population = dict()
+
+    for i in range(size):
+        bt = BacktestResult()
+        if rng.random() < 0.05:
+            # No trades
+            bt.cagr, bt.sharpe_ratio = -float("inf"), -float("inf")
+        else:
+            # Rounded so that ties and duplicates are common
+            bt.cagr = round(rng.gauss(5, 10), 1)
+            bt.sharpe_ratio = round(bt.cagr / 10 + rng.gauss(0, 1), 1)
+        population[i] = bt
+
+    return population
+
+
+def to_arrays(population: Dict[int, BacktestResult]) -> Population:
+    arrays = Population(np.zeros((len(population), 0)), dict())
+    arrays.cagr = np.array([bt.cagr for bt in population.values()])
+    arrays.sharpe_ratio = np.array([bt.sharpe_ratio for bt in population.values()])
+    return arrays
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="200,1000,5000,20000")
+    parser.add_argument("--max-pairwise", type=int, default=5000)
+    args = parser.parse_args()
+
+    nsga2 = Nsga2.__new__(Nsga2)
+
+    print(f"{'individuals':>11} | {'fronts':>6} | {'pairwise':>10} | {'sorted':>10} | identical")
+
+    for size in [int(s) for s in args.sizes.split(",")]:
+        population = make_population(size, seed=size)
+        arrays = to_arrays(population)
+
+        t = time.perf_counter()
+        fronts = nsga2.non_dominated_sorting(arrays)
+        elapsed = time.perf_counter() - t
+
+        if size <= args.max_pairwise:
+            t = time.perf_counter()
+            expected = pairwise_sorting(population)
+            pairwise_elapsed = f"{(time.perf_counter() - t) * 1000:>8.1f}ms"
+
+            rows = {id(bt): i for i, bt in population.items()}
+            identical = ([[(rows[id(bt)], bt.rank) for bt in front] for front in expected] ==
+                         [[(i, arrays.rank[i]) for i in front.tolist()] for front in fronts])
+        else:
+            pairwise_elapsed, identical = f"{'-':>10}", "-"
+
+        print(f"{size:>11,} | {len(fronts):>6} | {pairwise_elapsed} | {elapsed * 1000:>8.1f}ms | {identical}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+Local stand-in for the Binance and Oanda REST endpoints used by the exchange clients, replaying candles stored in
+HDF5 files.
+
+Binance: GET /api/v3/exchangeInfo, /fapi/v1/exchangeInfo, /api/v3/klines, /fapi/v1/klines
+Oanda:   GET /v3/accounts/<account>/instruments, /v3/instruments/<symbol>/candles (UNIX datetime format)
+
+Faults can be injected to exercise the clients: a fixed latency (plus jitter) per request, a 429 with
+Retry-After every rate_limit_every requests and a share of 500 responses.
+
+    server = ReplayServer(binance="replay_binance", oanda="replay_oanda", latency=0.05)
+    server.start()
+    client = BinanceClient(base_url=server.url)
+    oanda_client = OandaClient(api_url=server.url)
+
+binance / oanda are the exchange names passed to Hdf5Client, i.e. data/<name>.h5.
+"""
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Hdf5Client
+
+MINUTE_MS = 60_000
+BINANCE_KLINES_MAX = {"/api/v3/klines": 1000, "/fapi/v1/klines": 1500}
+OANDA_COUNT_MAX = 5000
+
+OANDA_CANDLES = re.compile(r"^/v3/instruments/([^/]+)/candles$")
+OANDA_INSTRUMENTS = re.compile(r"^/v3/accounts/[^/]+/instruments$")
+
+
+class ReplayServer:
+
+    def __init__(self, binance: Optional[str] = None, oanda: Optional[str] = None, latency: float = 0.0,
+                 jitter: float = 0.0, rate_limit_every: int = 0, retry_after: float = 1.0, error_rate: float = 0.0,
+                 seed: int = 0, port: int = 0):
+        self.candles = {"binance": self._load(binance), "oanda": self._load(oanda)}
+
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+
+        self.requests = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._weight_window = (0, 0)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.rate_limited = 0
+            self.errors = 0
+
+    @staticmethod
+    def _load(exchange: Optional[str]) -> Dict[str, np.ndarray]:
+        """
+        All the candles of every symbol, held in memory so the request threads never touch h5py.
+        """
+        if exchange is None:
+            return dict()
+
+        h5_db = Hdf5Client(exchange)
+        candles = dict()
+
+        for symbol in h5_db.hf.keys():
+            if symbol in ["timeframes", "gaps"] or h5_db.get_metadata(symbol)["row_count"] == 0:
+                continue
+
+            data = h5_db.get_data(symbol, 0, 2 ** 62)
+            timestamps = data.index.values.astype("datetime64[ms]").astype(np.int64)
+            candles[symbol] = np.column_stack([timestamps.astype(np.float64), data.to_numpy(dtype=np.float64)])
+
+        h5_db.hf.close()
+
+        return candles
+
+    def _fault(self) -> Optional[int]:
+        """
+        Latency is applied to every request, then the status code of an injected fault if any.
+        """
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+        with self._lock:
+            self.requests += 1
+
+            if self.rate_limit_every and self.requests % self.rate_limit_every == 0:
+                self.rate_limited += 1
+                return 429
+
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.errors += 1
+                return 500
+
+        return None
+
+    def _used_weight(self, weight: int) -> int:
+        with self._lock:
+            minute = int(time.time() // 60)
+            window_minute, used = self._weight_window
+            used = used + weight if window_minute == minute else weight
+            self._weight_window = (minute, used)
+            return used
+
+    def binance_klines(self, max_limit: int, query: Dict[str, str]):
+        candles = self.candles["binance"].get(query.get("symbol"))
+        if candles is None:
+            return 400, {"code": -1121, "msg": "Invalid symbol."}
+
+        limit = min(int(query.get("limit", 500)), max_limit)
+        start = np.searchsorted(candles[:, 0], int(query.get("startTime", 0)), side="left")
+        stop = np.searchsorted(candles[:, 0], int(query.get("endTime", 2 ** 62)), side="right")
+        rows = candles[start:min(stop, start + limit)].tolist()
+
+        return 200, [[int(r[0]), repr(r[1]), repr(r[2]), repr(r[3]), repr(r[4]), repr(r[5]), int(r[0]) + MINUTE_MS - 1,
+                      "0", 0, "0", "0", "0"] for r in rows]
+
+    def oanda_candles(self, symbol: str, query: Dict[str, str]):
+        candles = self.candles["oanda"].get(symbol)
+        if candles is None:
+            return 400, {"errorMessage": f"Invalid value specified for 'instrument'"}
+
+        from_ms = round(float(query.get("from", 0)) * 1000)
+        side = "left" if query.get("includeFirst", "True").lower() == "true" else "right"
+        start = np.searchsorted(candles[:, 0], from_ms, side=side)
+        if "to" in query:
+            stop = np.searchsorted(candles[:, 0], round(float(query["to"]) * 1000), side="right")
+            if stop - start > OANDA_COUNT_MAX:
+                return 400, {"errorMessage": f"Maximum value for 'count' exceeded"}
+        else:
+            stop = start + min(int(query.get("count", 500)), OANDA_COUNT_MAX)
+        rows = candles[start:stop].tolist()
+
+        return 200, {"instrument": symbol, "granularity": query.get("granularity", "M1"), "candles": [
+            {"complete": True, "volume": int(r[5]), "time": f"{r[0] / 1000:.9f}",
+             "mid": {"o": repr(r[1]), "h": repr(r[2]), "l": repr(r[3]), "c": repr(r[4])},
+             "bid": {"c": repr(round(r[4] - r[6] / 2, 6))}, "ask": {"c": repr(round(r[4] + r[6] / 2, 6))}}
+            for r in rows]}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                headers = dict()
+
+                fault = server._fault()
+                if fault == 429:
+                    headers["Retry-After"] = str(server.retry_after)
+                    status, body = 429, {"code": -1003, "msg": "Too many requests"}
+                elif fault is not None:
+                    status, body = fault, {"code": -1000, "msg": "Injected error"}
+                elif url.path in ["/api/v3/exchangeInfo", "/fapi/v1/exchangeInfo"]:
+                    status, body = 200, {"symbols": [{"symbol": s} for s in server.candles["binance"]]}
+                elif url.path in BINANCE_KLINES_MAX:
+                    status, body = server.binance_klines(BINANCE_KLINES_MAX[url.path], query)
+                elif OANDA_INSTRUMENTS.match(url.path):
+                    status, body = 200, {"instruments": [{"name": s, "type": "CURRENCY", "displayName": s}
+                                                         for s in server.candles["oanda"]]}
+                elif OANDA_CANDLES.match(url.path):
+                    status, body = server.oanda_candles(OANDA_CANDLES.match(url.path).group(1), query)
+                else:
+                    status, body = 404, {"msg": f"Unknown endpoint {url.path}"}
+
+                if url.path.startswith(("/api/", "/fapi/")):
+                    headers["X-MBX-USED-WEIGHT-1M"] = str(server._used_weight(2))
+
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
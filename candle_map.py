@@ -0,0 +1,141 @@
+import logging
+import os
+import struct
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from frame_cache import FrameCache
+from utils import TF_MS, atomic_write, candles_frame
+
+logger = logging.getLogger()
+
+CANDLE_MAP_DIR = "data/candles"
+
+# File layout, read by CandleMap.cpp as well:
+#   header  magic, rows, value columns, timeframe in ms, empty bucket handling, source key, 8 column names
+#   data    (1 + columns, rows) float64 from HEADER_SIZE on: the timestamps in ms, then one row per column
+CANDLE_MAP_MAGIC = b"CANDLES1"
+HEADER = struct.Struct("<8sqqq8s40s" + "16s" * 8)
+HEADER_SIZE = 256
+
+
+def candle_map_path(exchange: str, symbol: str, tf: str, from_time: int, to_time: int,
+                    columns: Optional[List[str]] = None, empty_buckets: str = "nan", drop_last: bool = False,
+                    directory: str = CANDLE_MAP_DIR) -> str:
+    name = f"{exchange}_{symbol}_{tf}_{from_time}_{to_time}_{empty_buckets}"
+    if columns is not None:
+        name += "_" + "-".join(columns)
+    if drop_last:
+        name += "_droplast"
+    return os.path.join(directory, f"{name}.candles")
+
+
+def export_candles(h5_db, symbol: str, tf: str, from_time: int, to_time: int, columns: Optional[List[str]] = None,
+                   empty_buckets: str = "nan", drop_last: bool = False, directory: str = CANDLE_MAP_DIR) -> str:
+    """
+    Writes the resampled candles of get_resampled() to a flat read-only file that load_candles() and the C++
+    library (CandleMap) map into memory without copying, so every process backtesting the same candles shares
+    one copy of them through the page cache. Returns the path of the file.
+
+    The file records the dataset version it was built from and is only rewritten when the symbol has changed
+    since, the processes calling this concurrently can all use the same path.
+    empty_buckets: as in resample_timeframe().
+    drop_last: leaves out the last bucket.
+    The C++ strategies expect empty_buckets="ffill" and drop_last=True, the candles rearrange_candles() of the
+    library produces: it never closes the bucket it is filling when the candles run out.
+    """
+    metadata = h5_db.get_metadata(symbol)
+    key = FrameCache.key(symbol, tf, from_time, to_time, columns, empty_buckets, drop_last,
+                         h5_db.get_version(symbol), metadata["row_count"], metadata["last_ts"])
+    path = candle_map_path(h5_db.exchange, symbol, tf, from_time, to_time, columns, empty_buckets, drop_last,
+                           directory)
+
+    try:
+        if read_header(path)["key"] == key:
+            return path
+    except (FileNotFoundError, ValueError):
+        pass
+
+    df = h5_db.get_resampled(symbol, tf, from_time, to_time, columns=columns)
+
+    if df is None:
+        names = [c for c in ["open", "high", "low", "close", "volume"] if columns is None or c in columns]
+        timestamps = np.empty(0, dtype=np.int64)
+        values = {c: np.empty(0) for c in names}
+    else:
+        names = list(df.columns)
+        timestamps = df.index.values.astype("datetime64[ms]").astype(np.int64)
+        values = {c: df[c].to_numpy(dtype=np.float64) for c in names}
+
+    if empty_buckets != "nan" and timestamps.shape[0]:
+        # get_resampled() keeps the empty buckets as NaN candles, rebuilt from the others
+        prices = [values[c] for c in names if c != "volume"]
+        keep = ~np.isnan(np.vstack(prices)).all(axis=0) if prices else np.ones(timestamps.shape[0], dtype=bool)
+        df = candles_frame(timestamps[keep], {c: v[keep] for c, v in values.items()}, tf, empty_buckets)
+        timestamps = df.index.values.astype("datetime64[ms]").astype(np.int64)
+        values = {c: df[c].to_numpy(dtype=np.float64) for c in names}
+
+    if drop_last and timestamps.shape[0]:
+        timestamps = timestamps[:-1]
+        values = {c: v[:-1] for c, v in values.items()}
+
+    block = np.empty((1 + len(names), timestamps.shape[0]))
+    block[0] = timestamps
+    for i, c in enumerate(names):
+        block[i + 1] = values[c]
+
+    header = HEADER.pack(CANDLE_MAP_MAGIC, block.shape[1], len(names), TF_MS[tf], empty_buckets.encode(),
+                         key.encode(), *[c.encode() for c in names], *[b""] * (8 - len(names)))
+
+    def write(tmp_path: str):
+        with open(tmp_path, "wb") as f:
+            f.write(header.ljust(HEADER_SIZE, b"\0"))
+            block.tofile(f)
+
+    os.makedirs(directory, exist_ok=True)
+    atomic_write(path, write)
+
+    logger.info(f"Exported {block.shape[1]} {symbol} {tf} candles to {path}")
+
+    return path
+
+
+def read_header(path: str) -> Dict:
+    with open(path, "rb") as f:
+        raw = f.read(HEADER.size)
+
+    if len(raw) < HEADER.size or raw[:8] != CANDLE_MAP_MAGIC:
+        raise ValueError(f"{path} is not a candle file")
+
+    magic, num_rows, num_columns, tf_ms, empty_buckets, key, *names = HEADER.unpack(raw)
+
+    return {
+        "num_rows": num_rows,
+        "tf_ms": tf_ms,
+        "empty_buckets": empty_buckets.rstrip(b"\0").decode(),
+        "key": key.decode(),
+        "columns": [n.rstrip(b"\0").decode() for n in names[:num_columns]],
+    }
+
+
+def load_candles(path: str) -> pd.DataFrame:
+    """
+    DataFrame laid out like get_resampled() output whose columns are a read-only memory map of the file, only
+    the index is built in memory. Pages are read on first access and shared with every other process mapping
+    the same file.
+    """
+    header = read_header(path)
+    columns = header["columns"]
+
+    if header["num_rows"] == 0:
+        block = np.empty((1 + len(columns), 0))
+    else:
+        block = np.memmap(path, dtype=np.float64, mode="r", offset=HEADER_SIZE,
+                          shape=(1 + len(columns), header["num_rows"]))
+
+    index = pd.DatetimeIndex(block[0].astype(np.int64).astype("datetime64[ms]"), name="timestamp")
+
+    # Column-major block, the layout DataFrame stores float columns in, so no copy is made
+    return pd.DataFrame(block[1:].T, index=index, columns=columns, copy=False)
@@ -1,19 +1,36 @@
+import heapq
 import logging
-from datetime import datetime, timezone, timedelta
-from typing import Tuple
+import queue
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone, timedelta
+from typing import Tuple, Dict, Optional, Generator, Union
+
+import numpy as np
 
 from database import Hdf5Client
+from pipeline import CollectionPipeline, StageMetrics, failed_windows
+from gaps import GAP_MISSING
 from utils import ms_to_dt, dt_to_ms
 from exchanges.binance import BinanceClient
 from exchanges.oanda import OandaClient
 
 logger = logging.getLogger()
 
+# Seconds left to the exchange to publish a closed candle before it is requested
+TAIL_SYNC_DELAY = 2
+# Rows landing inside the stored history are held until there are this many (a few pipeline write batches, per
+# symbol being collected), every insert shifts the rows after it
+INSERT_BUFFER_ROWS = 50_000
+
 
 class DataCollector:
-    def __init__(self, exchange: str):
-        if exchange == "binance":
+    def __init__(self, exchange: str, client: Union[BinanceClient, OandaClient, None] = None,
+                 insert_buffer_rows: int = INSERT_BUFFER_ROWS):
+        if client is not None:
+            self.client = client
+        elif exchange == "binance":
             self.client = BinanceClient()
         elif exchange == "oanda":
             self.client = OandaClient()
@@ -23,7 +40,33 @@ class DataCollector:
         self.h5_db = Hdf5Client(exchange=exchange)
         self.exchange = exchange
 
-    def sync_all(self, from_time: int):
+        # Both clients page through a window with a cursor (see iter_historical_data), the window only bounds the
+        # work handed to a fetcher
+        self.max_window_minutes = 30 * 1440
+
+        # h5py objects are shared between the collection threads, all access goes through this lock
+        self._db_lock = threading.Lock()
+        self._write_queue = None
+        # Symbols the writer thread failed to write rows for
+        self._write_failures = set()
+        # Per symbol being collected: last stored timestamp when the collection started, and the rows held back
+        # because they land before it, up to insert_buffer_rows, see _write_data
+        self.insert_buffer_rows = insert_buffer_rows
+        self._stored_until = dict()
+        self._insert_buffers = dict()
+
+    def sync_all(self, from_time: int, workers: int = 4, backfill: bool = False):
+        """
+        Collects every symbol of the exchange. With workers > 1 the symbols are fetched concurrently: the pace is
+        set by the client's shared rate limiter and a single writer thread owns the HDF5 writes.
+        backfill=True only requests the gaps inside the stored history of each symbol, see backfill().
+        The symbols that failed, or have windows that could not be fetched, are logged at the end to be run again.
+        """
+        if backfill:
+            task = lambda symbol: self.backfill(symbol)
+        else:
+            task = lambda symbol: self.collect_all(symbol, from_time)
+
         # WIP - Testing
         # for symbol in [
         #                'NATGAS_USD',
@@ -81,11 +124,51 @@ class DataCollector:
         #                'GBP_JPY',
         #                'CHF_HKD']:
             # WIP - Testing
-        for symbol in self.client.symbols:
-            self.collect_all(symbol, from_time)
-            time.sleep(30)
+        incomplete = []
+
+        if workers <= 1:
+            for symbol in self.client.symbols:
+                try:
+                    metrics = task(symbol)
+                except Exception as e:
+                    logger.error(f"{self.exchange} {symbol}: collection failed: {e}")
+                    metrics = None
+                    incomplete.append(symbol)
+                if metrics is not None and failed_windows(metrics):
+                    incomplete.append(symbol)
+            self._log_incomplete(incomplete)
+            return
+
+        self._write_queue = queue.Queue(maxsize=workers * 4)
+        self._write_failures = set()
+        writer = threading.Thread(target=self._writer, daemon=True)
+        writer.start()
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(task, symbol): symbol for symbol in self.client.symbols}
+                for future in as_completed(futures):
+                    try:
+                        metrics = future.result()
+                    except Exception as e:
+                        logger.error(f"{self.exchange} {futures[future]}: collection failed: {e}")
+                        incomplete.append(futures[future])
+                        continue
+                    if metrics is not None and failed_windows(metrics):
+                        incomplete.append(futures[future])
+        finally:
+            self._write_queue.put(None)
+            writer.join()
+            self._write_queue = None
 
-    def collect_all(self, symbol: str, from_time: int):
+        self._log_incomplete(set(incomplete) | self._write_failures)
+
+    def _log_incomplete(self, symbols):
+        if symbols:
+            logger.error(f"{self.exchange}: {len(symbols)} symbols are incomplete and should be collected again: "
+                         f"{', '.join(sorted(symbols))}")
+
+    def collect_all(self, symbol: str, from_time: int) -> Dict[str, StageMetrics]:
         if self.exchange == "oanda":
             num_cols = 7
         else:
@@ -94,84 +177,313 @@ class DataCollector:
         logger.info(
             f"[DataCollector.collect_all] Start: symbol: {symbol}, from_time: {ms_to_dt(from_time)}, num_cols: {num_cols}")
 
-        self.h5_db.create_dataset(symbol, num_cols)
-        oldest_ts, most_recent_ts = self.h5_db.get_first_last_timestamp(symbol)
-        data = list()
+        with self._db_lock:
+            self.h5_db.create_dataset(symbol, num_cols)
+            oldest_ts, most_recent_ts = self.h5_db.get_first_last_timestamp(symbol)
+
+        pipeline = self._pipeline(symbol, most_recent_ts)
+        try:
+            metrics = pipeline.run(self._collection_windows(symbol, from_time, oldest_ts, most_recent_ts))
+        finally:
+            self._flush_inserts(symbol)
+
+        if metrics["write"].rows == 0:
+            logger.warning(f"{self.exchange} {symbol}: no new data found")
+
+        self._log_failed_windows(symbol, metrics)
+
+        logger.info(f"{self.exchange} {symbol}: Collected {metrics['write'].rows} rows\n"
+                    + "\n".join(str(m) for m in metrics.values()) + f"\n{'-' * 80}")
+
+        return metrics
+
+    def tail_sync(self, from_time: Optional[int] = None, interval: int = 60, workers: int = 4,
+                  max_backoff: int = 16, rounds: Optional[int] = None, swmr: bool = False):
+        """
+        Long running sync keeping every symbol close to real time. Each symbol is scheduled for the minute its
+        next candle closes and only requests the candles after its last stored timestamp. Due symbols are
+        requested most stale first. A symbol that returns nothing (market closed, no trades) is polled less
+        often, up to max_backoff intervals apart, until it gets new candles again.
+        Symbols without stored data start at from_time, or are left out if from_time is None.
+        Runs until interrupted, or for the given number of rounds.
+        swmr: share the file with backtests reading it meanwhile, see Hdf5Client.start_swmr.
+        """
+        if self.exchange == "oanda":
+            num_cols = 7
+        else:
+            num_cols = 6
+
+        # (next due time, last stored timestamp, symbol): the heap pops the due symbols first
+        schedule = []
+        empty_polls = dict()
+        with self._db_lock:
+            for symbol in self.client.symbols:
+                # Only the symbols scheduled get a dataset, a run without from_time leaves the others alone
+                _, last_ts = self.h5_db.get_first_last_timestamp(symbol) if symbol in self.h5_db.hf else (None, None)
+                if last_ts is None and from_time is None:
+                    continue
+                self.h5_db.create_dataset(symbol, num_cols)
+                last_ts = from_time - 60000 if last_ts is None else int(last_ts)
+                heapq.heappush(schedule, (0.0, last_ts, symbol))
+                empty_polls[symbol] = 0
+
+            if swmr:
+                self.h5_db.start_swmr()
+
+        logger.info(f"{self.exchange}: tail sync of {len(schedule)} symbols every {interval}s")
+
+        completed_rounds = 0
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                while schedule and (rounds is None or completed_rounds < rounds):
+                    now = time.time()
+                    if schedule[0][0] > now:
+                        time.sleep(min(schedule[0][0] - now, interval))
+                        continue
+
+                    due = []
+                    while schedule and schedule[0][0] <= now:
+                        _, last_ts, symbol = heapq.heappop(schedule)
+                        due.append((last_ts, symbol))
+
+                    # Most stale first, so the rate limiter serves them before the others
+                    due.sort()
+                    futures = {executor.submit(self._tail_symbol, symbol, last_ts): (last_ts, symbol)
+                               for last_ts, symbol in due}
+
+                    requests = 0
+                    rows = 0
+                    for future in as_completed(futures):
+                        last_ts, symbol = futures[future]
+                        try:
+                            new_last_ts, num_requests, num_rows = future.result()
+                        except Exception as e:
+                            logger.error(f"{self.exchange} {symbol}: tail sync failed: {e}")
+                            new_last_ts, num_requests, num_rows = last_ts, 0, 0
+
+                        requests += num_requests
+                        rows += num_rows
+                        if new_last_ts > last_ts:
+                            empty_polls[symbol] = 0
+                            # The next candle closes 2 minutes after the open time of the last one stored
+                            next_due = new_last_ts / 1000 + 120 + TAIL_SYNC_DELAY
+                        else:
+                            empty_polls[symbol] += 1
+                            next_due = time.time() + interval * min(2 ** empty_polls[symbol], max_backoff)
+
+                        heapq.heappush(schedule, (next_due, new_last_ts, symbol))
+
+                    staleness = [now * 1000 - last_ts for _, last_ts, _ in schedule]
+                    logger.info(f"{self.exchange}: tail sync of {len(due)} symbols, {requests} requests, "
+                                f"{rows} rows added, max staleness {int(max(staleness) // 1000)}s")
+                    completed_rounds += 1
+        except KeyboardInterrupt:
+            logger.info(f"{self.exchange}: tail sync stopped")
+
+    def _tail_symbol(self, symbol: str, last_ts: int) -> Tuple[int, int, int]:
+        """
+        Fetches and writes the closed candles after last_ts. Returns the new last timestamp, the number of pages
+        requested and the number of rows written.
+        """
+        # Only closed candles: the one opened in the current minute is still changing
+        end_time = int(time.time() // 60) * 60000 - 60000
+        if last_ts + 60000 > end_time:
+            return last_ts, 0, 0
+
+        # An empty answer is a request too
+        num_requests = 1
+        num_rows = 0
+        for i, page in enumerate(self.client.iter_historical_data(symbol=symbol, start_time=last_ts + 60000,
+                                                                  end_time=end_time)):
+            num_requests = i + 1
+            data = self._parse_candles(page)
+            if data.shape[0]:
+                self._write_data(symbol, data)
+                num_rows += data.shape[0]
+                last_ts = max(last_ts, int(data[:, 0].max()))
+
+        return last_ts, num_requests, num_rows
+
+    def backfill(self, symbol: str) -> Optional[Dict[str, StageMetrics]]:
+        """
+        Requests only the ranges listed as missing in the symbol's gap index, instead of the whole history.
+        Expected market closures are never requested, and missing ranges the exchange has no candles for are
+        marked as empty so the next backfill skips them. A range is only marked once all its windows were fetched
+        without error, a failed request is not taken for an empty answer.
+        """
+        if self.exchange == "oanda":
+            num_cols = 7
+        else:
+            num_cols = 6
+
+        with self._db_lock:
+            self.h5_db.create_dataset(symbol, num_cols)
+            gaps = self.h5_db.scan_gaps(symbol)
+            _, last_ts = self.h5_db.get_first_last_timestamp(symbol)
+
+        missing = gaps[gaps[:, 2] == GAP_MISSING, :2]
+
+        if missing.shape[0] == 0:
+            logger.info(f"{self.exchange} {symbol}: no gaps to backfill")
+            return None
+
+        missing_minutes = int(((missing[:, 1] - missing[:, 0]) // 60000 + 1).sum())
+        logger.info(f"{self.exchange} {symbol}: backfilling {missing.shape[0]} gaps, {missing_minutes} missing minutes")
+
+        pipeline = self._pipeline(symbol, last_ts)
+        try:
+            metrics = pipeline.run(self._gap_windows(missing, self.max_window_minutes))
+        finally:
+            self._flush_inserts(symbol)
+
+        # Concurrent collection: the rows have to reach the file before the gaps are scanned again
+        self._wait_for_writes(symbol)
+
+        failed = np.array(failed_windows(metrics), dtype=np.int64).reshape(-1, 2)
+        if symbol in self._write_failures:
+            # Rows lost by the writer thread would look like an empty answer
+            answered = missing[:0]
+        else:
+            overlaps = (failed[:, 0] <= missing[:, 1, np.newaxis]) & (failed[:, 1] >= missing[:, 0, np.newaxis])
+            answered = missing[~overlaps.any(axis=1)]
+
+        with self._db_lock:
+            self.h5_db.scan_gaps(symbol)
+            self.h5_db.mark_gaps_empty(symbol, answered)
+
+        self._log_failed_windows(symbol, metrics)
+
+        logger.info(f"{self.exchange} {symbol}: Backfilled {metrics['write'].rows} rows\n"
+                    + "\n".join(str(m) for m in metrics.values()) + f"\n{'-' * 80}")
+
+        return metrics
+
+    def _log_failed_windows(self, symbol: str, metrics: Dict[str, StageMetrics]):
+        failed = failed_windows(metrics)
+        if failed:
+            logger.error(f"{self.exchange} {symbol}: {len(failed)} windows failed and are incomplete: "
+                         + ", ".join(f"{ms_to_dt(start)} - {ms_to_dt(end)}" for start, end in failed))
+
+    def _pipeline(self, symbol: str, stored_until: Optional[float]) -> CollectionPipeline:
+        if stored_until is not None:
+            self._stored_until[symbol] = stored_until
+
+        return CollectionPipeline(
+            fetch=lambda start, end: self.client.iter_historical_data(symbol=symbol, start_time=start, end_time=end),
+            parse=self._parse_candles,
+            write=lambda data: self._write_data(symbol, data),
+            paged=True,
+        )
+
+    @staticmethod
+    def _gap_windows(gaps: np.ndarray, max_minutes: int) -> Generator[Tuple[int, int], None, None]:
+        for start, end in gaps:
+            while start <= end:
+                window_end = min(start + (max_minutes - 1) * 60000, end)
+                yield int(start), int(window_end)
+                start = window_end + 60000
+
+    def _collection_windows(self, symbol: str, from_time: int, oldest_ts: Optional[float],
+                            most_recent_ts: Optional[float]) -> Generator[Tuple[int, int], None, None]:
+        now_ts = dt_to_ms(datetime.now(timezone.utc)) - 60000
 
         # Initial Request
         if oldest_ts is None:
-            most_recent_ts = dt_to_ms(datetime.now(timezone.utc)) - 60000
-            oldest_ts = from_time
             logger.info(
-                f"Initial Request: oldest_ts: {ms_to_dt(oldest_ts)} | most_recent_ts: {ms_to_dt(most_recent_ts)} | from_time: {ms_to_dt(from_time)}\n{'-' * 80}")
-            oldest_ts = from_time
-            for start, end in self._generate_batches(oldest_ts, most_recent_ts):
-                logger.debug(f"Collecting symbol: {symbol}, start: {start}, end: {end}")
-                data.extend(self.client.get_historical_data(symbol=symbol, start_time=start, end_time=end))
-                if len(data) > 10000:
-                    self._write_data(symbol, data)
-                    data.clear()
-                time.sleep(1.1)
-
-            if len(data) == 0:
-                logger.warning(f"{self.exchange} {symbol}: no initial data found")
-                return
-            else:
-                logger.info(
-                    f"{self.exchange} {symbol}: Collected {len(data)} initial data from {ms_to_dt(data[0][0])} to {ms_to_dt(data[-1][0])}")
-
-                oldest_ts = data[0][0]
-                most_recent_ts = data[-1][0]
-                self._write_data(symbol, data)
-                data.clear()
+                f"Initial Request: most_recent_ts: {ms_to_dt(now_ts)} | from_time: {ms_to_dt(from_time)}\n{'-' * 80}")
+            yield from self._generate_batches(from_time, now_ts, self.max_window_minutes)
+            return
 
         # Most recent data
         logger.info(
             f"Most recent data: oldest_ts: {ms_to_dt(oldest_ts)} | most_recent_ts: {ms_to_dt(most_recent_ts)} | from_time: {ms_to_dt(from_time)}\n{'-' * 80}")
-        for start, end in self._generate_batches(int(most_recent_ts + 60000),
-                                                 dt_to_ms(datetime.now(timezone.utc)) - 60000):
-            logger.debug(f"Collecting symbol: {symbol}, start: {start}, end: {end}")
-            data.extend(self.client.get_historical_data(symbol=symbol, start_time=start, end_time=end))
-            if len(data) > 10000:
-                self._write_data(symbol, data)
-                data.clear()
-            time.sleep(1.1)
-
-        logger.info(
-            f"{self.exchange} {symbol}: Collected {len(data)} most recent data from {ms_to_dt(data[0][0])} to {ms_to_dt(data[-1][0])}")
-
-        self._write_data(symbol, data)
-        data.clear()
+        yield from self._generate_batches(int(most_recent_ts + 60000), now_ts, self.max_window_minutes)
 
         # Older data
-        logger.info(
-            f"Older Data: oldest_ts: {ms_to_dt(oldest_ts)} | most_recent_ts: {ms_to_dt(most_recent_ts)} | from_time: {ms_to_dt(from_time)}\n{'-' * 80}")
-        for start, end in self._generate_batches(from_time, oldest_ts - 60000):
-            logger.debug(f"symbol: {symbol} start: {start} end: {end}")
-            data.extend(self.client.get_historical_data(symbol=symbol, start_time=start, end_time=end))
-            if len(data) > 10000:
-                self._write_data(symbol, data)
-                data.clear()
-            time.sleep(1.1)
-
-        if len(data):
+        if from_time < oldest_ts:
             logger.info(
-                f"{self.exchange} {symbol}: Collected {len(data)} older data from {ms_to_dt(data[0][0])} to {ms_to_dt(data[-1][0])}")
-        else:
-            logger.info(
-                f"{self.exchange} {symbol}: Collected {len(data)} older data.")
+                f"Older Data: oldest_ts: {ms_to_dt(oldest_ts)} | most_recent_ts: {ms_to_dt(most_recent_ts)} | from_time: {ms_to_dt(from_time)}\n{'-' * 80}")
+            yield from self._generate_batches(from_time, int(oldest_ts - 60000), self.max_window_minutes)
 
-        self._write_data(symbol, data)
-        data.clear()
+    @staticmethod
+    def _parse_candles(raw) -> np.ndarray:
+        return np.asarray(raw, dtype="float64").reshape(len(raw), -1)
 
     def _write_data(self, symbol, data):
+        stored_until = self._stored_until.get(symbol)
+        if stored_until is not None and len(data) and data[0, 0] < stored_until:
+            # Older data and backfills land inside the stored history, where every insert rewrites the rows after
+            # it: they are written together by _flush_inserts so that a pass shifts the history once per
+            # insert_buffer_rows
+            buffer = self._insert_buffers.setdefault(symbol, [])
+            buffer.append(data)
+            if sum(len(b) for b in buffer) >= self.insert_buffer_rows:
+                self._flush_inserts(symbol, keep=True)
+            return
+
+        self._hand_over(symbol, data)
+
+    def _flush_inserts(self, symbol, keep: bool = False):
+        buffer = self._insert_buffers.pop(symbol, [])
+        if not keep:
+            self._stored_until.pop(symbol, None)
+
+        if buffer:
+            self._hand_over(symbol, np.concatenate(buffer))
+
+    def _hand_over(self, symbol, data):
+        if self._write_queue is not None:
+            # Concurrent collection: hand the batch over to the writer thread
+            if len(data):
+                self._write_queue.put((symbol, data))
+            return
+
+        with self._db_lock:
+            self._write_batches(symbol, data)
+
+    def _wait_for_writes(self, symbol):
+        """
+        Returns once the writer thread has written every batch handed over for the symbol so far. A marker queued
+        behind them is acknowledged by the writer, the batches the other symbols queue meanwhile aren't waited for.
+        """
+        if self._write_queue is None:
+            return
+
+        written = threading.Event()
+        self._write_queue.put((symbol, written))
+        written.wait()
+
+    def _write_batches(self, symbol, data):
+        # A single write: the pipeline already hands over appends in batches, and a buffered insert split here would
+        # shift the stored rows once per piece again
         if len(data):
-            batch_size = 10000
-            for i in range(0, len(data), batch_size):
-                batch = data[i:i + batch_size]
-                self.h5_db.write_data(symbol, batch)
+            self.h5_db.write_data(symbol, data)
         logger.info(f"Wrote {len(data)} rows to {self.exchange} {symbol}\n{'-' * 80}")
 
+    def _writer(self):
+        while True:
+            item = self._write_queue.get()
+            if item is None:
+                self._write_queue.task_done()
+                return
+
+            symbol, data = item
+            if isinstance(data, threading.Event):
+                # Marker of _wait_for_writes: the batches queued before it are written
+                data.set()
+                self._write_queue.task_done()
+                continue
+
+            try:
+                with self._db_lock:
+                    self._write_batches(symbol, data)
+            except Exception as e:
+                logger.error(f"{self.exchange} {symbol}: failed to write {len(data)} rows: {e}")
+                self._write_failures.add(symbol)
+            finally:
+                self._write_queue.task_done()
+
     @staticmethod
     def _generate_batches(from_timestamp_ms: int, to_timestamp_ms: int, max_minutes=5000) -> Tuple[int, int]:
         # Convert from and to milliseconds to datetime
@@ -1,94 +1,708 @@
-from typing import Union, List, Tuple
+from typing import Union, List, Tuple, Dict, Optional, Generator
 import logging
 import h5py
 import numpy as np
 import pandas as pd
+import os
 import time
 from models import BacktestResult
+from utils import TF_MS, aggregate_candles, resample_chunks, candles_frame
+from gaps import find_gaps, GAP_MISSING, GAP_EMPTY
+from frame_cache import FrameCache
 
 logger = logging.getLogger()
 
+METADATA_ATTRS = ("first_ts", "last_ts", "row_count", "sorted")
+
+COLUMNS = ["timestamp", "open", "high", "low", "close", "volume", "spread"]
+
+# Timeframes kept pre-aggregated next to the 1m data, under timeframes/<tf>/<symbol>
+PYRAMID_TFS = ["5m", "15m", "30m", "1h", "4h", "12h", "1d"]
+
+# Rows per chunk of the columnar layout: ~45 days of 1m candles, 512KB per 8 byte column
+COLUMNAR_CHUNK_ROWS = 65536
+
+# Oldest file format able to switch to single-writer/multi-reader (SWMR) mode, needs HDF5 >= 1.10 to read
+SWMR_LIBVER = ("v110", "latest")
+
+
+class ColumnarTable:
+    """
+    Row-oriented view over a symbol stored in the columnar layout: one chunked dataset per column under the
+    symbol group, with int64 timestamps. Supports the subset of the h5py.Dataset API used by Hdf5Client
+    (shape, resize, row slices, [row, col] cells) so both layouts share the same read and write paths.
+    """
+
+    def __init__(self, group: h5py.Group):
+        self.group = group
+        self.columns = [c for c in COLUMNS if c in group]
+        self.datasets = {c: group[c] for c in self.columns}
+
+    @property
+    def attrs(self) -> h5py.AttributeManager:
+        return self.group.attrs
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        # A SWMR reader can see the columns mid-append, only the rows present in all of them count
+        return min(self.datasets[c].shape[0] for c in self.columns), len(self.columns)
+
+    def refresh(self):
+        for c in self.columns:
+            self.datasets[c].refresh()
+
+    def resize(self, size: int, axis: int = 0):
+        for c in self.columns:
+            self.datasets[c].resize((size,))
+
+    def read_columns(self, rows: slice, columns: List[str]) -> Dict[str, np.ndarray]:
+        return {c: self.datasets[c][rows] for c in columns}
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            rows, col = key
+            return self.datasets[self.columns[col]][rows].astype("float64")
+
+        return np.column_stack([self.datasets[c][key].astype("float64") for c in self.columns])
+
+    def __setitem__(self, key, value: np.ndarray):
+        for i, c in enumerate(self.columns):
+            column = value[:, i]
+            if c == "timestamp":
+                column = np.rint(column)
+            self.datasets[c][key] = column.astype(self.datasets[c].dtype)
+
 
 class Hdf5Client:
-    def __init__(self, exchange: str):
-        self.hf = h5py.File(f"data/{exchange}.h5", 'a')
-        self.hf.flush()
+    def __init__(self, exchange: str, layout: str = "matrix", compression: Optional[str] = "gzip",
+                 float32: bool = False, mode: str = "a"):
+        """
+        layout: how new symbols are stored, "matrix" (one (N, 6|7) float64 dataset) or "columnar" (one chunked
+        dataset per column, see ColumnarTable). A migrated file records its layout and that takes precedence.
+        compression: filter for columnar datasets. Use "gzip" or None if the C++ library has to read the file,
+        "lzf" is only available through h5py.
+        float32: store volume and spread as float32 in the columnar layout.
+        mode: "a" opens the file for reading and writing, HDF5 then locks it against every other process. "r" opens
+        it read-only as a SWMR reader, any number of which can share the file with each other and with a writer
+        in SWMR mode (see start_swmr).
+        """
+        if mode == "r":
+            self.hf = h5py.File(f"data/{exchange}.h5", 'r', swmr=True)
+        else:
+            self.hf = h5py.File(f"data/{exchange}.h5", 'a', libver=SWMR_LIBVER)
+            self.hf.flush()
+
+        # Shared with other processes: no objects created or deleted, metadata attributes may lag (see get_metadata)
+        self.swmr = mode == "r"
+        self._tables: Dict[str, Union[h5py.Dataset, ColumnarTable]] = dict()
+
+        self.exchange = exchange
+        self.layout = self.hf.attrs.get("layout", layout)
+        self.compression = compression
+        self.float32 = float32
+
+        self.frame_cache = FrameCache(exchange)
 
     def create_dataset(self, symbol: str, num_cols=6):
-        if symbol not in self.hf.keys():
-            # name, shape (row, columns), maxshape (row: unlimited, columns: 6)
-            self.hf.create_dataset(symbol, (0, num_cols), maxshape=(None, num_cols), dtype="float64")
+        if symbol not in self.hf:
+            self._require_exclusive(f"create {symbol}")
+            if self.layout == "columnar":
+                self._create_columnar(self.hf, symbol, COLUMNS[:num_cols], self.compression, self.float32)
+            else:
+                # name, shape (row, columns), maxshape (row: unlimited, columns: 6)
+                self.hf.create_dataset(symbol, (0, num_cols), maxshape=(None, num_cols), dtype="float64")
+            self._set_metadata(symbol, None, None, 0, True)
             self.hf.flush()
 
-    def write_data(self, symbol: str, data: List[Tuple]):
+    @staticmethod
+    def _create_columnar(hf: h5py.File, symbol: str, columns: List[str], compression: Optional[str],
+                         float32: bool) -> h5py.Group:
+        group = hf.create_group(symbol)
+        for c in columns:
+            if c == "timestamp":
+                dtype = "int64"
+            elif c in ("volume", "spread") and float32:
+                dtype = "float32"
+            else:
+                dtype = "float64"
+            group.create_dataset(c, (0,), maxshape=(None,), dtype=dtype, chunks=(COLUMNAR_CHUNK_ROWS,),
+                                 compression=compression, shuffle=compression is not None)
+        return group
+
+    def _table(self, symbol: str) -> Union[h5py.Dataset, ColumnarTable]:
+        if self.swmr and self.hf.mode == "r":
+            # A SWMR reader keeps one handle per dataset and refreshes it to pick up the rows appended by the
+            # writer. HDF5 corrupts its cache if another handle to the same dataset is open during a refresh.
+            if symbol not in self._tables:
+                node = self.hf[symbol]
+                self._tables[symbol] = ColumnarTable(node) if isinstance(node, h5py.Group) else node
+            self._tables[symbol].refresh()
+            return self._tables[symbol]
+
+        node = self.hf[symbol]
+        if isinstance(node, h5py.Group):
+            return ColumnarTable(node)
+        return node
+
+    def _require_exclusive(self, action: str):
+        if self.swmr:
+            raise ValueError(f"Can't {action} in data/{self.exchange}.h5 while it is shared in SWMR mode")
+
+    def _symbols(self) -> List[str]:
+        """
+        Candle datasets of the file, in either layout.
+        """
+        return [k for k, node in self.hf.items() if k not in ("timeframes", "gaps")
+                and (isinstance(node, h5py.Group) or node.ndim == 2)]
+
+    def start_swmr(self):
+        """
+        Switches the file to single-writer/multi-reader mode: this client keeps appending candles while other
+        processes read consistent data through Hdf5Client(exchange, mode="r") or the C++ library, none of them
+        blocking the others. Meant for the append-only tail_sync(), collection and backfill need exclusive access.
+
+        HDF5 forbids creating or deleting objects from then on, so every symbol must exist beforehand: the
+        symbols are sorted and their pre-aggregated timeframes created here. Metadata attributes are not
+        written in this mode either, get_metadata() reads the first/last timestamp off the sorted rows instead.
+        The file must have been created by HDF5 1.10 or later, see migrate_to_swmr().
+        """
+        for symbol in self._symbols():
+            if not self.get_metadata(symbol)["sorted"]:
+                self.sort_dataset(symbol)
+
+            if any(self._timeframe_path(symbol, tf) not in self.hf for tf in PYRAMID_TFS):
+                self.rebuild_timeframes(symbol)
+                # Empty symbols get empty timeframes, filled as the rows come in
+                for tf in PYRAMID_TFS:
+                    self.create_dataset(self._timeframe_path(symbol, tf), self._table(symbol).shape[1])
+
+        self.hf.flush()
+        try:
+            self.hf.swmr_mode = True
+        except RuntimeError as e:
+            raise ValueError(f"data/{self.exchange}.h5 is in a file format older than HDF5 1.10, run "
+                             f"migrate_to_swmr() first: {e}")
+        self.swmr = True
+
+        logger.info(f"data/{self.exchange}.h5 open in SWMR mode")
+
+    def write_data(self, symbol: str, data: List[Tuple], merge: bool = True):
+        """
+        merge=True keeps the dataset sorted by timestamp, unique and free of NaN rows: the batch is merged into
+        the existing rows in a single pass whether it lands before, after or in the middle of them. Where a
+        timestamp already exists the new row wins. merge=False blindly appends the rows.
+
+        The pre-aggregated timeframes of the symbol are updated for the buckets touched by the batch.
+        """
+
+        data_array = np.array(data, dtype="float64")
+
+        if data_array.shape[0] == 0 or not self._write_rows(symbol, data_array, merge):
+            logger.warning(f"{symbol}: No data to insert")
+            return
+
+        self._bump_version(symbol)
+
+        if self.get_metadata(symbol)["sorted"]:
+            self._update_timeframes(symbol, np.nanmin(data_array[:, 0]), np.nanmax(data_array[:, 0]))
+        else:
+            # The pyramid is rebuilt from scratch once the 1m data is sorted again
+            self._drop_timeframes(symbol)
+
+        logger.info(f"Saved {len(data)} {symbol} records to database")
+
+    def _write_rows(self, path: str, data_array: np.ndarray, merge: bool) -> bool:
 
-        min_ts, max_ts = self.get_first_last_timestamp(symbol)
+        if not merge:
+            self._append_rows(path, data_array)
+            return True
 
-        if min_ts is None:
-            min_ts = float("inf")
-            max_ts = 0
+        data_array = self._merge_rows(data_array[~np.isnan(data_array).any(axis=1)])
 
-        # filtered_data = []
-        #
-        # for d in data:
-        #     if d[0] < min_ts:
-        #         filtered_data.append(d)
-        #     elif d[0] > max_ts:
-        #         filtered_data.append(d)
-        #
-        # if len(filtered_data) == 0:
-        #     logger.warning(f"{symbol}: No data to insert")
-        #     return
+        if data_array.shape[0] == 0:
+            return False
+
+        metadata = self.get_metadata(path)
+
+        if metadata["row_count"] > 0 and not metadata["sorted"]:
+            self.sort_dataset(path)
+            metadata = self.get_metadata(path)
+
+        if self.swmr and metadata["row_count"] > 0 and data_array[0, 0] < metadata["last_ts"]:
+            # Only appends in SWMR mode, an insert would shift rows under the readers. Older pyramid buckets
+            # re-aggregated from unchanged 1m rows are skipped silently.
+            older = data_array[:, 0] < metadata["last_ts"]
+            if not path.startswith("timeframes/"):
+                logger.warning(f"{path}: {older.sum()} rows older than the last one skipped in SWMR mode")
+            data_array = data_array[~older]
+
+            if data_array.shape[0] == 0:
+                return False
+
+        if metadata["row_count"] == 0 or data_array[0, 0] > metadata["last_ts"]:
+            self._append_rows(path, data_array)
+        else:
+            self._insert_rows(path, data_array)
+
+        return True
+
+    def _update_timeframes(self, symbol: str, from_ts: float, to_ts: float):
+        """
+        Re-aggregates the buckets of every pyramid timeframe that overlap [from_ts, to_ts] from the 1m rows.
+        A single 1m read covering the widest (1d) buckets serves all the timeframes.
+        """
+        if any(self._timeframe_path(symbol, tf) not in self.hf for tf in PYRAMID_TFS):
+            self.rebuild_timeframes(symbol)
+            return
+
+        widest_ms = TF_MS[PYRAMID_TFS[-1]]
+        from_ts = from_ts - from_ts % widest_ms
+        to_ts = to_ts - to_ts % widest_ms + widest_ms - 1
+
+        dataset = self._table(symbol)
+        start, stop = self._find_row_bounds(dataset, from_ts, to_ts)
+        rows = dataset[start:stop]
+
+        for tf in PYRAMID_TFS:
+            self._write_rows(self._timeframe_path(symbol, tf), aggregate_candles(rows, TF_MS[tf]), merge=True)
+
+    def rebuild_timeframes(self, symbol: str, window_days: int = 30):
+        """
+        Builds the pre-aggregated 5m ... 1d datasets of a symbol from its whole 1m history, reading it in
+        day-aligned windows so that no bucket is split between two reads.
+        """
+        self._drop_timeframes(symbol)
+
+        metadata = self.get_metadata(symbol)
+        if metadata["row_count"] == 0 or not metadata["sorted"]:
+            return
+
+        dataset = self._table(symbol)
+        for tf in PYRAMID_TFS:
+            self.create_dataset(self._timeframe_path(symbol, tf), dataset.shape[1])
+
+        window_ms = window_days * TF_MS["1d"]
+        window_start = metadata["first_ts"] - metadata["first_ts"] % TF_MS["1d"]
+
+        while window_start <= metadata["last_ts"]:
+            start, stop = self._find_row_bounds(dataset, window_start, window_start + window_ms - 1)
+            rows = dataset[start:stop]
+            for tf in PYRAMID_TFS:
+                self._write_rows(self._timeframe_path(symbol, tf), aggregate_candles(rows, TF_MS[tf]), merge=True)
+            window_start += window_ms
+
+        logger.info(f"Rebuilt the {', '.join(PYRAMID_TFS)} timeframes of {symbol}")
+
+    def _drop_timeframes(self, symbol: str):
+        for tf in PYRAMID_TFS:
+            if self._timeframe_path(symbol, tf) in self.hf:
+                self._require_exclusive(f"drop the timeframes of {symbol}")
+                del self.hf[self._timeframe_path(symbol, tf)]
+
+    @staticmethod
+    def _timeframe_path(symbol: str, tf: str) -> str:
+        return f"timeframes/{tf}/{symbol}"
+
+    def sort_dataset(self, symbol: str):
+        """
+        One-off rewrite of a dataset written before merge-on-write: sorts it by timestamp, removes duplicate
+        timestamps (keeping the last written row) and drops rows containing NaN.
+        """
+        self._require_exclusive(f"sort {symbol}")
+
+        dataset = self._table(symbol)
+        existing_data = dataset[:]
+        existing_data = self._merge_rows(existing_data[~np.isnan(existing_data).any(axis=1)])
+
+        dataset.resize(existing_data.shape[0], axis=0)
+        dataset[:] = existing_data
+        self._bump_version(symbol)
+
+        if existing_data.shape[0]:
+            self._set_metadata(symbol, existing_data[0, 0], existing_data[-1, 0], existing_data.shape[0], True)
+        else:
+            self._set_metadata(symbol, None, None, 0, True)
+        self.hf.flush()
+
+        logger.info(f"Sorted {symbol}: {existing_data.shape[0]} unique records")
+
+    def _append_rows(self, symbol: str, data_array: np.ndarray):
+        dataset = self._table(symbol)
+        metadata = self.get_metadata(symbol)
+        num_rows = metadata["row_count"]
+        timestamps = data_array[:, 0]
+
+        # Keep track of whether the rows are still sorted, unique and clean so readers can trust the order
+        is_sorted = bool(not np.isnan(data_array).any() and np.all(np.diff(timestamps) > 0))
+        if num_rows > 0:
+            is_sorted = is_sorted and metadata["sorted"] and timestamps[0] > metadata["last_ts"]
+            first_ts = np.nanmin([metadata["first_ts"], np.nanmin(timestamps)])
+            last_ts = np.nanmax([metadata["last_ts"], np.nanmax(timestamps)])
+        else:
+            first_ts = np.nanmin(timestamps)
+            last_ts = np.nanmax(timestamps)
 
-        data_array = np.array(data)
         # Create space in file
-        self.hf[symbol].resize(self.hf[symbol].shape[0] + data_array.shape[0], axis=0)
+        dataset.resize(num_rows + data_array.shape[0], axis=0)
         # Write the data
-        self.hf[symbol][-data_array.shape[0]:] = data_array
+        dataset[-data_array.shape[0]:] = data_array
+        # Update the metadata last: a row_count that does not match the dataset marks it as stale
+        self._set_metadata(symbol, first_ts, last_ts, dataset.shape[0], is_sorted)
         # Flush the database
         self.hf.flush()
 
-        logger.info(f"Saved {len(data)} {symbol} records to database")
+    def _insert_rows(self, symbol: str, data_array: np.ndarray):
+        """
+        Merges a sorted, unique batch into a sorted dataset. Rows before the batch are left untouched, the
+        overlapping rows are merged and the rows after it are shifted by the number of new timestamps.
+        """
+        dataset = self._table(symbol)
+        num_rows = dataset.shape[0]
+
+        start, stop = self._find_row_bounds(dataset, data_array[0, 0], data_array[-1, 0])
+        merged = self._merge_rows(np.concatenate([dataset[start:stop], data_array]))
+
+        if merged.shape[0] == stop - start:
+            dataset[start:stop] = merged
+        else:
+            tail = dataset[stop:]
+            dataset.resize(num_rows + merged.shape[0] - (stop - start), axis=0)
+            dataset[start:start + merged.shape[0]] = merged
+            if tail.shape[0]:
+                dataset[start + merged.shape[0]:] = tail
+
+        self._set_metadata(symbol, dataset[0, 0], dataset[-1, 0], dataset.shape[0], True)
+        self.hf.flush()
+
+    @staticmethod
+    def _merge_rows(data_array: np.ndarray) -> np.ndarray:
+        # Stable sort so that, for equal timestamps, the row that came last in the input is kept
+        data_array = data_array[np.argsort(data_array[:, 0], kind="stable")]
+        keep = np.append(data_array[1:, 0] != data_array[:-1, 0], True)
+        return data_array[keep]
+
+    def get_data(self, symbol: str, from_time: int, to_time: int,
+                 columns: Optional[List[str]] = None) -> Union[None, pd.DataFrame]:
+        """
+        columns: subset of open/high/low/close/volume/spread to return, all of them by default. With the
+        columnar layout only those columns are read from disk.
+        """
+
+        start_query = time.time()
+
+        dataset = self._table(symbol)
+
+        if dataset.shape[0] == 0:
+            return None
+
+        available = COLUMNS[:dataset.shape[1]]
+        columns = [c for c in available[1:] if columns is None or c in columns]
+
+        if self.get_metadata(symbol)["sorted"]:
+            # Only read the hyperslab covering the requested time range
+            start, stop = self._find_row_bounds(dataset, from_time, to_time)
+            if isinstance(dataset, ColumnarTable):
+                data = dataset.read_columns(slice(start, stop), ["timestamp"] + columns)
+            else:
+                rows = dataset[start:stop]
+                data = {c: rows[:, available.index(c)] for c in ["timestamp"] + columns}
+        else:
+            existing_data = dataset[:]
+            existing_data = existing_data[(existing_data[:, 0] >= from_time) & (existing_data[:, 0] <= to_time)]
+            existing_data = existing_data[np.argsort(existing_data[:, 0], kind="stable")]
+            data = {c: existing_data[:, available.index(c)] for c in ["timestamp"] + columns}
+
+        index = pd.to_datetime(data.pop("timestamp").astype(np.int64), unit='ms')
+        df = pd.DataFrame(data, index=index, columns=columns)
+        df.index.name = "timestamp"
+
+        query_time = round((time.time() - start_query), 2)
+
+        logger.info(f"Retrieved {len(df.index)} {symbol} in {query_time} seconds")
+
+        return df
+
+    def iter_chunks(self, symbol: str, from_time: int, to_time: int, chunk_rows: int = COLUMNAR_CHUNK_ROWS,
+                    columns: Optional[List[str]] = None) -> Generator[np.ndarray, None, None]:
+        """
+        Streams the candles between from_time and to_time as sorted (N, 1 + len(columns)) float64 blocks of at most
+        chunk_rows rows: the timestamp, then the requested columns in storage order (all of them by default).
+        Only one block is held in memory at a time, whatever the length of the range.
+        """
+        dataset = self._table(symbol)
+
+        if dataset.shape[0] == 0:
+            return
+
+        available = COLUMNS[:dataset.shape[1]]
+        names = ["timestamp"] + [c for c in available[1:] if columns is None or c in columns]
+
+        if not self.get_metadata(symbol)["sorted"]:
+            logger.warning(f"{symbol} is not sorted, loading the whole range. Run sort_dataset() to stream it.")
+            data = dataset[:]
+            data = data[(data[:, 0] >= from_time) & (data[:, 0] <= to_time)]
+            data = data[np.argsort(data[:, 0], kind="stable")][:, [available.index(c) for c in names]]
+            for i in range(0, data.shape[0], chunk_rows):
+                yield data[i:i + chunk_rows]
+            return
+
+        start, stop = self._find_row_bounds(dataset, from_time, to_time)
+
+        for i in range(start, stop, chunk_rows):
+            rows = slice(i, min(i + chunk_rows, stop))
+            if isinstance(dataset, ColumnarTable):
+                block = dataset.read_columns(rows, names)
+                yield np.column_stack([block[c].astype(np.float64) for c in names])
+            elif len(names) == len(available):
+                yield dataset[rows]
+            else:
+                yield dataset[rows][:, [available.index(c) for c in names]]
+
+    def get_resampled(self, symbol: str, tf: str, from_time: int, to_time: int,
+                      columns: Optional[List[str]] = None, cache: bool = True) -> Union[None, pd.DataFrame]:
+        """
+        Same result as resample_timeframe(get_data(...), tf), read from the pre-aggregated timeframe where
+        possible. Buckets entirely inside the range come from the stored timeframe, the partial buckets at
+        either end are aggregated from the 1m rows. Other timeframes are aggregated while streaming the 1m rows
+        with iter_chunks().
+        cache: look the frame up in the on-disk cache (see FrameCache) first and store it there when built.
+        """
+        if not cache:
+            return self._resample(symbol, tf, from_time, to_time, columns)
+
+        metadata = self.get_metadata(symbol)
+        key = FrameCache.key(symbol, tf, from_time, to_time, columns, self.get_version(symbol),
+                             metadata["row_count"], metadata["last_ts"])
+
+        df = self.frame_cache.get(key)
+        if df is not None:
+            logger.info(f"Retrieved {len(df.index)} {symbol} {tf} candles from the cache")
+            return df
 
-    def get_data(self, symbol: str, from_time: int, to_time: int) -> Union[None, pd.DataFrame]:
+        df = self._resample(symbol, tf, from_time, to_time, columns)
+        if df is not None:
+            self.frame_cache.put(key, df)
+
+        return df
+
+    def _resample(self, symbol: str, tf: str, from_time: int, to_time: int,
+                  columns: Optional[List[str]] = None) -> Union[None, pd.DataFrame]:
+        path = self._timeframe_path(symbol, tf)
 
         start_query = time.time()
 
-        existing_data = self.hf[symbol][:]
+        tf_ms = TF_MS[tf]
+
+        if tf not in PYRAMID_TFS or path not in self.hf or not self.get_metadata(symbol)["sorted"]:
+            # Aggregated from the 1m rows, streamed so only one block of them is in memory at a time
+            if self._table(symbol).shape[0] == 0:
+                return None
+
+            names = [c for c in COLUMNS[1:self._table(symbol).shape[1]] if columns is None or c in columns]
+            blocks = list(resample_chunks(self.iter_chunks(symbol, from_time, to_time, columns=columns), tf_ms, names))
+            data = np.concatenate(blocks) if blocks else np.empty((0, len(names) + 1))
+
+            return self._candles_frame(symbol, tf, data, ["timestamp"] + names, columns, start_query)
 
-        if len(existing_data) == 0:
+        first_bucket = -(-from_time // tf_ms) * tf_ms
+        last_bucket = (to_time - tf_ms + 1) // tf_ms * tf_ms
+
+        dataset = self._table(symbol)
+        timeframe = self._table(path)
+
+        if dataset.shape[0] == 0:
             return None
 
-        data = sorted(existing_data, key=lambda x: x[0])
-        data = np.array(data)
+        start, stop = self._find_row_bounds(dataset, from_time, first_bucket - 1)
+        head = aggregate_candles(dataset[start:stop], tf_ms)
+        start, stop = self._find_row_bounds(timeframe, first_bucket, last_bucket)
+        middle = timeframe[start:stop]
+        start, stop = self._find_row_bounds(dataset, max(last_bucket + tf_ms, first_bucket), to_time)
+        tail = aggregate_candles(dataset[start:stop], tf_ms)
 
-        if data.shape[1] == 7:
-            df = pd.DataFrame(data, columns=["timestamp", "open", "high", "low", "close", "volume", "spread"])
-        else:
-            df = pd.DataFrame(data, columns=["timestamp", "open", "high", "low", "close", "volume"])
+        data = np.concatenate([head, middle, tail])
 
-        df = df[(df['timestamp'] >= from_time) & (df['timestamp'] <= to_time)]
+        return self._candles_frame(symbol, tf, data, COLUMNS[:data.shape[1]], columns, start_query)
+
+    def _candles_frame(self, symbol: str, tf: str, data: np.ndarray, available: List[str],
+                       columns: Optional[List[str]], start_query: float) -> pd.DataFrame:
+        """
+        DataFrame of aggregated candles laid out like resample_timeframe() output.
+        """
+        columns = [c for c in COLUMNS[1:] if (columns is None or c in columns) and c in available]
 
-        df['timestamp'] = pd.to_datetime(df['timestamp'].values.astype(np.int64), unit='ms')
-        df.set_index('timestamp', drop=True, inplace=True)
+        df = candles_frame(data[:, 0], {c: data[:, available.index(c)] for c in columns}, tf)
+        df.index.name = "timestamp"
 
         query_time = round((time.time() - start_query), 2)
 
-        logger.info(f"Retrieved {len(df.index)} {symbol} in {query_time} seconds")
+        logger.info(f"Retrieved {len(df.index)} {symbol} {tf} candles in {query_time} seconds")
 
         return df
 
+    def get_version(self, symbol: str) -> int:
+        """
+        Stamp changed by every write to the symbol, the resampled frames cached for another stamp are stale.
+        A random value rather than a counter, so a deleted and recollected file doesn't reuse old stamps.
+        """
+        return int(self._table(symbol).attrs.get("version", 0))
+
+    def _bump_version(self, symbol: str):
+        if self.swmr:
+            # Not written in SWMR mode, the cache keys also hold the row count and last timestamp which change
+            # with every append
+            return
+        self.hf[symbol].attrs["version"] = np.int64(int.from_bytes(os.urandom(8), "little") >> 1)
+
+    def get_metadata(self, symbol: str) -> Dict:
+        """
+        First/last timestamp, row count and sortedness of a symbol, read from the dataset attributes in O(1).
+        Datasets written before the attributes existed (or interrupted mid-write) are scanned once and repaired.
+        """
+        dataset = self._table(symbol)
+        attrs = dataset.attrs
+
+        if all(k in attrs for k in METADATA_ATTRS) and attrs["row_count"] == dataset.shape[0]:
+            row_count = int(attrs["row_count"])
+            return {
+                "first_ts": float(attrs["first_ts"]) if row_count else None,
+                "last_ts": float(attrs["last_ts"]) if row_count else None,
+                "row_count": row_count,
+                "sorted": bool(attrs["sorted"]),
+            }
+
+        if self.swmr and attrs.get("sorted", 0):
+            # Appended to in SWMR mode, which leaves the attributes behind but keeps the rows sorted
+            row_count = dataset.shape[0]
+            return {
+                "first_ts": float(dataset[0, 0]) if row_count else None,
+                "last_ts": float(dataset[row_count - 1, 0]) if row_count else None,
+                "row_count": row_count,
+                "sorted": True,
+            }
+
+        return self._refresh_metadata(symbol)
+
+    def _refresh_metadata(self, symbol: str) -> Dict:
+        dataset = self._table(symbol)
+        row_count = dataset.shape[0]
+
+        if row_count == 0:
+            first_ts, last_ts, is_sorted = None, None, True
+        else:
+            existing_data = dataset[:]
+            timestamps = existing_data[:, 0]
+            first_ts = float(np.nanmin(timestamps))
+            last_ts = float(np.nanmax(timestamps))
+            is_sorted = bool(not np.isnan(existing_data).any() and np.all(np.diff(timestamps) > 0))
+
+        if self.hf.mode == "r+" and not self.swmr:
+            self._set_metadata(symbol, first_ts, last_ts, row_count, is_sorted)
+            self.hf.flush()
+
+        return {"first_ts": first_ts, "last_ts": last_ts, "row_count": row_count, "sorted": is_sorted}
+
+    def _set_metadata(self, symbol: str, first_ts: Optional[float], last_ts: Optional[float], row_count: int,
+                      is_sorted: bool):
+        if self.swmr:
+            # HDF5 doesn't support attribute writes in SWMR mode, see get_metadata
+            return
+
+        attrs = self.hf[symbol].attrs
+        attrs["first_ts"] = np.nan if first_ts is None else float(first_ts)
+        attrs["last_ts"] = np.nan if last_ts is None else float(last_ts)
+        # Stored as an integer rather than h5py's boolean enum so the C++ Database can read it
+        attrs["sorted"] = np.int8(is_sorted)
+        # Written last, see get_metadata
+        attrs["row_count"] = int(row_count)
+
+    @staticmethod
+    def _find_row_bounds(dataset: Union[h5py.Dataset, ColumnarTable], from_time: int, to_time: int) -> Tuple[int, int]:
+        """
+        Binary search the timestamp column of a sorted dataset, reading one cell per step.
+        Returns the [start, stop) row slice where from_time <= timestamp <= to_time.
+        """
+
+        def bisect(value: float, right: bool) -> int:
+            lo, hi = 0, dataset.shape[0]
+            while lo < hi:
+                mid = (lo + hi) // 2
+                ts = dataset[mid, 0]
+                if ts < value or (right and ts == value):
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return lo
+
+        start = bisect(from_time, right=False)
+        stop = bisect(to_time, right=True)
+
+        return start, max(start, stop)
+
+    def scan_gaps(self, symbol: str) -> np.ndarray:
+        """
+        Rebuilds the gap index of a symbol (gaps/<symbol>) from its timestamp column and returns it as an
+        (N, 3) int64 array of [first missing timestamp, last missing timestamp, kind], see gaps.py.
+        Gaps already marked GAP_EMPTY by a previous backfill keep that mark.
+        """
+        metadata = self.get_metadata(symbol)
+
+        if metadata["row_count"] == 0:
+            gaps = np.empty((0, 3), dtype=np.int64)
+        else:
+            if not metadata["sorted"]:
+                self.sort_dataset(symbol)
+            gaps = find_gaps(self._table(symbol)[:, 0], self.exchange)
+
+        empty = self.get_gaps(symbol)
+        empty = empty[empty[:, 2] == GAP_EMPTY]
+        if empty.shape[0] and gaps.shape[0]:
+            pos = np.minimum(np.searchsorted(empty[:, 0], gaps[:, 0]), empty.shape[0] - 1)
+            gaps[(empty[pos, 0] == gaps[:, 0]) & (empty[pos, 1] == gaps[:, 1]), 2] = GAP_EMPTY
+
+        self._write_gaps(symbol, gaps)
+
+        return gaps
+
+    def get_gaps(self, symbol: str) -> np.ndarray:
+        path = f"gaps/{symbol}"
+        if path not in self.hf:
+            return np.empty((0, 3), dtype=np.int64)
+        return self.hf[path][:]
+
+    def mark_gaps_empty(self, symbol: str, requested: np.ndarray):
+        """
+        Marks the missing gaps lying inside the requested [start, end] ranges as GAP_EMPTY: the exchange was
+        asked for them and returned nothing.
+        """
+        gaps = self.get_gaps(symbol)
+        if gaps.shape[0] == 0 or requested.shape[0] == 0:
+            return
+
+        requested = requested[np.argsort(requested[:, 0])]
+        pos = np.searchsorted(requested[:, 0], gaps[:, 0], side="right") - 1
+        inside = (pos >= 0) & (gaps[:, 1] <= requested[np.maximum(pos, 0), 1])
+        gaps[inside & (gaps[:, 2] == GAP_MISSING), 2] = GAP_EMPTY
+
+        self._write_gaps(symbol, gaps)
+
+    def _write_gaps(self, symbol: str, gaps: np.ndarray):
+        self._require_exclusive(f"write the gap index of {symbol}")
+
+        path = f"gaps/{symbol}"
+        if path in self.hf:
+            del self.hf[path]
+        self.hf.create_dataset(path, data=gaps.astype(np.int64).reshape(-1, 3))
+        self.hf.flush()
+
     def get_first_last_timestamp(self, symbol: str, ) -> Union[Tuple[None, None], Tuple[float, float]]:
 
-        existing_data = self.hf[symbol][:]
+        metadata = self.get_metadata(symbol)
 
-        if len(existing_data) == 0:
+        if metadata["row_count"] == 0:
             return None, None
 
-        first_ts = min(existing_data, key=lambda x: x[0])[0]
-        last_ts = max(existing_data, key=lambda x: x[0])[0]
-
-        return first_ts, last_ts
+        return metadata["first_ts"], metadata["last_ts"]
 
     # WIP - adding optimised parameters
     def write_optimised_parameters(self, symbol: str, results: List[BacktestResult]):
@@ -135,4 +749,70 @@ class Hdf5Client:
             del self.hf[symbol]
 
         self.hf.create_dataset(symbol, data=data)
-        self.hf.flush()
\ No newline at end of file
+        self.hf.flush()
+
+def migrate_to_columnar(exchange: str, compression: Optional[str] = "gzip", float32: bool = False,
+                        batch_size: int = 1_000_000):
+    """
+    Converts data/<exchange>.h5 to the columnar layout. The new file is built next to the old one and swapped
+    in at the end, the original is kept as data/<exchange>.h5.bak. Datasets that are not candle matrices
+    (e.g. optimised parameters) are copied unchanged.
+    """
+    source = Hdf5Client(exchange)
+
+    # Left over by an interrupted migration, its symbols would be appended to
+    if os.path.exists(f"data/{exchange}.columnar.h5"):
+        os.remove(f"data/{exchange}.columnar.h5")
+
+    target = Hdf5Client(f"{exchange}.columnar", layout="columnar", compression=compression, float32=float32)
+    target.hf.attrs["layout"] = "columnar"
+
+    for symbol in list(source.hf.keys()):
+        node = source.hf[symbol]
+
+        # Pre-aggregated timeframes are rebuilt by write_data in the new layout
+        if symbol == "timeframes":
+            continue
+
+        if not isinstance(node, h5py.Dataset) or node.ndim != 2:
+            source.hf.copy(node, target.hf, name=symbol)
+            continue
+
+        target.create_dataset(symbol, node.shape[1])
+
+        if source.get_metadata(symbol)["sorted"]:
+            for i in range(0, node.shape[0], batch_size):
+                target.write_data(symbol, node[i:i + batch_size])
+        elif node.shape[0]:
+            target.write_data(symbol, node[:])
+
+        logger.info(f"Migrated {exchange} {symbol}: {target.get_metadata(symbol)['row_count']} rows")
+
+    source.hf.close()
+    target.hf.close()
+
+    os.replace(f"data/{exchange}.h5", f"data/{exchange}.h5.bak")
+    os.replace(f"data/{exchange}.columnar.h5", f"data/{exchange}.h5")
+
+
+def migrate_to_swmr(exchange: str):
+    """
+    Rewrites data/<exchange>.h5 in the HDF5 1.10 file format, the oldest one that can be shared in SWMR mode
+    (see Hdf5Client.start_swmr). Files created by this version of Hdf5Client already are. Every object is copied
+    as is, the original is kept as data/<exchange>.h5.bak.
+    """
+    source = h5py.File(f"data/{exchange}.h5", 'r')
+    target = h5py.File(f"data/{exchange}.swmr.h5", 'w', libver=SWMR_LIBVER)
+
+    for key, value in source.attrs.items():
+        target.attrs[key] = value
+
+    for name in source.keys():
+        source.copy(source[name], target, name=name)
+        logger.info(f"Migrated {exchange} {name}")
+
+    source.close()
+    target.close()
+
+    os.replace(f"data/{exchange}.h5", f"data/{exchange}.h5.bak")
+    os.replace(f"data/{exchange}.swmr.h5", f"data/{exchange}.h5")
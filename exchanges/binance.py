@@ -1,72 +1,206 @@
 # Course code
 from typing import *
 import logging
+import time
 
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+
+from rate_limiter import get_rate_limiter
+from symbol_cache import SymbolCache
 
 
 logger = logging.getLogger()
 
+# Published REQUEST_WEIGHT limits per minute, compared with the X-MBX-USED-WEIGHT-1M response header
+WEIGHT_LIMITS = {"spot": 6000, "futures": 2400}
+
+# Largest page of klines per request
+KLINES_LIMITS = {"spot": 1000, "futures": 1500}
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
 
 class BinanceClient:
-    def __init__(self, futures=False):
+    def __init__(self, futures=False, base_url: Optional[str] = None, pool_size: int = 16):
 
         self.futures = futures
 
         if self.futures:
             self._base_url = "https://fapi.binance.com"
+            self.rate_limiter = get_rate_limiter("binance_futures")
+            self._weight_limit = WEIGHT_LIMITS["futures"]
+            self.klines_limit = KLINES_LIMITS["futures"]
         else:
             self._base_url = "https://api.binance.com"
+            self.rate_limiter = get_rate_limiter("binance")
+            self._weight_limit = WEIGHT_LIMITS["spot"]
+            self.klines_limit = KLINES_LIMITS["spot"]
+
+        if base_url is not None:
+            self._base_url = base_url
+
+        # Keep-alive connections reused across requests and collection threads
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+        self.used_weight = 0
+
+        self._symbol_cache = SymbolCache("binance_futures" if self.futures else "binance", self._fetch_symbols,
+                                         on_refresh=self._set_symbols)
+        self._set_symbols(self._symbol_cache.load())
 
-        self.symbols = self._get_symbols()
+    def _request_weight(self, endpoint: str, query_parameters: Dict) -> int:
+        if endpoint.endswith("exchangeInfo"):
+            return 1 if self.futures else 20
+
+        if endpoint.endswith("klines") and self.futures:
+            limit = query_parameters.get("limit", 500)
+            if limit < 100:
+                return 1
+            elif limit < 500:
+                return 2
+            elif limit <= 1000:
+                return 5
+            return 10
+
+        return 2
 
     def _make_request(self, endpoint: str, query_parameters: Dict):
 
-        try:
-            response = requests.get(self._base_url + endpoint, params=query_parameters)
-        except Exception as e:
-            logger.error("Connection error while making request to %s: %s", endpoint, e)
-            return None
+        for attempt in range(MAX_RETRIES + 1):
+            self.rate_limiter.acquire(self._request_weight(endpoint, query_parameters))
+
+            try:
+                response = self._session.get(self._base_url + endpoint, params=query_parameters, timeout=30)
+            except Exception as e:
+                logger.error("Connection error while making request to %s: %s", endpoint, e)
+                if attempt < MAX_RETRIES:
+                    time.sleep(self._backoff(attempt))
+                    continue
+                return None
+
+            self._update_used_weight(response)
+
+            if response.status_code == 200:
+                return response.json()
+
+            if response.status_code in (418, 429):
+                # Rate limited (429) or IP banned (418): every thread sharing the limiter waits for Retry-After
+                wait = self._retry_after(response, attempt)
+                self.rate_limiter.pause(wait)
+                logger.warning("Status code %s on %s, backing off for %s seconds (used weight = %s)",
+                               response.status_code, endpoint, wait, self.used_weight)
+                if response.status_code == 429 and attempt < MAX_RETRIES:
+                    continue
+            elif response.status_code >= 500 and attempt < MAX_RETRIES:
+                time.sleep(self._backoff(attempt))
+                continue
 
-        if response.status_code == 200:
-            return response.json()
-        else:
             logger.error("Error while making request to %s: %s (status code = %s)",
-                         endpoint, response.json(), response.status_code)
+                         endpoint, response.text, response.status_code)
             return None
 
-    def _get_symbols(self) -> List[str]:
+    def _update_used_weight(self, response: requests.Response):
+        used_weight = response.headers.get("X-MBX-USED-WEIGHT-1M") or response.headers.get("X-MBX-USED-WEIGHT")
+        if used_weight is None:
+            return
+
+        try:
+            self.used_weight = int(used_weight)
+        except ValueError:
+            return
+
+        self.rate_limiter.update_usage(self.used_weight, self._weight_limit)
+
+    @staticmethod
+    def _retry_after(response: requests.Response, attempt: int) -> float:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return BinanceClient._backoff(attempt)
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        return min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX)
+
+    def _fetch_symbols(self) -> Dict:
 
         params = dict()
 
         endpoint = "/fapi/v1/exchangeInfo" if self.futures else "/api/v3/exchangeInfo"
         data = self._make_request(endpoint, params)
 
+        if data is None:
+            raise ConnectionError(f"Could not get the exchange info from {self._base_url}")
+
         symbols = [x["symbol"] for x in data["symbols"]]
 
-        return symbols
+        return {"symbols": symbols}
+
+    def _set_symbols(self, data: Dict):
+        self.symbols = data["symbols"]
+
+    def get_historical_data(self, symbol: str, start_time: Optional[int] = None,
+                            end_time: Optional[int] = None) -> Optional[np.ndarray]:
+        """
+        All the 1m candles between start_time and end_time as one (N, 6) array, see iter_historical_data().
+        None if nothing was returned.
+        """
+        pages = list(self.iter_historical_data(symbol, start_time, end_time))
+
+        if len(pages) == 0:
+            return None
+
+        return np.concatenate(pages)
 
-    def get_historical_data(self, symbol: str, start_time: Optional[int] = None, end_time: Optional[int] = None):
+    def iter_historical_data(self, symbol: str, start_time: Optional[int] = None,
+                             end_time: Optional[int] = None) -> Generator[np.ndarray, None, None]:
+        """
+        Pages through the 1m klines with a cursor: every request asks for a full page starting right after the
+        open time of the last candle received, until the page comes back short or passes end_time. Ranges the
+        exchange has no data for (before the listing, maintenance) are skipped in one request.
+        Yields one (N, 6) float64 array of timestamp, open, high, low, close, volume per page.
+        Raises ConnectionError when a request fails for good (retries exhausted, banned, 4xx), so the caller
+        can tell the candles left out from a range the exchange has no data for.
+        """
 
         params = dict()
 
         params["symbol"] = symbol
         params["interval"] = "1m"
-        params["limit"] = 1500
+        params["limit"] = self.klines_limit
 
-        if start_time is not None:
-            params["startTime"] = start_time
         if end_time is not None:
             params["endTime"] = end_time
 
         endpoint = "/fapi/v1/klines" if self.futures else "/api/v3/klines"
-        raw_candles = self._make_request(endpoint, params)
+        cursor = start_time
 
-        candles = []
+        while True:
+            if cursor is not None:
+                params["startTime"] = cursor
 
-        if raw_candles is not None:
-            for c in raw_candles:
-                candles.append((float(c[0]), float(c[1]), float(c[2]), float(c[3]), float(c[4]), float(c[5]),))
-            return candles
-        else:
-            return None
+            raw_candles = self._make_request(endpoint, params)
+
+            if raw_candles is None:
+                raise ConnectionError(f"{symbol}: stopped paging klines at {cursor}")
+
+            if len(raw_candles) == 0:
+                return
+
+            candles = np.array([c[:6] for c in raw_candles], dtype=np.float64)
+            yield candles
+
+            cursor = int(candles[-1, 0]) + 60000
+
+            if len(raw_candles) < self.klines_limit or (end_time is not None and cursor > end_time):
+                return
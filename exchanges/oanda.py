@@ -1,145 +1,195 @@
 import logging
-from typing import Optional, List
-import pandas as pd
+from typing import Optional, List, Dict, Generator
+import numpy as np
 from oandapyV20 import API
+from oandapyV20.oandapyV20 import TRADING_ENVIRONMENTS
 from oandapyV20.exceptions import V20Error
 import oandapyV20.endpoints.accounts as accounts
 import oandapyV20.endpoints.instruments as instruments
 # from oandapyV20.definitions.instruments import CandlestickGranularity
-import re
-from datetime import datetime, timedelta, timezone
 import time
-import pytz
 import os
 from dotenv import load_dotenv
 
+from rate_limiter import get_rate_limiter
+from symbol_cache import SymbolCache
+
 load_dotenv()
 
 logger = logging.getLogger()
 
+# Largest "count" accepted by the candles endpoint
+MAX_CANDLES = 5000
+MAX_RETRIES = 2
+# Seconds between two attempts of a failed request
+RETRY_DELAY = 5
+# 2020-01-01 UTC, used when no start time is given
+DEFAULT_START_MS = 1577836800000
+
+CANDLE_DTYPE = np.dtype([('time', 'f8'), ('o', 'f8'), ('h', 'f8'), ('l', 'f8'), ('c', 'f8'), ('volume', 'f8'),
+                         ('ask_c', 'f8'), ('bid_c', 'f8')])
+
 
 class OandaClient:
 
-    def __init__(self):
+    def __init__(self, api_url: Optional[str] = None):
         self.account_id = os.getenv("OANDA_ACCOUNT_ID")
         self.access_token = os.getenv("OANDA_ACCESS_TOKEN")
         self.account_type = os.getenv("OANDA_ACCOUNT_TYPE")
-        self.client = API(access_token=self.access_token)
+
+        # api_url points the client at another server (e.g. a local replay), registered as its own environment
+        environment = "practice"
+        if api_url is not None:
+            environment = api_url
+            TRADING_ENVIRONMENTS[environment] = {"api": api_url, "stream": api_url}
+
+        # Times sent and received as UNIX seconds rather than RFC3339 strings
+        self.client = API(access_token=self.access_token, environment=environment,
+                          headers={"Accept-Datetime-Format": "UNIX"})
+        self.rate_limiter = get_rate_limiter("oanda")
 
         # CandlestickGranularity().definitions.keys()
         self.granularities = ['S5', 'S10', 'S15', 'S30', 'M1', 'M2', 'M4', 'M5', 'M10', 'M15', 'M30', 'H1', 'H2', 'H3',
                               'H4', 'H6', 'H8', 'H12', 'D', 'W', 'M']
         self.price = ['M', 'B', 'A', 'BA', 'MBA']
 
-        self.date_input_format = "%Y-%m-%d"
-        self.date_output_format = "%Y-%m-%dT%H:%M:%SZ"
-
         self.symbols = list()
         self.symbol_details = dict()
-        self._get_symbols()
+        self._symbol_cache = SymbolCache("oanda", self._fetch_symbols, on_refresh=self._set_symbols)
+        self._set_symbols(self._symbol_cache.load())
 
     # def get_instruments(self):
-    def _get_symbols(self):
+    def _fetch_symbols(self) -> Dict:
         r = accounts.AccountInstruments(accountID=self.account_id)
+        self.rate_limiter.acquire()
         rv = self.client.request(r)
+
+        symbols = list()
+        symbol_details = dict()
         for i in rv.get('instruments'):
-            self.symbols.append(i.get('name'))
-            self.symbol_details[i.get('name')] = i
+            symbols.append(i.get('name'))
+            symbol_details[i.get('name')] = i
+
+        return {"symbols": symbols, "symbol_details": symbol_details}
+
+    def _set_symbols(self, data: Dict):
+        self.symbol_details = data["symbol_details"]
+        self.symbols = data["symbols"]
 
     def get_historical_data(self, symbol: str, start_time: Optional[int] = None, end_time: Optional[int] = None,
-                            price='MBA', granularity='M1'):
+                            price='MBA', granularity='M1') -> Optional[np.ndarray]:
+        """
+        All the complete candles between start_time and end_time as one (N, 7) array, see iter_historical_data().
+        None if nothing was returned.
+        """
+        pages = list(self.iter_historical_data(symbol, start_time, end_time, price, granularity))
+
+        if len(pages) == 0:
+            return None
+
+        return np.concatenate(pages)
+
+    def iter_historical_data(self, symbol: str, start_time: Optional[int] = None, end_time: Optional[int] = None,
+                             price='MBA', granularity='M1') -> Generator[np.ndarray, None, None]:
+        """
+        Pages through the candles from the exact start_time with "from" + "count" requests: every page starts
+        right after the last candle received, so closures are skipped and no range is downloaded twice. Once the
+        rest of the range fits in one page it is requested with "from" + "to", so nothing past end_time is
+        downloaded (but the candle following it).
+        Yields one (N, 7) float64 array of time, open, high, low, close, volume, spread per page.
+        Incomplete candles (the current minute) are left out.
+        Raises ConnectionError when a request still fails after the retries, so the caller can tell the candles
+        left out from a closure.
+        """
 
         if not symbol:
             raise ValueError("No symbol provided")
 
-        if start_time is not None:
-            from_date = datetime.fromtimestamp(int(start_time / 1000)).strftime(self.date_input_format)
-        else:
-            # from_date = (datetime.fromtimestamp(int(time.time())) - timedelta(days=1)).strftime(self.date_input_format)
-            from_date = "2020-01-01"
-        if end_time is not None:
-            to_date = datetime.fromtimestamp(int(end_time / 1000)).strftime(self.date_input_format)
-        else:
-            to_date = datetime.fromtimestamp(int(time.time())).strftime(self.date_input_format)
-
-        logger.info(f"Fetching {symbol} from {from_date} to {to_date}")
-
-        max_retries = 2
-        retries = 0
-        complete = False
-
-        candles = list()
-        for start_str, end_str in self._generate_batches(from_date, to_date):
-
-            logger.info(f"{symbol} from {start_str} to {end_str}")
-
-            if not self._check_date(start_str):
-                raise ValueError("Incorrect start_str date format: ", start_str)
-            if not self._check_date(end_str):
-                raise ValueError("Incorrect end_str date format: ", end_str)
-
-            while not complete:
-                if retries >= max_retries:
-                    complete = True
-                try:
-                    r = instruments.InstrumentsCandles(instrument=symbol, params={
-                        "from": start_str,
-                        "to": end_str,
-                        "granularity": granularity,
-                        "price": price,
-                        # "count": 50,
-                        # "smooth": False,
-                        # "includeFirst": False,
-                        # "dailyAlignment": 0,
-                        # "alignmentTimezone": "America/New_York",
-                        # "weeklyAlignment": "Friday"
-                    })
-                    rv = self.client.request(r)
-                    # time, open, high, low, close, volume, spread
-                    for candle in rv.get('candles', []):
-                        t = self._datetime_str_to_millis(candle.get('time'))
-                        o = float(candle.get('mid').get('o'))
-                        h = float(candle.get('mid').get('h'))
-                        l = float(candle.get('mid').get('l'))
-                        c = float(candle.get('mid').get('c'))
-                        v = int(candle.get('volume'))
-                        s = round(float(candle.get('ask').get('c')) - float(candle.get('bid').get('c')), 4)
-                        candles.append((t, o, h, l, c, v, s,))
-                    complete = True
-                except V20Error as ex:
-                    logger.error(f"V20Error: {ex}")
-                    retries += 1
-                    time.sleep(5)
-                except Exception as ex:
-                    logger.error(f"Exception: {ex}")
-                    retries += 1
-                    time.sleep(5)
-        return candles
+        if start_time is None:
+            start_time = DEFAULT_START_MS
 
-    @staticmethod
-    def _check_date(s):
-        dateFmt = "[\d]{4}-[\d]{2}-[\d]{2}T[\d]{2}:[\d]{2}:[\d]{2}Z"
-        if not re.match(dateFmt, s):
-            raise ValueError("Incorrect date format: ", s)
-        return True
+        logger.info(f"Fetching {symbol} from {start_time} to {end_time}")
+
+        params = {
+            "from": self._to_unix(start_time),
+            "count": MAX_CANDLES,
+            "granularity": granularity,
+            "price": price,
+            "includeFirst": True,
+        }
+
+        while True:
+            last_page = end_time is not None and self._fits_one_page(params, end_time)
+            if last_page:
+                # "to" and "count" are exclusive, the "to" candle itself is filtered out below
+                params.pop("count", None)
+                params["to"] = self._to_unix(end_time + 60000)
 
-    def _generate_batches(self, from_date_str: str, to_date_str: str, max_minutes=5000):
+            raw_candles = self._request_candles(symbol, params)
 
-        # Parse input dates and set time to start and end of day
-        from_date = datetime.strptime(from_date_str, "%Y-%m-%d").replace(tzinfo=timezone.utc)
-        to_date = (datetime.strptime(to_date_str, "%Y-%m-%d") + timedelta(hours=23, minutes=59, seconds=59)).replace(
-            tzinfo=timezone.utc)
+            if raw_candles is None:
+                raise ConnectionError(f"{symbol}: stopped paging candles at {params['from']}")
 
-        if to_date > datetime.now(timezone.utc):
-            to_date = datetime.now(timezone.utc)
+            if len(raw_candles) == 0:
+                return
 
-        current = from_date
-        while current < to_date:
-            batch_end = min(current + timedelta(minutes=max_minutes), to_date)
-            yield current.strftime(self.date_output_format), batch_end.strftime(self.date_output_format)
-            current = batch_end
+            candles = self._parse_candles(raw_candles)
+            last_time = candles[-1, 0] if candles.shape[0] else None
+
+            if end_time is not None:
+                candles = candles[candles[:, 0] <= end_time]
+
+            if candles.shape[0]:
+                yield candles
+
+            if (last_page or len(raw_candles) < MAX_CANDLES or last_time is None
+                    or (end_time is not None and last_time >= end_time)):
+                return
+
+            params["from"] = self._to_unix(last_time)
+            params["includeFirst"] = False
+
+    def _request_candles(self, symbol: str, params: Dict) -> Optional[List[Dict]]:
+        for retries in range(MAX_RETRIES + 1):
+            try:
+                r = instruments.InstrumentsCandles(instrument=symbol, params=params)
+                self.rate_limiter.acquire()
+                rv = self.client.request(r)
+                return rv.get('candles', [])
+            except V20Error as ex:
+                logger.error(f"V20Error: {ex}")
+            except Exception as ex:
+                logger.error(f"Exception: {ex}")
+
+            if retries < MAX_RETRIES:
+                time.sleep(RETRY_DELAY)
+
+        return None
+
+    @staticmethod
+    def _parse_candles(raw_candles: List[Dict]) -> np.ndarray:
+        """
+        Bulk conversion of the price="MBA" candles: the fields are gathered as strings into a structured array
+        and converted column by column, times included since the client asks for UNIX seconds.
+        """
+        fields = [(c['time'], *(c['mid'][k] for k in 'ohlc'), c['volume'], c['ask']['c'], c['bid']['c'])
+                  for c in raw_candles if c.get('complete', True)]
+        raw = np.array(fields, dtype=CANDLE_DTYPE)
+
+        # time, open, high, low, close, volume, spread
+        candles = np.empty((raw.shape[0], 7), dtype=np.float64)
+        candles[:, 0] = np.rint(raw['time'] * 1000)
+        for i, k in enumerate(['o', 'h', 'l', 'c', 'volume'], start=1):
+            candles[:, i] = raw[k]
+        candles[:, 6] = np.round(raw['ask_c'] - raw['bid_c'], 4)
+
+        return candles
+
+    @staticmethod
+    def _fits_one_page(params: Dict, end_time: int) -> bool:
+        # M1 candles from "from" to the one after end_time, at most: closures only make the page shorter
+        return (end_time + 60000 - float(params["from"]) * 1000) // 60000 + 1 <= MAX_CANDLES
 
     @staticmethod
-    def _datetime_str_to_millis(dt_str):
-        # Parse the string assuming ISO 8601 with Z (UTC)
-        return int(pd.to_datetime(dt_str).timestamp() * 1000)
+    def _to_unix(timestamp_ms: float) -> str:
+        return f"{int(timestamp_ms) / 1000:.3f}"
@@ -0,0 +1,78 @@
+import hashlib
+import logging
+import os
+from typing import Optional
+
+import pandas as pd
+
+from utils import atomic_write
+
+logger = logging.getLogger()
+
+# Total size of the cached frames of an exchange before the least recently used ones are removed
+FRAME_CACHE_MAX_BYTES = 1024 ** 3
+
+
+class FrameCache:
+    """
+    Resampled candles kept on disk under data/cache/<exchange>, one pickle per key. The key holds the dataset
+    version stamped by Hdf5Client.write_data, so frames built from older data are never returned and simply age
+    out. A hit refreshes the file's modification time, which is what the LRU eviction goes by.
+    """
+
+    def __init__(self, exchange: str, max_bytes: int = FRAME_CACHE_MAX_BYTES, directory: str = "data/cache"):
+        self.directory = os.path.join(directory, exchange)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.sha1("|".join(str(p) for p in parts).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        path = self._path(key)
+
+        try:
+            df = pd.read_pickle(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring the unreadable cached frame {path}: {e}")
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return df
+
+    def put(self, key: str, df: pd.DataFrame):
+        os.makedirs(self.directory, exist_ok=True)
+
+        atomic_write(self._path(key), df.to_pickle)
+
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pkl"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,54 @@
+import numpy as np
+
+# Kinds of gap stored in the gap index
+GAP_MISSING = 0  # minutes the exchange should have, to be backfilled
+GAP_CLOSURE = 1  # expected market closure, never requested
+GAP_EMPTY = 2    # requested during a backfill and the exchange had nothing, not requested again
+
+MINUTE_MS = 60_000
+DAY_MINUTES = 1440
+WEEK_MINUTES = 7 * DAY_MINUTES
+
+# Oanda closes from Friday ~21:00 to Sunday ~21:00 UTC (20:00/22:00 with daylight saving) and the CFDs have a
+# daily break in the evening. Bounds in minutes since Monday 00:00 UTC / since midnight UTC.
+OANDA_WEEKEND_START = 4 * DAY_MINUTES + 20 * 60
+OANDA_WEEKEND_END = 6 * DAY_MINUTES + 23 * 60
+OANDA_DAILY_BREAK_START = 20 * 60
+OANDA_DAILY_BREAK_END = 23 * 60
+OANDA_DAILY_BREAK_MAX_MINUTES = 120
+
+
+def find_gaps(timestamps: np.ndarray, exchange: str, interval_ms: int = MINUTE_MS) -> np.ndarray:
+    """
+    Scans a sorted timestamp column for missing candles. Returns an (N, 3) int64 array of
+    [first missing timestamp, last missing timestamp, kind], where kind is GAP_CLOSURE for the exchange's
+    expected closures and GAP_MISSING otherwise.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+
+    idx = np.flatnonzero(np.diff(timestamps) > interval_ms)
+    starts = timestamps[idx] + interval_ms
+    ends = timestamps[idx + 1] - interval_ms
+
+    kinds = np.where(is_market_closure(starts, ends, exchange), GAP_CLOSURE, GAP_MISSING)
+
+    return np.column_stack([starts, ends, kinds]).astype(np.int64).reshape(-1, 3)
+
+
+def is_market_closure(starts: np.ndarray, ends: np.ndarray, exchange: str) -> np.ndarray:
+    if exchange != "oanda":
+        # Binance trades around the clock
+        return np.zeros(starts.shape[0], dtype=bool)
+
+    start_minutes = starts // MINUTE_MS
+    length = (ends - starts) // MINUTE_MS + 1
+
+    # 1970-01-01 was a Thursday, shift by 3 days so that minute 0 of the week is Monday 00:00
+    minute_of_week = (start_minutes + 3 * DAY_MINUTES) % WEEK_MINUTES
+    minute_of_day = start_minutes % DAY_MINUTES
+
+    weekend = (minute_of_week >= OANDA_WEEKEND_START) & (minute_of_week + length <= OANDA_WEEKEND_END)
+    daily_break = ((minute_of_day >= OANDA_DAILY_BREAK_START) & (minute_of_day < OANDA_DAILY_BREAK_END)
+                   & (length <= OANDA_DAILY_BREAK_MAX_MINUTES))
+
+    return weekend | daily_break
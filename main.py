@@ -1,11 +1,13 @@
 import logging
+import os
+import sys
 from datetime import datetime, timezone
 import pandas as pd
 
 import backtester
 import optimiser
 from data_service import DataCollector
-from database import Hdf5Client
+from database import Hdf5Client, migrate_to_columnar, migrate_to_swmr
 from exchanges.binance import BinanceClient
 from exchanges.oanda import OandaClient
 from utils import TF_EQUIV
@@ -35,8 +37,8 @@ if __name__ == "__main__":
     exchange = None
 
     while True:
-        mode = input("Choose the program mode (data / backtest / optimise): ").lower()
-        if mode in ["data", "backtest", "optimise"]:
+        mode = input("Choose the program mode (data / sync / backtest / optimise / migrate): ").lower()
+        if mode in ["data", "sync", "backtest", "optimise", "migrate"]:
             break
 
     # Exchange
@@ -49,6 +51,27 @@ if __name__ == "__main__":
         if exchange in ["binance", "oanda"]:
             break
 
+    # Storage migrations of data/<exchange>.h5, no exchange connection needed: to the columnar layout, or to the
+    # HDF5 file format that can be shared in SWMR mode
+    if mode == "migrate":
+        while True:
+            migration = input("Migrate to the columnar layout or to the SWMR file format (columnar / swmr): ").lower()
+            if migration in ["columnar", "swmr"]:
+                break
+
+        if migration == "columnar":
+            migrate_to_columnar(exchange)
+            logger.info(f"Migrated data/{exchange}.h5 to the columnar layout")
+        else:
+            migrate_to_swmr(exchange)
+            logger.info(f"Migrated data/{exchange}.h5 to the SWMR file format")
+        sys.exit(0)
+
+    # Keeps every stored symbol up to date until interrupted, backtests can read the file meanwhile
+    if mode == "sync":
+        DataCollector(exchange=exchange).tail_sync(swmr=True)
+        sys.exit(0)
+
     if exchange == 'binance':
         client = BinanceClient(futures=True)
     elif exchange == 'oanda':
@@ -88,8 +111,20 @@ if __name__ == "__main__":
             except ValueError:
                 continue
 
+        # Only fill the holes inside the stored history
+        while True:
+            backfill = input("Backfill gaps only (t or f): ")
+            if backfill == "t":
+                backfill = True
+                break
+            elif backfill == "f" or backfill == "":
+                backfill = False
+                break
+
         if symbol == 'ALL':
-            data_collector.sync_all(from_time)
+            data_collector.sync_all(from_time, backfill=backfill)
+        elif backfill:
+            data_collector.backfill(symbol)
         else:
             data_collector.collect_all(symbol, from_time)
         logger.info("Data collected")
@@ -174,49 +209,53 @@ if __name__ == "__main__":
                 except ValueError:
                     continue
 
+            # Worker processes
+            while True:
+                workers = input("Number of worker processes (Press Enter for all cores): ")
+                if workers == "":
+                    workers = os.cpu_count() or 1
+                    break
+
+                try:
+                    workers = max(int(workers), 1)
+                    break
+                except ValueError:
+                    continue
+
             if symbol == 'ALL':
                 symbols = client.symbols
 
                 for i, symbol in enumerate(symbols):
                     print(f"symbol: {symbol}")
-                    nsga2 = optimiser.Nsga2(exchange, symbol, strategy, tf, from_time, to_time, pop_size)
-
-                    p_population = nsga2.create_initial_population()
-                    p_population = nsga2.evaluate_population(p_population)
-                    p_population = nsga2.crowding_distance(p_population)
-
-                    g = 0
-                    while g < generations:
+                    with optimiser.Nsga2(exchange, symbol, strategy, tf, from_time, to_time, pop_size,
+                                         workers) as nsga2:
 
-                        q_population = nsga2.create_offspring_population(p_population)
-                        q_population = nsga2.evaluate_population(q_population)
+                        p_population = nsga2.create_initial_population()
+                        p_population = nsga2.evaluate_population(p_population)
+                        p_population = nsga2.crowding_distance(p_population)
 
-                        r_population = p_population + q_population
+                        g = 0
+                        while g < generations:
 
-                        nsga2.population_params.clear()
+                            q_population = nsga2.create_offspring_population(p_population)
+                            q_population = nsga2.evaluate_population(q_population)
 
-                        i = 0
-                        population = dict()
-                        for bt in r_population:
-                            bt.reset_results()
-                            nsga2.population_params.append(bt.parameters)
-                            population[i] = bt
-                            i += 1
+                            r_population = p_population + q_population
+                            r_population.reset_results()
 
-                        fronts = nsga2.non_dominated_sorting(population)
-                        for j in range(len(fronts)):
-                            fronts[j] = nsga2.crowding_distance(fronts[j])
+                            fronts = nsga2.non_dominated_sorting(r_population)
+                            fronts = nsga2.crowding_distances(r_population, fronts)
 
-                        p_population = nsga2.create_new_population(fronts)
+                            p_population = nsga2.create_new_population(r_population, fronts)
 
-                        for i, individual in enumerate(list(p_population)):
-                            individual.order = i
-                            results.append(individual)
-                            print(f"{individual}")
+                            for i, individual in enumerate(p_population):
+                                individual.order = i
+                                results.append(individual)
+                                print(f"{individual}")
 
-                        print(f"\rgenerations: {int((g + 1) / generations * 100)}%", end='')
+                            print(f"\rgenerations: {int((g + 1) / generations * 100)}%", end='')
 
-                        g += 1
+                            g += 1
 
                     print("\n")
                     print(f"\rsymbols: {int(i + 1) / len(symbols) * 100}%",end='')
@@ -225,43 +264,33 @@ if __name__ == "__main__":
                     f"\nexchange: {exchange} | symbol: {symbol} | strategy: {strategy} | timeframe {tf}\n{pd.to_datetime(from_time, unit='ms')} -> {pd.to_datetime(to_time, unit='ms')}\n")
 
             else:
-                nsga2 = optimiser.Nsga2(exchange, symbol, strategy, tf, from_time, to_time, pop_size)
-
-                p_population = nsga2.create_initial_population()
-                p_population = nsga2.evaluate_population(p_population)
-                p_population = nsga2.crowding_distance(p_population)
+                with optimiser.Nsga2(exchange, symbol, strategy, tf, from_time, to_time, pop_size, workers) as nsga2:
 
-                g = 0
-                while g < generations:
-
-                    q_population = nsga2.create_offspring_population(p_population)
-                    q_population = nsga2.evaluate_population(q_population)
+                    p_population = nsga2.create_initial_population()
+                    p_population = nsga2.evaluate_population(p_population)
+                    p_population = nsga2.crowding_distance(p_population)
 
-                    r_population = p_population + q_population
+                    g = 0
+                    while g < generations:
 
-                    nsga2.population_params.clear()
+                        q_population = nsga2.create_offspring_population(p_population)
+                        q_population = nsga2.evaluate_population(q_population)
 
-                    i = 0
-                    population = dict()
-                    for bt in r_population:
-                        bt.reset_results()
-                        nsga2.population_params.append(bt.parameters)
-                        population[i] = bt
-                        i += 1
+                        r_population = p_population + q_population
+                        r_population.reset_results()
 
-                    fronts = nsga2.non_dominated_sorting(population)
-                    for j in range(len(fronts)):
-                        fronts[j] = nsga2.crowding_distance(fronts[j])
+                        fronts = nsga2.non_dominated_sorting(r_population)
+                        fronts = nsga2.crowding_distances(r_population, fronts)
 
-                    p_population = nsga2.create_new_population(fronts)
+                        p_population = nsga2.create_new_population(r_population, fronts)
 
-                    print(f"\r{int((g + 1) / generations * 100)}%", end='')
+                        print(f"\r{int((g + 1) / generations * 100)}%", end='')
 
-                    g += 1
+                        g += 1
 
                 print(f"\nexchange: {exchange} | symbol: {symbol} | strategy: {strategy} | timeframe {tf}\n{pd.to_datetime(from_time, unit='ms')} -> {pd.to_datetime(to_time, unit='ms')}\n")
 
-                for i, individual in enumerate(list(p_population)):
+                for i, individual in enumerate(p_population):
                     # print(f"{i + 1} {individual}")
                     individual.order = i
                     print(f"{individual}")
@@ -1,6 +1,8 @@
-from typing import Dict, List
+from typing import Dict, Iterator, List, Optional
 from datetime import datetime
 
+import numpy as np
+
 
 class BacktestResult:
 
@@ -66,3 +68,140 @@ Order = {self.order}
             "order": self.order,
             "written_at": self.written_at
         }
+
+
+
+class Population:
+    """
+    Population of the optimiser as a structure of arrays: one row per individual in the parameters matrix (columns
+    in the order of param_types, ints stored as floats) and in every result column. Individuals are only built
+    as Individual views for reporting, symbol, strategy, timeframe and period are held once for all of them.
+    """
+
+    RESULT_COLUMNS = ["pnl", "max_dd", "num_trades", "sharpe_ratio", "cagr", "rank", "crowding_distance", "order"]
+
+    def __init__(self, parameters: np.ndarray, param_types: Dict[str, type], info: Optional[Dict] = None):
+        self.param_types = param_types
+        self.parameters = np.asarray(parameters, dtype=np.float64).reshape(len(parameters), len(param_types))
+        self.info: Dict = dict(info) if info is not None else dict()
+        self.written_at: str = datetime.utcnow().isoformat()
+
+        size = len(self.parameters)
+        self.pnl = np.zeros(size)
+        self.max_dd = np.zeros(size)
+        self.num_trades = np.zeros(size, dtype=np.int64)
+        self.sharpe_ratio = np.zeros(size)
+        self.cagr = np.zeros(size)
+        self.rank = np.zeros(size, dtype=np.int64)
+        self.crowding_distance = np.zeros(size)
+        self.order = np.full(size, -float("inf"))
+
+    def __len__(self) -> int:
+        return len(self.parameters)
+
+    def __getitem__(self, index: int) -> "Individual":
+        if not -len(self) <= index < len(self):
+            raise IndexError(f"Individual {index} out of a population of {len(self)}")
+        return Individual(self, index % len(self))
+
+    def __iter__(self) -> Iterator["Individual"]:
+        return (Individual(self, i) for i in range(len(self)))
+
+    def __add__(self, other: "Population") -> "Population":
+        population = Population(np.concatenate([self.parameters, other.parameters]), self.param_types, self.info)
+        for column in self.RESULT_COLUMNS:
+            setattr(population, column, np.concatenate([getattr(self, column), getattr(other, column)]))
+        return population
+
+    def take(self, indexes: np.ndarray) -> "Population":
+        """
+        New population of the given rows, in that order.
+        """
+        population = Population(self.parameters[indexes], self.param_types, self.info)
+        population.written_at = self.written_at
+        for column in self.RESULT_COLUMNS:
+            setattr(population, column, getattr(self, column)[indexes])
+        return population
+
+    def reset_results(self):
+        self.rank[:] = 0
+        self.crowding_distance[:] = 0.0
+
+    def parameter_dicts(self) -> List[Dict]:
+        names = list(self.param_types)
+        types = list(self.param_types.values())
+        return [{n: t(v) for n, t, v in zip(names, types, row)} for row in self.parameters.tolist()]
+
+
+def _column(name: str):
+    def get(self):
+        return getattr(self.population, name)[self.index].item()
+
+    def set(self, value):
+        getattr(self.population, name)[self.index] = value
+
+    return property(get, set)
+
+
+def _info(name: str):
+    return property(lambda self: self.population.info.get(name, ''))
+
+
+class Individual:
+    """
+    Lightweight view of one row of a Population, read like a BacktestResult.
+    """
+
+    __slots__ = ("population", "index")
+
+    def __init__(self, population: Population, index: int):
+        self.population = population
+        self.index = index
+
+    symbol = _info("symbol")
+    strategy = _info("strategy")
+    tf = _info("tf")
+    from_time = _info("from_time")
+    to_time = _info("to_time")
+
+    pnl = _column("pnl")
+    max_dd = _column("max_dd")
+    num_trades = _column("num_trades")
+    sharpe_ratio = _column("sharpe_ratio")
+    cagr = _column("cagr")
+    rank = _column("rank")
+    crowding_distance = _column("crowding_distance")
+    order = _column("order")
+
+    @property
+    def parameters(self) -> Dict:
+        row = self.population.parameters[self.index].tolist()
+        return {n: t(v) for (n, t), v in zip(self.population.param_types.items(), row)}
+
+    @property
+    def written_at(self) -> str:
+        return self.population.written_at
+
+    __repr__ = BacktestResult.__repr__
+
+    def h5_serialise(self):
+        return {
+            "symbol": self.symbol,
+            "strategy": self.strategy,
+            "tf": self.tf,
+            "from_time": self.from_time,
+            "to_time": self.to_time,
+            "pnl": self.pnl,
+            "max_dd": self.max_dd,
+            "num_trade": self.num_trades,
+            "cagr": self.cagr,
+            "sharpe_ratio": self.sharpe_ratio,
+            "parameters": self.parameters,
+            # Only used while sorting in BacktestResult, kept so both serialise to the same keys
+            "dominated_by": 0,
+            "dominates": [],
+            "rank": self.rank,
+            "crowding_distance": self.crowding_distance,
+            "order": self.order,
+            "written_at": self.written_at
+        }
@@ -1,18 +1,159 @@
-from typing import List, Dict
-import random
-from copy import copy
+from typing import List, Dict, Optional, Tuple
+import math
+import multiprocessing
+from ctypes import POINTER, c_double
+from multiprocessing import shared_memory
+import numpy as np
 import pandas as pd
 
-from utils import STRAT_PARAMS, resample_timeframe, get_library
+from backtester import CPP_STRATEGIES, PY_STRATEGIES
+from utils import STRAT_PARAMS, STRAT_COLUMNS, BACKTEST_METRICS_DTYPE, BacktestMetrics, get_library
 from database import Hdf5Client
-from models import BacktestResult
-from strategies import obv, ichimoku, support_resistance
+from models import Population
+
+# Candles of the worker processes, attached once by _init_worker()
+_worker_shm: Optional[shared_memory.SharedMemory] = None
+_worker_data: Optional[pd.DataFrame] = None
+_worker_strategy: Optional[str] = None
+
+
+def _init_worker(shm_name: str, shape: Tuple[int, int], columns: List[str], index_dtype: str, strategy: str):
+    """
+    Rebuilds the candles DataFrame of the parent over its shared memory block: row 0 holds the timestamps in
+    ms, the others the columns. Only the index is copied.
+    """
+    global _worker_shm, _worker_data, _worker_strategy
+
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    block = np.ndarray(shape, dtype=np.float64, buffer=_worker_shm.buf)
+    timestamps = block[0].astype(np.int64).astype("datetime64[ms]").astype(index_dtype)
+    index = pd.DatetimeIndex(timestamps, name="timestamp")
+
+    _worker_data = pd.DataFrame(block[1:].T, index=index, columns=columns, copy=False)
+    _worker_strategy = strategy
+
+
+def _evaluate(params: Dict) -> Tuple:
+    strategy_params = {p: params[p] for p in STRAT_PARAMS[_worker_strategy]}
+    return PY_STRATEGIES[_worker_strategy].backtest(_worker_data, **strategy_params)
+
+
+# Objectives maximised by the non-dominated sorting, in the order of the columns of the values it sorts
+SORT_OBJECTIVES = ["cagr", "sharpe_ratio"]
+# Objectives the crowding distance is measured on, in the order the fronts are sorted on them
+# TODO add num_trades
+CROWDING_OBJECTIVES = ["pnl", "max_dd", "sharpe_ratio"]
+
+
+def dominance(values_1: np.ndarray, values_2: np.ndarray) -> np.ndarray:
+    """
+    dominance[i, j]: row i of values_1 dominates row j of values_2, i.e. is >= on every objective and > on one.
+    A NaN objective neither dominates nor is dominated.
+    """
+    v_1 = values_1[:, None, :]
+    v_2 = values_2[None, :, :]
+    return (v_1 >= v_2).all(axis=2) & (v_1 > v_2).any(axis=2)
+
+
+def dominance_ranks(values: np.ndarray) -> np.ndarray:
+    """
+    Front of every row of values (one column per objective, maximised), 0 for the non-dominated ones. The rank of
+    a row is one more than the highest rank of the rows dominating it, as found by peeling the fronts off.
+    """
+    num_rows, num_objectives = values.shape
+    ranks = np.zeros(num_rows, dtype=np.int64)
+
+    if num_rows == 0:
+        return ranks
+
+    if num_objectives == 2:
+        # Sweep in decreasing order of the first objective (then the second): only the rows before a row can
+        # dominate it. Within a front the second objective increases along the sweep, so the last row of a front
+        # dominates the current row whenever any row of that front does, and the fronts dominating the row are
+        # the first ones: a binary search finds its rank.
+        valid = np.flatnonzero(~np.isnan(values).any(axis=1))
+        order = valid[np.lexsort((-values[valid, 1], -values[valid, 0]))]
+        last_1: List[float] = []
+        last_2: List[float] = []
+
+        for i, (v_1, v_2) in zip(order.tolist(), values[order].tolist()):
+            low, high = 0, len(last_2)
+            while low < high:
+                middle = (low + high) // 2
+                if last_2[middle] >= v_2 and (last_1[middle] != v_1 or last_2[middle] != v_2):
+                    low = middle + 1
+                else:
+                    high = middle
+
+            if low == len(last_2):
+                last_1.append(v_1)
+                last_2.append(v_2)
+            else:
+                last_1[low] = v_1
+                last_2[low] = v_2
+            ranks[i] = low
+
+        return ranks
+
+    dominated = dominance(values, values)
+    dominated_by = dominated.sum(axis=0)
+    remaining = np.ones(num_rows, dtype=bool)
+    rank = 0
+
+    while remaining.any():
+        front = remaining & (dominated_by == 0)
+        ranks[front] = rank
+        remaining &= ~front
+        dominated_by -= dominated[front].sum(axis=0)
+        rank += 1
+
+    return ranks
+
+
+def sort_fronts(values: np.ndarray, ranks: np.ndarray) -> List[np.ndarray]:
+    """
+    Row indexes of every front, in the order the pairwise sorting appends them: the first front in row order,
+    then every row when its last dominator of the previous front is reached, those of the same dominator in row
+    order.
+    """
+    fronts = [np.flatnonzero(ranks == 0)] if len(ranks) else []
+
+    for rank in range(1, int(ranks.max(initial=0)) + 1):
+        previous = fronts[-1]
+        front = np.flatnonzero(ranks == rank)
+
+        if values.shape[1] == 2:
+            # Sorted on the first objective decreasing, the previous front has the second one increasing: the rows
+            # dominating a row of the front are a slice of it
+            positions = np.flatnonzero(~np.isnan(values[previous]).any(axis=1))
+            positions = positions[np.lexsort((values[previous[positions], 1], -values[previous[positions], 0]))]
+            previous_values = values[previous[positions]]
+
+            stop = np.searchsorted(-previous_values[:, 0], -values[front, 0], side="right")
+            start = np.searchsorted(previous_values[:, 1], values[front, 1], side="left")
+            # Every slice holds a row at least, the -1 appended lets a slice end at the last row
+            slices = np.column_stack([start, stop]).ravel()
+            last_dominator = np.maximum.reduceat(np.append(positions, -1), slices)[::2]
+        else:
+            dominated = dominance(values[previous], values[front])
+            last_dominator = np.where(dominated, np.arange(len(previous))[:, None], -1).max(axis=0)
+
+        fronts.append(front[np.lexsort((front, last_dominator))])
+
+    return fronts
 
 
 class Nsga2:
 
     def __init__(self, exchange: str, symbol: str, strategy: str, tf: str, from_time: int, to_time: int,
-                 population_size: int):
+                 population_size: int, workers: int = 1, seed: Optional[int] = None):
+        """
+        workers: number of processes the Python strategies (obv, ichimoku, sup_res) are evaluated in. Above 1
+        the population is spread over a process pool that reads the candles from shared memory, the results
+        are the same as evaluating it in this process. Call close() once done to stop the pool.
+        The C++ strategies evaluate the population on as many native threads, in a single library call.
+        seed: of the random generator behind the populations, for reproducible runs.
+        """
         self.exchange = exchange
         self.symbol = symbol
         self.strategy = strategy
@@ -21,123 +162,159 @@ class Nsga2:
         self.to_time = to_time
         self.population_size = population_size
 
+        self.workers = workers
+
         self.params_data = STRAT_PARAMS[strategy]
-        self.population_params = []
+        # Parameter sets already tried, an offspring is only made of new ones
+        self.population_params = set()
 
-        if self.strategy in ["obv", "ichimoku", "sup_res"]:
-            h5_db = Hdf5Client(exchange)
-            self.data = h5_db.get_data(symbol, from_time, to_time)
-            self.data = resample_timeframe(self.data, tf)
+        # Columns of the parameters matrix of the populations
+        self.param_types = {p_code: p["type"] for p_code, p in self.params_data.items()}
+        self.param_columns = {p_code: i for i, p_code in enumerate(self.params_data)}
+        self.param_min = np.array([p["min"] for p in self.params_data.values()], dtype=np.float64)
+        self.param_max = np.array([p["max"] for p in self.params_data.values()], dtype=np.float64)
+        self.param_is_int = np.array([p["type"] == int for p in self.params_data.values()])
 
-        elif self.strategy in ["sma", "psar", "atr", "gpsar"]:
-            self.lib = get_library()
-            if self.strategy == "sma":
-                self.obj = self.lib.Sma_new(exchange.encode(), symbol.encode(), tf.encode(), from_time, to_time)
-            elif self.strategy == "psar":
-                self.obj = self.lib.Psar_new(exchange.encode(), symbol.encode(), tf.encode(), from_time, to_time)
-            elif self.strategy == "atr":
-                self.obj = self.lib.Atr_new(exchange.encode(), symbol.encode(), tf.encode(), from_time, to_time)
-            elif self.strategy == "gpsar":
-                self.obj = self.lib.GradientPsar_new(exchange.encode(), symbol.encode(), tf.encode(), from_time, to_time)
-
-    def _set_population_info(self, population: List[BacktestResult]):
-        for individual in population:
-            individual.symbol = self.symbol
-            individual.strategy = self.strategy
-            individual.tf = self.tf
-            individual.from_time = pd.to_datetime(self.from_time, unit='ms')
-            individual.to_time = pd.to_datetime(self.to_time, unit='ms')
-        return population
+        self.random = np.random.default_rng(seed)
+        self.info = {"symbol": symbol, "strategy": strategy, "tf": tf,
+                     "from_time": pd.to_datetime(from_time, unit='ms'), "to_time": pd.to_datetime(to_time, unit='ms')}
+
+        self.pool = None
+        self._shm: Optional[shared_memory.SharedMemory] = None
+
+        if self.strategy in PY_STRATEGIES:
+            h5_db = Hdf5Client(exchange, mode="r")
+            self.data = h5_db.get_resampled(symbol, tf, from_time, to_time, columns=STRAT_COLUMNS[strategy])
 
-    def create_initial_population(self) -> List[BacktestResult]:
+        elif self.strategy in CPP_STRATEGIES:
+            self.lib = get_library()
+            prefix = CPP_STRATEGIES[self.strategy][0]
+            self.obj = getattr(self.lib, f"{prefix}_new")(exchange.encode(), symbol.encode(), tf.encode(),
+                                                          from_time, to_time)
+
+    def _round_parameters(self, params: np.ndarray) -> np.ndarray:
+        for p_code, p in self.params_data.items():
+            if p["type"] == float:
+                column = self.param_columns[p_code]
+                params[:, column] = np.round(params[:, column], p["decimals"])
+        return params
 
-        population = []
+    def _random_subsets(self, count: int, minimum: int) -> np.ndarray:
+        """
+        Mask of a random subset of the parameters for every row, of a random size between minimum and all of
+        them.
+        """
+        num_params = len(self.params_data)
+        sizes = self.random.integers(minimum, num_params + 1, size=count)
+        ranks = self.random.random((count, num_params)).argsort(axis=1).argsort(axis=1)
+        return ranks < sizes[:, None]
+
+    def _new_rows(self, params: np.ndarray, count: int) -> List[Tuple]:
+        """
+        The first count rows of params that were never tried, in order.
+        """
+        rows = []
+
+        for row in map(tuple, params.tolist()):
+            if row not in self.population_params:
+                self.population_params.add(row)
+                rows.append(row)
+                if len(rows) == count:
+                    break
+
+        return rows
+
+    def _tournament(self, population: Population, count: int) -> np.ndarray:
+        """
+        Index of the best of two distinct random individuals, count times: the lowest rank, or the highest
+        crowding distance between individuals of the same rank (the first one when equal).
+        """
+        first = self.random.integers(0, len(population), size=count)
+        second = self.random.integers(0, len(population) - 1, size=count)
+        second += second >= first
+
+        rank = population.rank
+        crowding_distance = population.crowding_distance
+
+        first_wins = np.where(rank[first] != rank[second], rank[first] < rank[second],
+                              crowding_distance[first] >= crowding_distance[second])
+
+        return np.where(first_wins, first, second)
+
+    def create_initial_population(self) -> Population:
+
+        self.population_params.clear()
+        rows = []
+
+        while len(rows) < self.population_size:
+            count = self.population_size - len(rows)
+            params = np.empty((count, len(self.params_data)))
 
-        while len(population) < self.population_size:
-            backtest = BacktestResult()
             for p_code, p in self.params_data.items():
+                column = self.param_columns[p_code]
                 if p["type"] == int:
-                    backtest.parameters[p_code] = random.randint(p["min"], p["max"])
+                    params[:, column] = self.random.integers(p["min"], p["max"] + 1, size=count)
                 elif p["type"] == float:
-                    backtest.parameters[p_code] = round(random.uniform(p["min"], p["max"]), p["decimals"])
+                    params[:, column] = self.random.uniform(p["min"], p["max"], size=count)
 
-            if backtest not in population:
-                population.append(backtest)
-                self.population_params.append(backtest.parameters)
+            rows += self._new_rows(self._round_parameters(params), count)
 
-        population = self._set_population_info(population)
-
-        return population
+        return Population(np.array(rows), self.param_types, self.info)
 
-    def create_new_population(self, fronts: List[List[BacktestResult]]) -> List[BacktestResult]:
-
-        new_pop = []
+    def create_new_population(self, population: Population, fronts: List[np.ndarray]) -> Population:
+        """
+        The population_size best individuals of population: whole fronts first, then the most isolated
+        individuals (highest crowding distance) of the first front that does not fit.
+        """
+        selected = []
+        size = 0
 
         for front in fronts:
-            if len(new_pop) + len(front) > self.population_size:
-                max_individuals = self.population_size - len(new_pop)
+            if size + len(front) > self.population_size:
+                max_individuals = self.population_size - size
                 if max_individuals > 0:
-                    new_pop += sorted(front, key=lambda x: getattr(x, "crowding_distance"))[-max_individuals:]
+                    by_distance = front[np.argsort(population.crowding_distance[front], kind="stable")]
+                    selected.append(by_distance[-max_individuals:])
+                    size += max_individuals
             else:
-                new_pop += front
-
-        new_pop = self._set_population_info(new_pop)
-
-        return new_pop
-
-    def create_offspring_population(self, population: List[BacktestResult]) -> List[BacktestResult]:
+                selected.append(front)
+                size += len(front)
 
-        offspring_pop = []
+        # The next offspring is made of parameter sets not in this generation
+        self.population_params = set(map(tuple, population.parameters.tolist()))
 
-        while len(offspring_pop) != self.population_size:
-
-            parents: List[BacktestResult] = []
-
-            for i in range(2):
-                random_parents = random.sample(population, k=2)
-                if random_parents[0].rank != random_parents[1].rank:
-                    best_parent = min(random_parents, key=lambda x: getattr(x, "rank"))
-                else:
-                    best_parent = max(random_parents, key=lambda x: getattr(x, "crowding_distance"))
+        return population.take(np.concatenate(selected) if selected else np.empty(0, dtype=np.int64))
 
-                parents.append(best_parent)
+    def create_offspring_population(self, population: Population) -> Population:
 
-            new_child = BacktestResult()
-            new_child.parameters = copy(parents[0].parameters)
+        rows = []
 
-            # Crossover
+        while len(rows) < self.population_size:
+            count = self.population_size - len(rows)
 
-            number_of_crossovers = random.randint(1, len(self.params_data))
-            params_to_cross = random.sample(list(self.params_data.keys()), k=number_of_crossovers)
+            parents_1 = population.parameters[self._tournament(population, count)]
+            parents_2 = population.parameters[self._tournament(population, count)]
 
-            for p in params_to_cross:
-                new_child.parameters[p] = copy(parents[1].parameters[p])
+            # Crossover: between one and all the parameters of the second parent
 
-            # Mutation
+            children = np.where(self._random_subsets(count, 1), parents_2, parents_1)
 
-            number_of_mutations = random.randint(0, len(self.params_data))
-            params_to_change = random.sample(list(self.params_data.keys()), k=number_of_mutations)
+            # Mutation: of none to all the parameters, by -200% to +200%
 
-            for p in params_to_change:
-                mutations_strength = random.uniform(-2, 2)
-                new_child.parameters[p] = self.params_data[p]["type"](new_child.parameters[p] * (1 + mutations_strength))
-                new_child.parameters[p] = max(new_child.parameters[p], self.params_data[p]["min"])
-                new_child.parameters[p] = min(new_child.parameters[p], self.params_data[p]["max"])
+            mutated = children * (1 + self.random.uniform(-2, 2, size=children.shape))
+            mutated[:, self.param_is_int] = np.trunc(mutated[:, self.param_is_int])
+            mutated = self._round_parameters(np.clip(mutated, self.param_min, self.param_max))
 
-                if self.params_data[p]["type"] == float:
-                    new_child.parameters[p] = round(new_child.parameters[p], self.params_data[p]["decimals"])
+            children = np.where(self._random_subsets(count, 0), mutated, children)
+            children = self._params_constraints(children)
 
-            new_child.parameters = self._params_constraints(new_child.parameters)
+            rows += self._new_rows(children, count)
 
-            if new_child.parameters not in self.population_params:
-                offspring_pop.append(new_child)
-                self.population_params.append(new_child.parameters)
+        return Population(np.array(rows), self.param_types, self.info)
 
-        offspring_pop = self._set_population_info(offspring_pop)
+    def _params_constraints(self, params: np.ndarray) -> np.ndarray:
+        column = self.param_columns
 
-        return offspring_pop
-
-    def _params_constraints(self, params: Dict) -> Dict:
         if self.strategy == "obv":
             pass
 
@@ -145,225 +322,165 @@ class Nsga2:
             pass
 
         elif self.strategy == "ichimoku":
-            params["kijun_period"] = max(params["kijun_period"], params["tenkan_period"])
+            params[:, column["kijun_period"]] = np.maximum(params[:, column["kijun_period"]],
+                                                           params[:, column["tenkan_period"]])
 
         elif self.strategy == "sma":
-            params["slow_ma"] = max(params["slow_ma"], params["fast_ma"])
+            params[:, column["slow_ma"]] = np.maximum(params[:, column["slow_ma"]], params[:, column["fast_ma"]])
 
-        elif self.strategy == "psar":
-            params["initial_acc"] = min(params["initial_acc"], params["max_acc"])
-            params["acc_increment"] = min(params["acc_increment"], params["max_acc"] - params["initial_acc"])
+        elif self.strategy in ["psar", "gpsar"]:
+            params[:, column["initial_acc"]] = np.minimum(params[:, column["initial_acc"]],
+                                                          params[:, column["max_acc"]])
+            params[:, column["acc_increment"]] = np.minimum(params[:, column["acc_increment"]],
+                                                            params[:, column["max_acc"]] -
+                                                            params[:, column["initial_acc"]])
 
         elif self.strategy == "atr":
             pass
 
-        elif self.strategy == "gpsar":
-            params["initial_acc"] = min(params["initial_acc"], params["max_acc"])
-            params["acc_increment"] = min(params["acc_increment"], params["max_acc"] - params["initial_acc"])
-
         return params
 
-    def crowding_distance(self, population: List[BacktestResult]) -> List[BacktestResult]:
-
-        # TODO add num_trades
-        for objective in ["pnl", "max_dd", "sharpe_ratio"]:
-
-            population = sorted(population, key=lambda x: getattr(x, objective))
-            min_value = getattr(min(population, key=lambda x: getattr(x, objective)), objective)
-            max_value = getattr(max(population, key=lambda x: getattr(x, objective)), objective)
-
-            population[0].crowding_distance = float("inf")
-            population[-1].crowding_distance = float("inf")
-
-            for i in range(1, len(population) - 1):
-                distance = getattr(population[i + 1], objective) - getattr(population[i - 1], objective)
-                diff = max_value - min_value
-                if diff != 0:
-                    distance = distance / (diff)
-                population[i].crowding_distance += distance
-
-        return population
-
-    def non_dominated_sorting(self, population: Dict[int, BacktestResult]) -> List[List[BacktestResult]]:
-
-        fronts = []
-
-        # TODO add num_trades
-        for id_1, indiv_1 in population.items():
-            for id_2, indiv_2 in population.items():
-                # WIP - Original Code
-                # if (
-                #         indiv_1.pnl >= indiv_2.pnl
-                #         and indiv_1.max_dd <= indiv_2.max_dd
-                #         and ( indiv_1.pnl > indiv_2.pnl or indiv_1.max_dd < indiv_2.max_dd )
-                # ):
-                #     indiv_1.dominates.append(id_2)
-                # elif (
-                #         indiv_2.pnl >= indiv_1.pnl
-                #         and indiv_2.max_dd <= indiv_1.max_dd
-                #         and ( indiv_2.pnl > indiv_1.pnl or indiv_2.max_dd < indiv_1.max_dd )
-                # ):
-                #     indiv_1.dominated_by += 1
-
-                if (
-                    indiv_1.cagr >= indiv_2.cagr
-                    and indiv_1.sharpe_ratio >= indiv_2.sharpe_ratio
-                    and ( indiv_1.cagr > indiv_2.cagr or indiv_1.sharpe_ratio > indiv_2.sharpe_ratio)
-                ):
-                    indiv_1.dominates.append(id_2)
-                elif (
-                        indiv_2.cagr >= indiv_1.cagr
-                        and indiv_2.sharpe_ratio >= indiv_1.sharpe_ratio
-                        and (indiv_2.cagr > indiv_1.cagr or indiv_2.sharpe_ratio > indiv_1.sharpe_ratio)
-                ):
-                    indiv_1.dominated_by += 1
-
-            if indiv_1.dominated_by == 0:
-                if len(fronts) == 0:
-                    fronts.append([])
-                fronts[0].append(indiv_1)
-                indiv_1.rank = 0
-
-        i = 0
-
-        while True:
-            fronts.append([])
-
-            for indiv_1 in fronts[i]:
-                for indiv_2_id in indiv_1.dominates:
-                    population[indiv_2_id].dominated_by -= 1
-                    if population[indiv_2_id].dominated_by == 0:
-                        fronts[i + 1].append(population[indiv_2_id])
-                        population[indiv_2_id].rank = i + 1
-
-            if len(fronts[i + 1]) > 0:
-                i += 1
+    def crowding_distance(self, population: Population) -> Population:
+        """
+        Crowding distances of the population taken as a single front, returned in the order of the last sort.
+        """
+        return population.take(self.crowding_distances(population, [np.arange(len(population))])[0])
+
+    def crowding_distances(self, population: Population, fronts: List[np.ndarray]) -> List[np.ndarray]:
+        """
+        Adds the crowding distance on CROWDING_OBJECTIVES to every individual of every front, at once. For each
+        objective in turn, the front is stable sorted on it (starting from the order of the previous objective),
+        its first and last individuals get an infinite distance and the others the distance between their
+        neighbours over the range of the front. Returns the fronts in the order of the last sort.
+        """
+        individuals = np.concatenate(fronts) if fronts else np.empty(0, dtype=np.int64)
+        if len(individuals) == 0:
+            return fronts
+
+        values = np.column_stack([getattr(population, o)[individuals] for o in CROWDING_OBJECTIVES])
+        distances = population.crowding_distance[individuals]
+        front_ids = np.repeat(np.arange(len(fronts)), [len(front) for front in fronts])
+
+        order = np.arange(len(individuals))
+
+        for objective in range(len(CROWDING_OBJECTIVES)):
+            order = order[np.lexsort((values[order, objective], front_ids[order]))]
+            sorted_values = values[order, objective]
+            sorted_fronts = front_ids[order]
+
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = sorted_fronts[1:] != sorted_fronts[:-1]
+            last = np.ones(len(order), dtype=bool)
+            last[:-1] = first[1:]
+            # Sorted, the range of a front is between its last and first values
+            segment = np.cumsum(first) - 1
+            with np.errstate(invalid="ignore"):
+                diff = (sorted_values[last] - sorted_values[first])[segment]
+
+            distance = np.zeros(len(order))
+            # The infinite results of the backtests without trades give NaN differences, as they did in Python
+            with np.errstate(invalid="ignore"):
+                distance[1:-1] = sorted_values[2:] - sorted_values[:-2]
+                np.divide(distance, diff, out=distance, where=diff != 0)
+
+            inner = ~(first | last)
+            distances[order[inner]] += distance[inner]
+            distances[order[~inner]] = float("inf")
+
+        population.crowding_distance[individuals] = distances
+
+        sorted_fronts = front_ids[order]
+        bounds = np.searchsorted(sorted_fronts, np.arange(len(fronts) + 1))
+
+        return [individuals[order[bounds[f]:bounds[f + 1]]] for f in range(len(fronts))]
+
+    def non_dominated_sorting(self, population: Population) -> List[np.ndarray]:
+        """
+        Fronts of the population on SORT_OBJECTIVES, as arrays of row indexes, each individual's rank set to the
+        index of its front. Same fronts, in the same order, as comparing every pair of individuals.
+        """
+        values = np.column_stack([getattr(population, o) for o in SORT_OBJECTIVES])
+        population.rank[:] = dominance_ranks(values)
+
+        return sort_fronts(values, population.rank)
+
+    def _start_pool(self):
+        """
+        Copies the candles once into a shared memory block the workers map, instead of pickling them with
+        every task.
+        """
+        columns = list(self.data.columns)
+        shape = (1 + len(columns), len(self.data))
+
+        self._shm = shared_memory.SharedMemory(create=True, size=max(8 * shape[0] * shape[1], 1))
+        block = np.ndarray(shape, dtype=np.float64, buffer=self._shm.buf)
+        block[0] = self.data.index.values.astype("datetime64[ms]").astype(np.int64)
+        block[1:] = self.data.to_numpy(dtype=np.float64).T
+
+        self.pool = multiprocessing.Pool(self.workers, initializer=_init_worker,
+                                         initargs=(self._shm.name, shape, columns, str(self.data.index.dtype),
+                                                   self.strategy))
+
+    def __enter__(self) -> "Nsga2":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Stops the worker processes and frees the shared candles. Also called when leaving a with block, so an
+        error or Ctrl-C during the generations doesn't leave them behind.
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def evaluate_population(self, population: Population) -> Population:
+
+        if self.strategy in PY_STRATEGIES:
+            params = population.parameter_dicts()
+
+            if self.workers > 1 and len(population) > 1:
+                if self.pool is None:
+                    self._start_pool()
+                # map() returns the results in the order of the population whichever worker ran them
+                chunksize = math.ceil(len(params) / (self.workers * 4))
+                results = self.pool.map(_evaluate, params, chunksize=chunksize)
             else:
-                del fronts[-1]
-                break
-
-        return fronts
-
-    def evaluate_population(self, population: List[BacktestResult]) -> List[BacktestResult]:
-
-        if self.strategy == "obv":
-            for bt in population:
-                bt.pnl, bt.max_dd, bt.num_trades, bt.sharpe_ratio, bt.cagr = obv.backtest(self.data, ma_period=bt.parameters["ma_period"])
-
-                if bt.pnl == 0:
-                    bt.pnl = -float("inf")
-                    bt.max_dd = float("inf")
-                    bt.num_trades = 0
-                    bt.sharpe_ratio = -float("inf")
-                    bt.cagr = -float("inf")
-
-            return population
+                strategy = PY_STRATEGIES[self.strategy]
+                results = [strategy.backtest(self.data, **par) for par in params]
+
+            results = np.array(results, dtype=np.float64).reshape(len(population), 5)
+            population.pnl, population.max_dd, num_trades, population.sharpe_ratio, population.cagr = results.T.copy()
+            # Counted as a float by the pandas strategies
+            population.num_trades = np.rint(np.nan_to_num(num_trades)).astype(np.int64)
+
+        elif self.strategy in CPP_STRATEGIES:
+            # One call for the whole population, backtested on self.workers threads sharing the candles
+            prefix, args = CPP_STRATEGIES[self.strategy]
+            params = np.ascontiguousarray(population.parameters[:, [self.param_columns[p] for p in args]])
+            metrics = np.zeros(len(population), dtype=BACKTEST_METRICS_DTYPE)
+
+            getattr(self.lib, f"{prefix}_execute_batch")(self.obj, params.ctypes.data_as(POINTER(c_double)),
+                                                         len(population),
+                                                         metrics.ctypes.data_as(POINTER(BacktestMetrics)),
+                                                         self.workers)
+
+            for column in ["pnl", "max_dd", "num_trades", "sharpe_ratio", "cagr"]:
+                setattr(population, column, metrics[column].astype(getattr(population, column).dtype))
+
+        no_trades = population.pnl == 0
+        population.pnl[no_trades] = -float("inf")
+        population.max_dd[no_trades] = float("inf")
+        population.num_trades[no_trades] = 0
+        population.sharpe_ratio[no_trades] = -float("inf")
+        population.cagr[no_trades] = -float("inf")
 
-        elif self.strategy == "ichimoku":
-            for bt in population:
-                bt.pnl, bt.max_dd, bt.num_trades, bt.sharpe_ratio, bt.cagr = ichimoku.backtest(self.data, tenkan_period=bt.parameters["tenkan_period"],
-                                                      kijun_period=bt.parameters["kijun_period"])
-
-                if bt.pnl == 0:
-                    bt.pnl = -float("inf")
-                    bt.max_dd = float("inf")
-                    bt.num_trades = 0
-                    bt.sharpe_ratio = -float("inf")
-                    bt.cagr = -float("inf")
-
-            return population
-
-        elif self.strategy == "sup_res":
-
-            for bt in population:
-                bt.pnl, bt.max_dd, bt.num_trades, bt.sharpe_ratio, bt.cagr = support_resistance.backtest(self.data, min_points=bt.parameters["min_points"],
-                                                                min_diff_points=bt.parameters["min_diff_points"],
-                                                                rounding_nb=bt.parameters["rounding_nb"],
-                                                                take_profit=bt.parameters["take_profit"],
-                                                                stop_loss=bt.parameters["stop_loss"])
-
-                if bt.pnl == 0:
-                    bt.pnl = -float("inf")
-                    bt.max_dd = float("inf")
-                    bt.num_trades = 0
-                    bt.sharpe_ratio = -float("inf")
-                    bt.cagr = -float("inf")
-
-            return population
-
-        elif self.strategy == "sma":
-
-            for bt in population:
-                self.lib.Sma_execute_backtest(self.obj, bt.parameters["slow_ma"], bt.parameters["fast_ma"])
-                bt.pnl = self.lib.Sma_get_pnl(self.obj)
-                bt.max_dd = self.lib.Sma_get_max_dd(self.obj)
-                bt.num_trades = self.lib.Sma_get_num_trades(self.obj)
-                bt.sharpe_ratio = self.lib.Sma_get_sharpe_ratio(self.obj)
-                bt.cagr = self.lib.Sma_get_cagr(self.obj)
-
-                if bt.pnl == 0:
-                    bt.pnl = -float("inf")
-                    bt.max_dd = float("inf")
-                    bt.num_trades = 0
-                    bt.sharpe_ratio = -float("inf")
-                    bt.cagr = -float("inf")
-
-            return population
-
-        elif self.strategy == "psar":
-
-            for bt in population:
-                self.lib.Psar_execute_backtest(self.obj, bt.parameters["initial_acc"], bt.parameters["acc_increment"],
-                                               bt.parameters["max_acc"])
-                bt.pnl = self.lib.Psar_get_pnl(self.obj)
-                bt.max_dd = self.lib.Psar_get_max_dd(self.obj)
-                bt.num_trades = self.lib.Psar_get_num_trades(self.obj)
-                bt.sharpe_ratio = self.lib.Psar_get_sharpe_ratio(self.obj)
-                bt.cagr = self.lib.Psar_get_cagr(self.obj)
-
-                if bt.pnl == 0:
-                    bt.pnl = -float("inf")
-                    bt.max_dd = float("inf")
-                    bt.num_trades = 0
-                    bt.sharpe_ratio = -float("inf")
-                    bt.cagr = -float("inf")
-
-            return population
-
-        elif self.strategy == "atr":
-            for bt in population:
-                self.lib.Atr_execute_backtest(self.obj, bt.parameters["period"], bt.parameters["atr_multiplier"])
-                bt.pnl = self.lib.Atr_get_pnl(self.obj)
-                bt.max_dd = self.lib.Atr_get_max_dd(self.obj)
-                bt.num_trades = self.lib.Atr_get_num_trades(self.obj)
-                bt.sharpe_ratio = self.lib.Atr_get_sharpe_ratio(self.obj)
-                bt.cagr = self.lib.Atr_get_cagr(self.obj)
-
-                if bt.pnl == 0:
-                    bt.pnl = -float("inf")
-                    bt.max_dd = float("inf")
-                    bt.num_trades = 0
-                    bt.sharpe_ratio = -float("inf")
-                    bt.cagr = -float("inf")
-
-            return population
-
-        elif self.strategy == "gpsar":
-
-            for bt in population:
-                self.lib.GradientPsar_execute_backtest(self.obj, bt.parameters["initial_acc"], bt.parameters["acc_increment"],
-                                               bt.parameters["max_acc"], bt.parameters["gradient_threshold"], bt.parameters["gradient_period"])
-                bt.pnl = self.lib.GradientPsar_get_pnl(self.obj)
-                bt.max_dd = self.lib.GradientPsar_get_max_dd(self.obj)
-                bt.num_trades = self.lib.GradientPsar_get_num_trades(self.obj)
-                bt.sharpe_ratio = self.lib.GradientPsar_get_sharpe_ratio(self.obj)
-                bt.cagr = self.lib.GradientPsar_get_cagr(self.obj)
-
-                if bt.pnl == 0:
-                    bt.pnl = -float("inf")
-                    bt.max_dd = float("inf")
-                    bt.num_trades = 0
-                    bt.sharpe_ratio = -float("inf")
-                    bt.cagr = -float("inf")
-
-            return population
+        return population
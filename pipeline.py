@@ -0,0 +1,260 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger()
+
+# End of stream marker passed down the queues
+_DONE = object()
+
+
+class StageMetrics:
+    """
+    Throughput of one pipeline stage. busy is the time spent doing work, excluding the time spent waiting
+    on the queues, so rows_per_sec shows what the stage alone could sustain.
+    errors lists the (window, error) of the windows the stage failed on, their data is missing or incomplete.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.rows = 0
+        self.busy = 0.0
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.errors: List[Tuple[Tuple[int, int], Exception]] = []
+        self._lock = threading.Lock()
+
+    def record(self, rows: int, seconds: float):
+        with self._lock:
+            self.items += 1
+            self.rows += rows
+            self.busy += seconds
+
+    def record_error(self, window: Tuple[int, int], error: Exception):
+        with self._lock:
+            self.errors.append((window, error))
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.busy if self.busy > 0 else 0.0
+
+    @property
+    def wall_rows_per_sec(self) -> float:
+        if self.started is None or self.finished is None or self.finished <= self.started:
+            return 0.0
+        return self.rows / (self.finished - self.started)
+
+    def __repr__(self):
+        failed = f", {len(self.errors)} failed" if self.errors else ""
+        return (f"{self.name}: {self.items} items, {self.rows} rows, {round(self.rows_per_sec)} rows/s busy, "
+                f"{round(self.wall_rows_per_sec)} rows/s wall{failed}")
+
+
+def failed_windows(metrics: Dict[str, StageMetrics]) -> List[Tuple[int, int]]:
+    """
+    Sorted windows of a pipeline run that failed to fetch or parse. The rest of the windows were answered in full.
+    """
+    return sorted({window for m in metrics.values() for window, _ in m.errors})
+
+
+class CollectionPipeline:
+    """
+    window producer -> fetcher(s) -> parser -> batched writer
+
+    Every stage runs on its own thread (the writer on the calling thread) and the stages are connected by
+    bounded queues, so network waits, parsing and HDF5 writes overlap while memory stays bounded by
+    queue_size responses plus one write batch.
+
+    fetch(start, end) returns the raw candles of a window (or None), parse(raw) turns them into a
+    (N, columns) float64 array and write(array) stores a batch of up to batch_size rows.
+    With paged=True fetch(start, end) returns an iterator of pages instead, each page is passed downstream
+    as soon as it arrives.
+
+    A window whose fetch or parse raises is logged and recorded in the metrics (see failed_windows), the other
+    windows carry on. A failure of the window producer or of the writer is raised by run().
+    """
+
+    def __init__(self, fetch: Callable[[int, int], Any], parse: Callable[[Any], np.ndarray],
+                 write: Callable[[np.ndarray], None], fetch_workers: int = 1, queue_size: int = 8,
+                 batch_size: int = 10000, paged: bool = False):
+        self.fetch = fetch
+        self.parse = parse
+        self.write = write
+        self.paged = paged
+        self.fetch_workers = fetch_workers
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+
+        self.metrics = {name: StageMetrics(name) for name in ["produce", "fetch", "parse", "write"]}
+        self._stop = threading.Event()
+        self._producer_error: Optional[Exception] = None
+
+    def run(self, windows: Iterable[Tuple[int, int]]) -> Dict[str, StageMetrics]:
+        windows_queue = queue.Queue(maxsize=self.queue_size)
+        raw_queue = queue.Queue(maxsize=self.queue_size)
+        parsed_queue = queue.Queue(maxsize=self.queue_size)
+
+        threads = [threading.Thread(target=self._produce, args=(windows, windows_queue), daemon=True),
+                   threading.Thread(target=self._parse, args=(raw_queue, parsed_queue), daemon=True)]
+        threads += [threading.Thread(target=self._fetch, args=(windows_queue, raw_queue), daemon=True)
+                    for _ in range(self.fetch_workers)]
+
+        for t in threads:
+            t.start()
+
+        try:
+            self._write(parsed_queue)
+        finally:
+            # Unblocks the upstream stages if the writer failed
+            self._stop.set()
+            for t in threads:
+                t.join()
+
+        if self._producer_error is not None:
+            # The windows after the failure were never requested
+            raise self._producer_error
+
+        return self.metrics
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _produce(self, windows: Iterable[Tuple[int, int]], windows_queue: queue.Queue):
+        metrics = self.metrics["produce"]
+        metrics.started = time.time()
+
+        try:
+            for window in windows:
+                metrics.record(0, 0.0)
+                if not self._put(windows_queue, window):
+                    return
+        except Exception as e:
+            logger.error(f"Window producer failed: {e}")
+            self._producer_error = e
+        finally:
+            metrics.finished = time.time()
+            for _ in range(self.fetch_workers):
+                self._put(windows_queue, _DONE)
+
+    def _fetch(self, windows_queue: queue.Queue, raw_queue: queue.Queue):
+        metrics = self.metrics["fetch"]
+        if metrics.started is None:
+            metrics.started = time.time()
+
+        try:
+            while not self._stop.is_set():
+                window = self._get(windows_queue)
+                if window is _DONE:
+                    return
+
+                if self.paged:
+                    if not self._fetch_pages(window, raw_queue):
+                        return
+                    continue
+
+                start = time.time()
+                try:
+                    raw = self.fetch(*window)
+                except Exception as e:
+                    logger.error(f"Fetching {window} failed: {e}")
+                    metrics.record_error(window, e)
+                    raw = None
+                metrics.record(len(raw) if raw is not None else 0, time.time() - start)
+
+                if raw is not None and len(raw) and not self._put(raw_queue, (window, raw)):
+                    return
+        finally:
+            metrics.finished = time.time()
+            self._put(raw_queue, _DONE)
+
+    def _fetch_pages(self, window: Tuple[int, int], raw_queue: queue.Queue) -> bool:
+        metrics = self.metrics["fetch"]
+
+        try:
+            pages = iter(self.fetch(*window))
+            while True:
+                start = time.time()
+                raw = next(pages, None)
+                if raw is None:
+                    return True
+                metrics.record(len(raw), time.time() - start)
+
+                if len(raw) and not self._put(raw_queue, (window, raw)):
+                    return False
+        except Exception as e:
+            # The pages already fetched are written, the window is still incomplete
+            logger.error(f"Fetching {window} failed: {e}")
+            metrics.record_error(window, e)
+            return True
+
+    def _parse(self, raw_queue: queue.Queue, parsed_queue: queue.Queue):
+        metrics = self.metrics["parse"]
+        metrics.started = time.time()
+        fetchers_done = 0
+
+        try:
+            while fetchers_done < self.fetch_workers and not self._stop.is_set():
+                item = self._get(raw_queue)
+                if item is _DONE:
+                    fetchers_done += 1
+                    continue
+
+                window, raw = item
+                start = time.time()
+                try:
+                    data = self.parse(raw)
+                except Exception as e:
+                    logger.error(f"Parsing {window} failed: {e}")
+                    metrics.record_error(window, e)
+                    continue
+                metrics.record(data.shape[0], time.time() - start)
+
+                if data.shape[0] and not self._put(parsed_queue, data):
+                    return
+        finally:
+            metrics.finished = time.time()
+            self._put(parsed_queue, _DONE)
+
+    def _write(self, parsed_queue: queue.Queue):
+        metrics = self.metrics["write"]
+        metrics.started = time.time()
+        pending = []
+        pending_rows = 0
+
+        while True:
+            data = parsed_queue.get()
+
+            if data is not _DONE:
+                pending.append(data)
+                pending_rows += data.shape[0]
+
+            if pending and (data is _DONE or pending_rows >= self.batch_size):
+                batch = np.concatenate(pending)
+                start = time.time()
+                self.write(batch)
+                metrics.record(batch.shape[0], time.time() - start)
+                pending.clear()
+                pending_rows = 0
+
+            if data is _DONE:
+                metrics.finished = time.time()
+                return
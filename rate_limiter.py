@@ -0,0 +1,86 @@
+import threading
+import time
+from typing import Dict
+
+# Budgets used by the exchange clients, kept ~10% under the published limits:
+# Binance REQUEST_WEIGHT is 6000/min on spot and 2400/min on futures, Oanda allows 120 REST requests/s.
+# capacity is the burst allowed on top of the steady rate.
+RATE_LIMITS = {
+    "binance": {"capacity": 600, "rate": 6000 * 0.9 / 60},
+    "binance_futures": {"capacity": 240, "rate": 2400 * 0.9 / 60},
+    "oanda": {"capacity": 20, "rate": 100},
+}
+
+_limiters: Dict[str, "TokenBucket"] = dict()
+_limiters_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Holds up to `capacity` tokens and refills at `rate` tokens per second.
+    acquire() blocks until enough tokens are available, so every thread sharing a bucket stays under the rate.
+    """
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self._tokens = capacity
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        if now <= self._last_refill:
+            # Paused, nothing accrues until the pause ends
+            return
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self, tokens: float = 1.0):
+        tokens = min(tokens, self.capacity)
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._refill()
+                    if self._tokens >= tokens:
+                        self._tokens -= tokens
+                        return
+                    wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def update_usage(self, used: float, limit: float):
+        """
+        Aligns the bucket with the usage reported by the server (e.g. Binance's X-MBX-USED-WEIGHT-1M header).
+        The burst left is scaled down to the share of the server-side limit still unused, and goes negative
+        once the server counts more than the limit, so the callers slow down before being rejected.
+        """
+        with self._lock:
+            self._refill()
+            headroom = (limit - used) / limit * self.capacity
+            self._tokens = min(self._tokens, headroom)
+
+    def pause(self, seconds: float):
+        """
+        Blocks every acquire() for the given time, used when the server asks to back off (HTTP 429/418).
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            # Restart from an empty bucket once the pause is over
+            self._tokens = min(self._tokens, 0)
+            self._last_refill = self._paused_until
+
+
+def get_rate_limiter(name: str) -> TokenBucket:
+    """
+    One shared bucket per exchange (see RATE_LIMITS), so all the clients of an exchange created in this
+    process draw from the same budget.
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = TokenBucket(**RATE_LIMITS[name])
+        return _limiters[name]
@@ -0,0 +1,85 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from utils import atomic_write
+
+logger = logging.getLogger()
+
+# Exchange info rarely changes, a day old list is fine to start with
+SYMBOLS_TTL = 24 * 60 * 60
+
+
+class SymbolCache:
+    """
+    Exchange symbol lists cached in data/<name>_symbols.json.
+
+    load() only goes to the network when there is no usable cache file. A cache older than the TTL is still
+    returned straight away and refreshed on a background thread, on_refresh() receives the new data so the
+    client can swap it in. If the exchange can't be reached the stale cache is kept.
+    """
+
+    def __init__(self, name: str, fetch: Callable[[], Dict], ttl: float = SYMBOLS_TTL,
+                 on_refresh: Optional[Callable[[Dict], None]] = None, directory: str = "data"):
+        self.name = name
+        self.fetch = fetch
+        self.ttl = ttl
+        self.on_refresh = on_refresh
+        self.path = os.path.join(directory, f"{name}_symbols.json")
+
+        self._refresh_thread: Optional[threading.Thread] = None
+
+    def load(self) -> Dict:
+        cached = self._read()
+
+        if cached is None:
+            return self.refresh()
+
+        age = time.time() - cached["fetched_at"]
+        if age > self.ttl:
+            logger.info(f"{self.name} symbols cached {int(age)}s ago, refreshing in the background")
+            self._refresh_thread = threading.Thread(target=self._background_refresh, daemon=True)
+            self._refresh_thread.start()
+
+        return cached["data"]
+
+    def refresh(self) -> Dict:
+        data = self.fetch()
+        self._write(data)
+        return data
+
+    def _background_refresh(self):
+        try:
+            data = self.refresh()
+        except Exception as e:
+            logger.warning(f"Could not refresh the {self.name} symbols, keeping the cached list: {e}")
+            return
+
+        if self.on_refresh is not None:
+            self.on_refresh(data)
+
+    def _read(self) -> Optional[Dict]:
+        try:
+            with open(self.path) as f:
+                cached = json.load(f)
+            cached["fetched_at"] = float(cached["fetched_at"])
+            if "symbols" not in cached["data"]:
+                raise KeyError("symbols")
+            return cached
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring the unreadable symbol cache {self.path}: {e}")
+            return None
+
+    def _write(self, data: Dict):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        def write(tmp_path: str):
+            with open(tmp_path, "w") as f:
+                json.dump({"fetched_at": time.time(), "data": data}, f)
+
+        atomic_write(self.path, write)
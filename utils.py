@@ -1,9 +1,25 @@
 from datetime import datetime, timezone
+import os
+import threading
+import numpy as np
 import pandas as pd
 import typing
 from ctypes import *
+from pandas.tseries.frequencies import to_offset
 
-TF_EQUIV = {"1m": "1Min", "5m": "5Min", "15m": "15Min", "30m": "30Min", "1h": "1h", "4h": "4h", "12h": "12h", "1d": "d"}
+TF_EQUIV = {"1m": "1Min", "5m": "5Min", "15m": "15Min", "30m": "30Min", "1h": "1h", "4h": "4h", "12h": "12h", "1d": "D"}
+TF_MS = {"1m": 60_000, "5m": 300_000, "15m": 900_000, "30m": 1_800_000, "1h": 3_600_000, "4h": 14_400_000,
+         "12h": 43_200_000, "1d": 86_400_000}
+
+# Candle columns after the timestamp, in storage order
+CANDLE_COLUMNS = ["open", "high", "low", "close", "volume", "spread"]
+
+# Candle columns each Python strategy reads, so the columnar layout only loads those
+STRAT_COLUMNS = {
+    "obv": ["close", "volume"],
+    "ichimoku": ["high", "low", "close"],
+    "sup_res": ["high", "low", "close"],
+}
 
 STRAT_PARAMS = {
     "obv": {
@@ -55,10 +71,230 @@ def dt_to_ms(dt: typing.Union[str, datetime]) -> typing.Union[int, None]:
     return int(pd.to_datetime(dt).timestamp() * 1000)
 
 
-def resample_timeframe(data: pd.DataFrame, tf: str) -> pd.DataFrame:
-    return data.resample(TF_EQUIV.get(tf)).agg(
-        {"open": "first", "high": "max", "low": "min", "close": "last", "volume": "sum"}
-    )
+def atomic_write(path: str, write_fn: typing.Callable[[str], None]):
+    """
+    write_fn(tmp_path) writes the content to a temporary file next to path, which then replaces path in one step,
+    so the readers (other threads and processes) never see a partial file. The temporary file is removed if
+    writing it fails.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        write_fn(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def resample_timeframe(data: pd.DataFrame, tf: str, empty_buckets: str = "nan") -> pd.DataFrame:
+    """
+    Aggregates 1m candles into tf candles: first open, max high, min low, last close, summed volume and mean
+    spread, over buckets aligned on the epoch. Same output as
+    data.resample(TF_EQUIV[tf]).agg({"open": "first", ..., "spread": "mean"}), computed with NumPy reductions
+    over the int64 timestamps.
+
+    empty_buckets sets what happens to the buckets without candles between the first and the last one:
+    "nan" keeps them with NaN prices and 0 volume (as pandas does), "drop" leaves them out and "ffill" turns them
+    into flat candles at the previous close.
+    """
+    columns = [c for c in CANDLE_COLUMNS if c in data.columns]
+
+    timestamps = data.index.values.astype("datetime64[ms]").astype(np.int64)
+    values = {c: data[c].to_numpy(dtype=np.float64) for c in columns}
+
+    if data.shape[0] == 0:
+        df = candles_frame(timestamps, values, tf, empty_buckets, unit=getattr(data.index, "unit", "ns"))
+        df.index.name = data.index.name
+        return df
+
+    if not data.index.is_monotonic_increasing:
+        order = np.argsort(timestamps, kind="stable")
+        timestamps = timestamps[order]
+        values = {c: v[order] for c, v in values.items()}
+
+    bucket_ts, starts, ends = _bucket_bounds(timestamps, TF_MS[tf])
+    aggregated = {c: _aggregate_column(v, c, starts, ends) for c, v in values.items()}
+
+    df = candles_frame(bucket_ts, aggregated, tf, empty_buckets, unit=getattr(data.index, "unit", "ns"))
+    df.index.name = data.index.name
+
+    return df
+
+
+def candles_frame(timestamps: np.ndarray, values: typing.Dict[str, np.ndarray], tf: str, empty_buckets: str = "nan",
+                  unit: str = "ms") -> pd.DataFrame:
+    """
+    DataFrame of aggregated candles (bucket start times in ms and one array per column) in resample_timeframe()
+    layout, the empty buckets handled as described there.
+    """
+    if empty_buckets not in ["nan", "drop", "ffill"]:
+        raise ValueError(f"Unknown empty bucket handling: {empty_buckets}")
+
+    tf_ms = TF_MS[tf]
+    timestamps = np.asarray(timestamps).astype(np.int64)
+    columns = list(values.keys())
+
+    if empty_buckets == "drop" or timestamps.shape[0] == 0:
+        index = pd.DatetimeIndex(timestamps.astype("datetime64[ms]").astype(f"datetime64[{unit}]"))
+        block = np.empty((len(columns), timestamps.shape[0]))
+        for i, c in enumerate(columns):
+            block[i] = values[c]
+    else:
+        positions = (timestamps - timestamps[0]) // tf_ms
+        num_buckets = int(positions[-1]) + 1
+
+        # Regular buckets from the first to the last one, with the frequency like a resample() index
+        index = pd.date_range(pd.Timestamp(int(timestamps[0]), unit="ms"), periods=num_buckets,
+                              freq=to_offset(TF_EQUIV[tf]), unit=unit)
+
+        block = np.empty((len(columns), num_buckets))
+        empty = None
+        if num_buckets > timestamps.shape[0]:
+            empty = np.ones(num_buckets, dtype=bool)
+            empty[positions] = False
+
+        for i, c in enumerate(columns):
+            if empty is None:
+                block[i] = values[c]
+            else:
+                block[i].fill(0.0 if c == "volume" else np.nan)
+                block[i, positions] = values[c]
+
+        if empty is not None and empty_buckets == "ffill":
+            # Flat candles at the previous close, the spread carried over
+            last = np.maximum.accumulate(np.where(empty, 0, np.arange(num_buckets)))[empty]
+            for i, c in enumerate(columns):
+                if c != "volume":
+                    source = columns.index("close") if c != "spread" and "close" in columns else i
+                    block[i, empty] = block[source, last]
+
+    # The block is laid out the way DataFrame stores float columns, so no copy is made
+    return pd.DataFrame(block.T, index=index, columns=columns, copy=False)
+
+
+def aggregate_candles(data: np.ndarray, tf_ms: int, columns: typing.Optional[typing.List[str]] = None) -> np.ndarray:
+    """
+    Aggregates sorted candle rows (timestamp, open, high, low, close, volume[, spread]) into buckets of tf_ms
+    aligned on the epoch, like DataFrame.resample does for timeframes that divide a day. Only non-empty
+    buckets are returned. The spread of a bucket is the mean spread of its candles.
+    columns names the columns after the timestamp when data only holds a subset of them.
+    """
+    if columns is None:
+        columns = CANDLE_COLUMNS[:data.shape[1] - 1]
+
+    if data.shape[0] == 0:
+        return np.empty((0, data.shape[1]))
+
+    bucket_ts, starts, ends = _bucket_bounds(data[:, 0].astype(np.int64), tf_ms)
+
+    result = np.empty((starts.shape[0], data.shape[1]))
+    result[:, 0] = bucket_ts
+    for i, c in enumerate(columns, start=1):
+        result[:, i] = _aggregate_column(data[:, i], c, starts, ends)
+
+    return result
+
+
+def _bucket_bounds(timestamps: np.ndarray, tf_ms: int) -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Start time, first row and last row of every non-empty bucket of sorted int64 timestamps.
+    """
+    buckets = timestamps // tf_ms
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], timestamps.shape[0]] - 1
+    return buckets[starts] * tf_ms, starts, ends
+
+
+def _aggregate_column(column: np.ndarray, name: str, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    missing = np.isnan(column)
+    if missing.any():
+        # NaN candles are skipped like pandas does: first/last valid value, NaN when a bucket has none
+        return _aggregate_with_nan(column, missing, name, starts)
+
+    if starts.shape[0] == column.shape[0]:
+        # One candle per bucket
+        return column
+
+    if name == "open":
+        return column[starts]
+    if name == "high":
+        return np.maximum.reduceat(column, starts)
+    if name == "low":
+        return np.minimum.reduceat(column, starts)
+    if name == "close":
+        return column[ends]
+    if name == "volume":
+        return np.add.reduceat(column, starts)
+    if name == "spread":
+        return np.add.reduceat(column, starts) / (ends - starts + 1)
+
+    raise ValueError(f"No aggregation for column {name}")
+
+
+def _aggregate_with_nan(column: np.ndarray, missing: np.ndarray, name: str, starts: np.ndarray) -> np.ndarray:
+    positions = np.arange(column.shape[0])
+    counts = np.add.reduceat((~missing).astype(np.int64), starts)
+
+    if name == "open":
+        first = np.minimum.reduceat(np.where(missing, column.shape[0] - 1, positions), starts)
+        return np.where(counts > 0, column[first], np.nan)
+    if name == "close":
+        last = np.maximum.reduceat(np.where(missing, 0, positions), starts)
+        return np.where(counts > 0, column[last], np.nan)
+    if name == "high":
+        return np.fmax.reduceat(column, starts)
+    if name == "low":
+        return np.fmin.reduceat(column, starts)
+
+    total = np.add.reduceat(np.where(missing, 0.0, column), starts)
+    if name == "volume":
+        return total
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, total / counts, np.nan)
+
+
+def resample_chunks(chunks: typing.Iterable[np.ndarray], tf_ms: int,
+                    columns: typing.Optional[typing.List[str]] = None) -> typing.Generator[np.ndarray, None, None]:
+    """
+    Streaming aggregate_candles() over sorted blocks of candles (see Hdf5Client.iter_chunks). The rows of the
+    last bucket of a block are held back until the next block shows that bucket is complete, so memory stays
+    bounded by one block plus one bucket.
+    """
+    carry = None
+
+    for chunk in chunks:
+        if carry is not None and carry.shape[0]:
+            chunk = np.concatenate([carry, chunk])
+
+        if chunk.shape[0] == 0:
+            continue
+
+        last_bucket = chunk[-1, 0] - chunk[-1, 0] % tf_ms
+        split = np.searchsorted(chunk[:, 0], last_bucket, side="left")
+        carry = chunk[split:]
+
+        if split:
+            yield aggregate_candles(chunk[:split], tf_ms, columns)
+
+    if carry is not None and carry.shape[0]:
+        yield aggregate_candles(carry, tf_ms, columns)
+
+
+class BacktestMetrics(Structure):
+    """
+    Results of one backtest of the *_execute_batch functions, mirrors BacktestMetrics of backtestingCpp/Backtest.h.
+    """
+    _fields_ = [("pnl", c_double), ("max_dd", c_double), ("num_trades", c_int), ("sharpe_ratio", c_double),
+                ("cagr", c_double)]
+
+
+# Same layout as a NumPy dtype, for arrays of results passed to the library as BacktestMetrics pointers
+BACKTEST_METRICS_DTYPE = np.dtype([(name, np.int32 if c_type is c_int else np.float64)
+                                   for name, c_type in BacktestMetrics._fields_], align=True)
 
 
 def get_library():
@@ -68,9 +304,15 @@ def get_library():
     lib.Sma_new.restype = c_void_p
     lib.Sma_new.argtypes = [c_char_p, c_char_p, c_char_p, c_longlong, c_longlong]
 
+    lib.Sma_new_mapped.restype = c_void_p
+    lib.Sma_new_mapped.argtypes = [c_char_p]
+
     lib.Sma_execute_backtest.restype = c_void_p
     lib.Sma_execute_backtest.argtypes = [c_void_p, c_int, c_int]
 
+    lib.Sma_execute_batch.restype = None
+    lib.Sma_execute_batch.argtypes = [c_void_p, POINTER(c_double), c_int, POINTER(BacktestMetrics), c_int]
+
     lib.Sma_get_pnl.restype = c_double
     lib.Sma_get_pnl.argtypes = [c_void_p]
 
@@ -90,9 +332,15 @@ def get_library():
     lib.Psar_new.restype = c_void_p
     lib.Psar_new.argtypes = [c_char_p, c_char_p, c_char_p, c_longlong, c_longlong]
 
+    lib.Psar_new_mapped.restype = c_void_p
+    lib.Psar_new_mapped.argtypes = [c_char_p]
+
     lib.Psar_execute_backtest.restype = c_void_p
     lib.Psar_execute_backtest.argtypes = [c_void_p, c_double, c_double, c_double]
 
+    lib.Psar_execute_batch.restype = None
+    lib.Psar_execute_batch.argtypes = [c_void_p, POINTER(c_double), c_int, POINTER(BacktestMetrics), c_int]
+
     lib.Psar_get_pnl.restype = c_double
     lib.Psar_get_pnl.argtypes = [c_void_p]
 
@@ -112,9 +360,15 @@ def get_library():
     lib.Atr_new.restype = c_void_p
     lib.Atr_new.argtypes = [c_char_p, c_char_p, c_char_p, c_longlong, c_longlong]
 
+    lib.Atr_new_mapped.restype = c_void_p
+    lib.Atr_new_mapped.argtypes = [c_char_p]
+
     lib.Atr_execute_backtest.restype = c_void_p
     lib.Atr_execute_backtest.argtypes = [c_void_p, c_int, c_double]
 
+    lib.Atr_execute_batch.restype = None
+    lib.Atr_execute_batch.argtypes = [c_void_p, POINTER(c_double), c_int, POINTER(BacktestMetrics), c_int]
+
     lib.Atr_get_pnl.restype = c_double
     lib.Atr_get_pnl.argtypes = [c_void_p]
 
@@ -134,9 +388,15 @@ def get_library():
     lib.GradientPsar_new.restype = c_void_p
     lib.GradientPsar_new.argtypes = [c_char_p, c_char_p, c_char_p, c_longlong, c_longlong]
 
+    lib.GradientPsar_new_mapped.restype = c_void_p
+    lib.GradientPsar_new_mapped.argtypes = [c_char_p]
+
     lib.GradientPsar_execute_backtest.restype = c_void_p
     lib.GradientPsar_execute_backtest.argtypes = [c_void_p, c_double, c_double, c_double, c_double, c_int]
 
+    lib.GradientPsar_execute_batch.restype = None
+    lib.GradientPsar_execute_batch.argtypes = [c_void_p, POINTER(c_double), c_int, POINTER(BacktestMetrics), c_int]
+
     lib.GradientPsar_get_pnl.restype = c_double
     lib.GradientPsar_get_pnl.argtypes = [c_void_p]
 